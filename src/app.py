@@ -5,37 +5,86 @@ A super simple FastAPI application that allows students to view and sign up
 for extracurricular activities at Mergington High School.
 """
 
-from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import RedirectResponse
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, RedirectResponse
 import os
+import tempfile
 from pathlib import Path
-from backend import database
-from backend.routers import activities, auth
+
+# Several worker processes (MERGINGTON_WORKERS) share one dataset through a data
+# directory; without MERGINGTON_DATA_DIR they use a fresh temporary one
+if int(os.environ.get("MERGINGTON_WORKERS", "1")) > 1:
+    os.environ.setdefault("MERGINGTON_DATA_DIR", tempfile.mkdtemp(prefix="mergington-"))
+
+from backend import database, passwords
+from backend.assets import StaticAssets
+from backend.metrics import MetricsMiddleware
+from backend.routers import activities, auth, metrics
+
+@asynccontextmanager
+async def lifespan(app):
+    if database.storage is not None:
+        # Apply other workers' writes on the event loop, where requests read the collections
+        database.storage.bind_loop(asyncio.get_running_loop())
+    yield
+    # Stop the password hashing processes and flush storage with the server
+    passwords.shutdown_pool()
+    database.close_database()
 
 # Initialize web host
 app = FastAPI(
     title="Mergington High School API",
-    description="API for viewing and signing up for extracurricular activities"
+    description="API for viewing and signing up for extracurricular activities",
+    lifespan=lifespan
 )
 
+# Ask clients to retry later instead of queueing unbounded password hashing work
+@app.exception_handler(passwords.PasswordHashingBusy)
+def password_hashing_busy(request: Request, exc: passwords.PasswordHashingBusy):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server is busy, please try again shortly"},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
 # Initialize database with sample data if empty
 database.init_database()
 
-# Mount the static files directory for serving the frontend
+# With several workers, apply the other workers' writes before handling each request
+if database.storage is not None and database.storage.shared:
+    @app.middleware("http")
+    async def catch_up_with_other_workers(request: Request, call_next):
+        if database.storage.has_new_records():
+            database.storage.catch_up()
+        return await call_next(request)
+
+# Record per-route request metrics for GET /metrics
+app.add_middleware(MetricsMiddleware)
+
+# Serve the frontend minified, precompressed and with fingerprinted, long-cached names
 current_dir = Path(__file__).parent
-app.mount("/static", StaticFiles(directory=os.path.join(current_dir, "static")), name="static")
+app.mount("/static", StaticAssets(
+    os.path.join(current_dir, "static"),
+    reload=os.environ.get("MERGINGTON_STATIC_RELOAD", "").lower() in ("1", "true", "yes")
+), name="static")
 
 # Root endpoint to redirect to static index.html
 @app.get("/")
-def root():
+async def root():
     return RedirectResponse(url="/static/index.html")
 
 # Include routers
 app.include_router(activities.router)
 app.include_router(auth.router)
+app.include_router(metrics.router)
 
 # Run the application
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=8000)
+    if database.WORKERS > 1:
+        # Worker processes import the app by name
+        uvicorn.run("app:app", host="127.0.0.1", port=8000, workers=database.WORKERS)
+    else:
+        uvicorn.run(app, host="127.0.0.1", port=8000)
@@ -0,0 +1,325 @@
+"""
+Aggregation pipelines for the in-memory collections
+
+Stages are chained generators, so documents stream through the pipeline one
+at a time: $match, $unwind, $project, $skip and $limit never hold more than
+the current document, $group holds one accumulator per group and $sort
+followed by $limit keeps only the top documents in a heap.
+
+A leading $match is handed to the collection's find(), so it is answered
+from secondary indexes when possible.
+"""
+
+import heapq
+from itertools import islice
+
+from .indexes import get_field, MISSING
+from .participants import ParticipantList
+
+
+# Expressions
+
+_COMPARISONS = {
+    '$eq': lambda a, b: a == b,
+    '$ne': lambda a, b: a != b,
+    '$lt': lambda a, b: a < b,
+    '$lte': lambda a, b: a <= b,
+    '$gt': lambda a, b: a > b,
+    '$gte': lambda a, b: a >= b,
+}
+
+_ARITHMETIC = {
+    '$add': lambda a, b: a + b,
+    '$subtract': lambda a, b: a - b,
+    '$multiply': lambda a, b: a * b,
+    '$divide': lambda a, b: a / b if b else None,
+}
+
+
+def evaluate_expression(doc, expression):
+    """Evaluate an aggregation expression against a document
+
+    Supports "$field.path" references, literals, sub-documents of
+    expressions, $size, $ifNull, comparisons and arithmetic. Missing
+    fields evaluate to None.
+    """
+    if isinstance(expression, str):
+        if expression.startswith('$'):
+            value = get_field(doc, expression[1:])
+            return None if value is MISSING else value
+        return expression
+    if isinstance(expression, dict):
+        if len(expression) == 1:
+            operator, operand = next(iter(expression.items()))
+            if operator.startswith('$'):
+                return _evaluate_operator(doc, operator, operand)
+        return {field: evaluate_expression(doc, value) for field, value in expression.items()}
+    if isinstance(expression, list):
+        return [evaluate_expression(doc, item) for item in expression]
+    return expression
+
+
+def _evaluate_operator(doc, operator, operand):
+    if operator == '$literal':
+        return operand
+    if operator == '$size':
+        value = evaluate_expression(doc, operand)
+        return len(value) if value is not None else 0
+    if operator == '$ifNull':
+        value, default = (evaluate_expression(doc, item) for item in operand)
+        return default if value is None else value
+    if operator in _COMPARISONS:
+        left, right = (evaluate_expression(doc, item) for item in operand)
+        if left is None or right is None:
+            return False
+        return _COMPARISONS[operator](left, right)
+    if operator in _ARITHMETIC:
+        values = [evaluate_expression(doc, item) for item in operand]
+        if any(value is None for value in values):
+            return None
+        result = values[0]
+        for value in values[1:]:
+            result = _ARITHMETIC[operator](result, value)
+            if result is None:
+                return None
+        return result
+    raise ValueError(f"Unsupported expression operator: {operator}")
+
+
+# Accumulators for $group, as (initial state, add value, final result)
+
+def _sum_add(state, value):
+    return state + value if isinstance(value, (int, float)) else state
+
+def _avg_add(state, value):
+    if isinstance(value, (int, float)):
+        return (state[0] + value, state[1] + 1)
+    return state
+
+def _min_add(state, value):
+    return value if value is not None and (state is None or value < state) else state
+
+def _max_add(state, value):
+    return value if value is not None and (state is None or value > state) else state
+
+def _push_add(state, value):
+    state.append(value)
+    return state
+
+def _add_to_set_add(state, value):
+    key = repr(value)
+    if key not in state:
+        state[key] = value
+    return state
+
+_ACCUMULATORS = {
+    '$sum': (lambda: 0, _sum_add, lambda state: state),
+    '$count': (lambda: 0, lambda state, value: state + 1, lambda state: state),
+    '$avg': (lambda: (0, 0), _avg_add, lambda state: state[0] / state[1] if state[1] else None),
+    '$min': (lambda: None, _min_add, lambda state: state),
+    '$max': (lambda: None, _max_add, lambda state: state),
+    '$push': (list, _push_add, lambda state: state),
+    '$addToSet': (dict, _add_to_set_add, lambda state: list(state.values())),
+    '$first': (lambda: MISSING, lambda state, value: value if state is MISSING else state,
+               lambda state: None if state is MISSING else state),
+    '$last': (lambda: MISSING, lambda state, value: value,
+              lambda state: None if state is MISSING else state),
+}
+
+
+# Stages
+
+def _with_field(doc, path, value):
+    """Shallow copy of doc with value set at a dotted path (copying along the path)"""
+    parts = path.split('.')
+    result = dict(doc)
+    target = result
+    for part in parts[:-1]:
+        child = target.get(part)
+        child = dict(child) if isinstance(child, dict) else {}
+        target[part] = child
+        target = child
+    target[parts[-1]] = value
+    return result
+
+
+def _assign(doc, path, value):
+    """Set a value at a dotted path of a document being built, in place"""
+    parts = path.split('.')
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def _unwind(documents, spec):
+    if isinstance(spec, str):
+        spec = {'path': spec}
+    path = spec['path'][1:]
+    preserve = spec.get('preserveNullAndEmptyArrays', False)
+    for doc in documents:
+        value = get_field(doc, path)
+        if isinstance(value, (list, tuple, ParticipantList)):
+            emitted = False
+            for item in value:
+                emitted = True
+                yield _with_field(doc, path, item)
+            if not emitted and preserve:
+                yield _without_field(doc, path)
+        elif value is MISSING or value is None:
+            if preserve:
+                yield doc
+        else:
+            yield doc
+
+
+def _without_field(doc, path):
+    parts = path.split('.')
+    if len(parts) == 1:
+        return {field: value for field, value in doc.items() if field != path}
+    return _with_field(doc, '.'.join(parts[:-1]), {
+        field: value for field, value in get_field(doc, '.'.join(parts[:-1])).items()
+        if field != parts[-1]
+    })
+
+
+def _group_key(value):
+    """Hashable form of a group _id"""
+    if isinstance(value, dict):
+        return tuple((field, _group_key(item)) for field, item in value.items())
+    if isinstance(value, list):
+        return tuple(_group_key(item) for item in value)
+    return value
+
+
+def _group(documents, spec):
+    id_expression = spec['_id']
+    fields = []
+    for field, accumulator in spec.items():
+        if field == '_id':
+            continue
+        (operator, expression), = accumulator.items()
+        if operator not in _ACCUMULATORS:
+            raise ValueError(f"Unsupported accumulator: {operator}")
+        fields.append((field, expression, _ACCUMULATORS[operator]))
+
+    groups = {}
+    for doc in documents:
+        group_id = evaluate_expression(doc, id_expression)
+        key = _group_key(group_id)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = [group_id, [initial() for _, _, (initial, _, _) in fields]]
+        states = group[1]
+        for position, (_, expression, (_, add, _)) in enumerate(fields):
+            states[position] = add(states[position], evaluate_expression(doc, expression))
+
+    for group_id, states in groups.values():
+        result = {'_id': group_id}
+        for position, (field, _, (_, _, final)) in enumerate(fields):
+            result[field] = final(states[position])
+        yield result
+
+
+def _project(documents, spec):
+    include_id = spec.get('_id', 1)
+    fields = {field: value for field, value in spec.items() if field != '_id'}
+    exclude = all(value in (0, False) for value in fields.values())
+    for doc in documents:
+        if exclude:
+            result = doc
+            for field in fields:
+                result = _without_field(result, field) if get_field(result, field) is not MISSING else result
+            if not include_id:
+                result = {field: value for field, value in result.items() if field != '_id'}
+            yield result
+            continue
+        result = {}
+        if include_id and '_id' in doc:
+            result['_id'] = doc['_id']
+        for field, value in fields.items():
+            if value in (1, True):
+                field_value = get_field(doc, field)
+                if field_value is MISSING:
+                    continue
+            else:
+                field_value = evaluate_expression(doc, value)
+            _assign(result, field, field_value)
+        yield result
+
+
+def _sort_key(spec):
+    def key(doc):
+        values = []
+        for field, direction in spec.items():
+            value = get_field(doc, field)
+            values.append(_Ordered((0, None) if value is MISSING or value is None else (1, value), direction))
+        return values
+    return key
+
+
+class _Ordered:
+    """Sort key wrapper that reverses comparison for descending fields"""
+
+    __slots__ = ('value', 'direction')
+
+    def __init__(self, value, direction):
+        self.value = value
+        self.direction = direction
+
+    def __lt__(self, other):
+        if self.direction >= 0:
+            return self.value < other.value
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+def _sort(documents, spec, limit=None):
+    key = _sort_key(spec)
+    if limit is not None:
+        # Bounded memory: keep only the first `limit` documents
+        return iter(heapq.nsmallest(limit, documents, key=key))
+    return iter(sorted(documents, key=key))
+
+
+def run_pipeline(collection, pipeline):
+    """Run an aggregation pipeline over a collection, yielding result documents"""
+    from .query import compile_query  # query.py evaluates $expr with this module
+
+    stages = list(pipeline)
+
+    # Push leading $match stages down into the collection's query planner
+    query = {}
+    while stages and '$match' in stages[0] and not (set(stages[0]['$match']) & set(query)):
+        query.update(stages.pop(0)['$match'])
+    # Counted as an 'aggregate' operation in the collection's metrics
+    documents = collection._find(query, None, None, 0, 0, True, 'aggregate')
+
+    position = 0
+    while position < len(stages):
+        (operator, spec), = stages[position].items()
+        position += 1
+        if operator == '$match':
+            matches = compile_query(spec)
+            documents = (doc for doc in documents if matches(doc))
+        elif operator == '$unwind':
+            documents = _unwind(documents, spec)
+        elif operator == '$group':
+            documents = _group(documents, spec)
+        elif operator == '$project':
+            documents = _project(documents, spec)
+        elif operator == '$sort':
+            limit = None
+            if position < len(stages) and '$limit' in stages[position]:
+                limit = stages[position]['$limit']
+            documents = _sort(documents, spec, limit)
+        elif operator == '$skip':
+            documents = islice(documents, spec, None)
+        elif operator == '$limit':
+            documents = islice(documents, spec)
+        elif operator == '$count':
+            documents = iter([{spec: sum(1 for _ in documents)}])
+        else:
+            raise ValueError(f"Unsupported pipeline stage: {operator}")
+    return documents
@@ -0,0 +1,406 @@
+"""
+Static asset pipeline: minified, precompressed, fingerprinted files
+
+At startup StaticAssets reads the static directory once and, in memory:
+
+- minifies JavaScript, CSS and HTML (comments and indentation are removed;
+  line breaks are kept, so statement boundaries in JavaScript are unchanged)
+- gives every asset except HTML pages a fingerprinted name holding a hash of
+  its content (app.js -> app.3f2c9a1b.js) and rewrites the src/href
+  references in the pages to those names
+- precomputes gzip and, if the optional brotli package is installed, brotli
+  variants of compressible assets
+
+Fingerprinted names never change content, so they are served with
+"Cache-Control: public, max-age=31536000, immutable". Pages and the original
+names are served with "no-cache" and an ETag, so browsers revalidate them
+cheaply. Each response uses the best encoding the client accepts
+(Accept-Encoding), with "Vary: Accept-Encoding".
+
+Set MERGINGTON_STATIC_RELOAD=1 while editing the frontend to rebuild when a
+source file changes. write() builds the same files ahead of time instead,
+for serving from a CDN.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+import time
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+# Encodings in order of preference when the client accepts several
+ENCODINGS = ("br", "gzip")
+
+
+# Minifiers: each skips over strings (and comments) with a small scanner, so
+# their contents are never altered
+
+_JS_TIGHT = set("{}();,:=<>!&|?[]")
+# Tokens after which a / starts a regular expression rather than a division
+_REGEX_AFTER = set("(,=:[!&|?{};+-*%<>~^") | {
+    "return", "typeof", "case", "in", "of", "throw", "else", "void",
+    "await", "yield", "delete", "instanceof", "do",
+}
+# A trailing identifier, with the dot if it is a property (an operand even if named like a keyword)
+_WORD_AT_END = re.compile(r"\.?[\w$]+$")
+
+
+def minify_js(source):
+    """Remove comments, indentation and blank lines, and spaces next to punctuation"""
+    out = []
+    i, length = 0, len(source)
+    # One entry per open template literal: the brace depth of its current ${...}, or None
+    templates = []
+    depth = 0
+
+    def last():
+        return out[-1][-1] if out and out[-1] else ""
+
+    def previous_token():
+        # The last word, ++ or --, or else character, output other than whitespace
+        # ("(" at the start)
+        tail = ""
+        for text in reversed(out):
+            tail = text + tail
+            stripped = tail.rstrip()
+            word = _WORD_AT_END.search(stripped)
+            if len(stripped) > 1 and (word is None or word.start() > 0):
+                break
+        stripped = tail.rstrip()
+        if not stripped:
+            return "("
+        if stripped.endswith(("++", "--")):
+            # Postfix (a prefix ++ or -- cannot come before a regular expression)
+            return stripped[-2:]
+        word = _WORD_AT_END.search(stripped)
+        return word.group() if word else stripped[-1]
+
+    def regex_end(start):
+        # Index after the regular expression literal at start, or None if there is
+        # none: a literal cannot span lines
+        end, in_class = start + 1, False
+        while end < length and (source[end] != "/" or in_class):
+            if source[end] == "\\":
+                end += 1
+            elif source[end] == "[":
+                in_class = True
+            elif source[end] == "]":
+                in_class = False
+            elif source[end] == "\n":
+                return None
+            end += 1
+        return end + 1 if end < length else None
+
+    def copy_string(start, quote):
+        end = start + 1
+        while end < length and source[end] != quote:
+            end += 2 if source[end] == "\\" else 1
+        return end + 1
+
+    while i < length:
+        char = source[i]
+        if templates and templates[-1] is None:
+            # Inside a template literal's text
+            start = i
+            while i < length and source[i] != "`" and not source.startswith("${", i):
+                i += 2 if source[i] == "\\" else 1
+            out.append(source[start:i])
+            if source.startswith("${", i):
+                out.append("${")
+                templates[-1] = depth
+                depth += 1
+                i += 2
+            else:
+                out.append("`")
+                templates.pop()
+                i += 1
+            continue
+        if char in "'\"":
+            end = copy_string(i, char)
+            out.append(source[i:end])
+            i = end
+        elif char == "`":
+            out.append("`")
+            templates.append(None)
+            i += 1
+        elif source.startswith("//", i):
+            while i < length and source[i] != "\n":
+                i += 1
+        elif source.startswith("/*", i):
+            end = source.find("*/", i + 2)
+            i = length if end < 0 else end + 2
+        elif char == "/" and previous_token() in _REGEX_AFTER:
+            # A regular expression literal (a / after an operand is a division)
+            end = regex_end(i)
+            if end is None:
+                # Not one after all: output the / alone
+                end = i + 1
+            out.append(source[i:end])
+            i = end
+        elif char in " \t\r\n":
+            start = i
+            while i < length and source[i] in " \t\r\n":
+                i += 1
+            newline = "\n" in source[start:i]
+            previous = last()
+            following = source[i] if i < length else ""
+            if previous in ("", "\n") or not following:
+                continue
+            if newline:
+                out.append("\n")
+            elif previous not in _JS_TIGHT and following not in _JS_TIGHT:
+                out.append(" ")
+        else:
+            if char in "{}":
+                if templates and templates[-1] is not None:
+                    if char == "{":
+                        depth += 1
+                    else:
+                        depth -= 1
+                        if depth == templates[-1]:
+                            # End of a ${...}: back to the template text
+                            out.append("}")
+                            templates[-1] = None
+                            i += 1
+                            continue
+            if char in _JS_TIGHT and last() == " ":
+                out[-1] = out[-1][:-1]
+            out.append(char)
+            i += 1
+    return "".join(out).strip() + "\n"
+
+
+_CSS_TIGHT = set("{};,>")
+
+
+def minify_css(source):
+    """Remove comments and collapse whitespace outside strings"""
+    out = []
+    i, length = 0, len(source)
+    while i < length:
+        char = source[i]
+        if char in "'\"":
+            end = i + 1
+            while end < length and source[end] != char:
+                end += 2 if source[end] == "\\" else 1
+            out.append(source[i:end + 1])
+            i = end + 1
+        elif source.startswith("/*", i):
+            end = source.find("*/", i + 2)
+            i = length if end < 0 else end + 2
+        elif char in " \t\r\n":
+            while i < length and source[i] in " \t\r\n":
+                i += 1
+            if out and i < length and out[-1][-1] not in _CSS_TIGHT and source[i] not in _CSS_TIGHT:
+                out.append(" ")
+        else:
+            if char == "}" and out and out[-1] == ";":
+                out.pop()
+            out.append(char)
+            i += 1
+    return "".join(out).strip() + "\n"
+
+
+_HTML_COMMENT = re.compile(r"<!--(?!\[if).*?-->", re.DOTALL)
+_HTML_RAW = re.compile(r"(<(pre|textarea|script|style)\b.*?</\2>)", re.DOTALL | re.IGNORECASE)
+
+
+def minify_html(source):
+    """Remove comments, indentation and blank lines (except in pre, textarea, script and style)"""
+    parts = _HTML_RAW.split(_HTML_COMMENT.sub("", source))
+    out = []
+    # split() yields text, then (raw element, tag name) pairs
+    for position in range(0, len(parts), 3):
+        lines = (line.strip() for line in parts[position].splitlines())
+        text = "\n".join(line for line in lines if line)
+        if text:
+            out.append(text)
+        if position + 1 < len(parts):
+            out.append(parts[position + 1])
+    return "\n".join(out) + "\n"
+
+
+MINIFIERS = {".js": minify_js, ".css": minify_css, ".html": minify_html}
+
+_REFERENCE = re.compile(r'\b(src|href)="([^"#?:]+)"')
+
+
+class Asset:
+    """One servable file: its encoded variants and caching policy"""
+
+    __slots__ = ('content_type', 'variants', 'etag', 'cache_control')
+
+    def __init__(self, content, content_type, cache_control):
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.etag = '"' + hashlib.sha256(content).hexdigest()[:20] + '"'
+        self.variants = {"identity": content}
+        if content_type.startswith(COMPRESSIBLE_TYPES):
+            compressed = {"gzip": gzip.compress(content, 9, mtime=0)}
+            if brotli is not None:
+                compressed["br"] = brotli.compress(content, quality=11)
+            for encoding, body in compressed.items():
+                if len(body) < len(content):
+                    self.variants[encoding] = body
+
+
+def fingerprinted_name(name, content):
+    """app.js -> app.<hash>.js"""
+    stem, extension = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(content).hexdigest()[:8]}{extension}"
+
+
+def build(directory):
+    """Build every asset of a directory: {url path (relative): Asset}, plus {name: fingerprinted name}"""
+    sources = {}
+    for root, _, files in os.walk(directory):
+        for file_name in files:
+            path = os.path.join(root, file_name)
+            name = os.path.relpath(path, directory).replace(os.sep, "/")
+            with open(path, "rb") as source_file:
+                sources[name] = source_file.read()
+
+    contents = {}
+    for name, content in sources.items():
+        minify = MINIFIERS.get(os.path.splitext(name)[1])
+        contents[name] = minify(content.decode("utf-8")).encode("utf-8") if minify else content
+
+    # Pages reference the others, so they are rewritten once those have their names
+    pages = [name for name in contents if name.endswith(".html")]
+    manifest = {name: fingerprinted_name(name, content) for name, content in contents.items() if name not in pages}
+    for name in pages:
+        base = os.path.dirname(name)
+
+        def rewrite(match):
+            target = os.path.normpath(os.path.join(base, match.group(2))).replace(os.sep, "/")
+            if target not in manifest:
+                return match.group(0)
+            return f'{match.group(1)}="{os.path.relpath(manifest[target], base or ".").replace(os.sep, "/")}"'
+        contents[name] = _REFERENCE.sub(rewrite, contents[name].decode("utf-8")).encode("utf-8")
+
+    assets = {}
+    for name, content in contents.items():
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        if content_type.startswith("text/") or content_type == "application/javascript":
+            content_type += "; charset=utf-8"
+        assets[name] = Asset(content, content_type, REVALIDATE)
+        if name in manifest:
+            assets[manifest[name]] = Asset(content, content_type, IMMUTABLE)
+    return assets, manifest
+
+
+def choose_encoding(accept_encoding, variants):
+    """The preferred variant the client accepts ("identity" if none)"""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        coding, _, parameters = item.strip().partition(";")
+        quality = 1.0
+        if parameters.strip().startswith("q="):
+            try:
+                quality = float(parameters.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    for encoding in ENCODINGS:
+        if encoding in variants and accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return "identity"
+
+
+class StaticAssets:
+    """ASGI app serving a built static directory, mounted in place of StaticFiles"""
+
+    def __init__(self, directory, reload=False):
+        self.directory = directory
+        self.reload = reload
+        self.assets, self.manifest = build(directory)
+        self._built_at = time.monotonic()
+        self._mtime = self._latest_mtime()
+        self._lock = threading.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if self.reload:
+            self._rebuild_if_changed()
+        root_path = scope.get("root_path", "")
+        path = scope["path"][len(root_path):] if scope["path"].startswith(root_path) else scope["path"]
+        asset = self.assets.get(path.lstrip("/") or "index.html")
+
+        if scope["method"] not in ("GET", "HEAD"):
+            await _respond(send, 405, [(b"allow", b"GET, HEAD")], b"Method Not Allowed")
+            return
+        if asset is None:
+            await _respond(send, 404, [], b"Not Found")
+            return
+
+        headers = dict(_request_headers(scope))
+        encoding = choose_encoding(headers.get("accept-encoding", ""), asset.variants)
+        etag = asset.etag if encoding == "identity" else f'{asset.etag[:-1]}-{encoding}"'
+        response_headers = [
+            (b"cache-control", asset.cache_control.encode()),
+            (b"etag", etag.encode()),
+            (b"vary", b"Accept-Encoding"),
+        ]
+        if etag in _etags(headers.get("if-none-match", "")):
+            await _respond(send, 304, response_headers, b"")
+            return
+
+        body = asset.variants[encoding]
+        response_headers.append((b"content-type", asset.content_type.encode()))
+        if encoding != "identity":
+            response_headers.append((b"content-encoding", encoding.encode()))
+        await _respond(send, 200, response_headers, body, head=scope["method"] == "HEAD")
+
+    def _latest_mtime(self):
+        return max((os.path.getmtime(os.path.join(root, name))
+                    for root, _, files in os.walk(self.directory) for name in files), default=0)
+
+    def _rebuild_if_changed(self):
+        # Check the sources at most once a second
+        if time.monotonic() - self._built_at < 1:
+            return
+        with self._lock:
+            self._built_at = time.monotonic()
+            mtime = self._latest_mtime()
+            if mtime != self._mtime:
+                self.assets, self.manifest = build(self.directory)
+                self._mtime = mtime
+
+
+def _request_headers(scope):
+    for name, value in scope["headers"]:
+        yield name.decode("latin-1"), value.decode("latin-1")
+
+
+def _etags(if_none_match):
+    return {tag.strip().removeprefix("W/") for tag in if_none_match.split(",") if tag.strip()}
+
+
+async def _respond(send, status, headers, body, head=False):
+    headers = headers + [(b"content-length", str(len(body)).encode())]
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": b"" if head else body})
+
+
+def write(directory, output):
+    """Build a directory's assets into output, with .gz and .br files beside each compressible one"""
+    assets, manifest = build(directory)
+    for name, asset in assets.items():
+        path = os.path.join(output, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        for encoding, suffix in (("identity", ""), ("gzip", ".gz"), ("br", ".br")):
+            if encoding in asset.variants:
+                with open(path + suffix, "wb") as output_file:
+                    output_file.write(asset.variants[encoding])
+    return manifest
+
@@ -0,0 +1,72 @@
+"""
+Async API over the in-memory collections for async endpoints
+
+Sync endpoints run on anyio's worker thread pool, which caps a worker at
+about 40 requests in flight however cheap each one is. Async endpoints run on
+the event loop instead, so they must never block it. AsyncCollection makes
+that explicit:
+
+- reads only touch memory, so they run inline
+- writes are applied in memory under the collection's lock (held for
+  microseconds), then wait for the write-ahead log with
+  StorageEngine.wait_async() rather than blocking on an fsync
+- with shared storage (several worker processes) a write waits for a
+  cross-process lock and fsyncs before releasing it; those steps run on a
+  thread, while the write itself is applied on the event loop (see
+  StorageEngine.writing_async), so reads never race with it
+
+Password hashing, the other blocking work, already runs on a process pool
+(see passwords.py).
+"""
+
+
+class AsyncCollection:
+    """Coroutine methods mirroring an InMemoryCollection"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    @property
+    def version(self):
+        return self.collection.version
+
+    # Reads
+
+    async def find(self, query=None, projection=None, sort=None, skip=0, limit=0, view=False):
+        """List of the documents matching query (see InMemoryCollection.find)"""
+        return list(self.collection.find(query, projection, sort, skip, limit, view))
+
+    async def find_one(self, query, view=False):
+        return self.collection.find_one(query, view)
+
+    async def aggregate(self, pipeline):
+        """List of the results of an aggregation pipeline"""
+        return list(self.collection.aggregate(pipeline))
+
+    # Writes
+
+    async def update_one(self, query, update):
+        return await self._write(self.collection._update_one, query, update)
+
+    async def update_many(self, query, update):
+        return await self._write(self.collection._update_many, query, update)
+
+    async def insert_one(self, document):
+        return await self._write(self.collection._insert_one, document)
+
+    async def insert_many(self, documents):
+        return await self._write(self.collection._insert_many, documents)
+
+    async def bulk_write(self, requests):
+        return await self._write(self.collection._bulk_write, requests)
+
+    async def _write(self, method, *args):
+        storage = self.collection.storage
+        if storage is not None and storage.shared:
+            async with storage.writing_async():
+                result, lsn = method(*args)
+        else:
+            result, lsn = method(*args)
+        if lsn:
+            await storage.wait_async(lsn)
+        return result
@@ -0,0 +1,84 @@
+"""
+Response cache for read-heavy endpoints
+
+Responses are cached as already-encoded JSON bytes, keyed by the endpoint
+and its normalized parameters. Each entry remembers the collection version it
+was built from; InMemoryCollection bumps its version on every write, so a
+stale entry is simply rebuilt on the next request instead of being
+invalidated explicitly.
+
+Every cached response carries an ETag, and a request whose If-None-Match
+matches it gets an empty 304 Not Modified.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+from fastapi import Request
+from fastapi.responses import Response
+
+
+class CachedResponse:
+    __slots__ = ('version', 'body', 'etag', 'headers')
+
+    def __init__(self, version, body, headers):
+        self.version = version
+        self.body = body
+        self.etag = '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+        self.headers = headers
+
+
+class ResponseCache:
+    """Least-recently-used cache of encoded responses"""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version, build):
+        """Return the entry for key, calling build() -> (body, headers) if missing or stale"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.version == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        body, headers = build()
+        entry = CachedResponse(version, body, headers)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether the request's If-None-Match header covers etag"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def cached_json_response(request: Request, cache: ResponseCache, key, version, build) -> Response:
+    """Serve a JSON response from cache, answering conditional requests with 304"""
+    entry = cache.get(key, version, build)
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache", **entry.headers}
+    if etag_matches(request, entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
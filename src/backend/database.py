@@ -1,189 +1,879 @@
 """
 In-memory database configuration for Mergington High School API
-All data is stored in memory and will be reset when the server restarts.
+All data is stored in memory. It is reset when the server restarts unless
+MERGINGTON_DATA_DIR names a directory to persist it in (see storage.py).
 """
 
-from argon2 import PasswordHasher
+import copy
+import hashlib
+import heapq
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from itertools import count, islice
+
+from .aggregation import run_pipeline
+from .async_collection import AsyncCollection
+from .documents import DocumentView, copy_document
+from .events import OccupancyStream
+from .indexes import INDEX_TYPES, get_field, MISSING
+from .metrics import CollectionStats, registry
+from .participants import MembershipIndex, ParticipantList, normalize_participants
+from .query import compile_query, query_shape
+from .records import compact_activity
+from .schedule import ScheduleIndex, normalize_schedule
+from .search import SearchIndex
+from .slowlog import slow_operations
+from .storage import StorageEngine
+from .ttl import TTLStore
 
 # Use in-memory storage instead of MongoDB
 activities_data = {}
 teachers_data = {}
 students_data = {}
-password_reset_tokens = {}  # Store password reset tokens temporarily
+# Password reset tokens, valid for an hour, at most 3 per student. They are kept
+# (as SHA-256 hashes) in the student's document, so every worker process sees
+# them through the shared log, and indexed by hash in password_reset_tokens,
+# which a students collection listener keeps in step
+RESET_TOKEN_SECONDS = 3600
+RESET_TOKENS_PER_STUDENT = 3
+password_reset_tokens = TTLStore(ttl=RESET_TOKEN_SECONDS, max_entries=10000, max_per_owner=RESET_TOKENS_PER_STUDENT)
 
 # Simple in-memory collections simulation
 class InMemoryCollection:
-    def __init__(self, data_dict):
+    def __init__(self, data_dict, normalize=None, name=None):
         self.data = data_dict
+        # Called on every inserted (or $set-updated) document to fix up its representation;
+        # returns the document to store, which for updates must be the same object
+        self.normalize = normalize
+        self.indexes = {}
+        self.listeners = []
+        # Storage engine persisting this collection (see storage.py), if any
+        self.storage = None
+        self.name = name
+        # Serializes writes, so indexes, the log and snapshots see them in order
+        self._lock = threading.RLock()
+        # Bumped on every write, so cached results can tell they are stale
+        self.version = 0
+        # Operation counters reported by GET /metrics
+        self.stats = CollectionStats()
+        # Insertion order of each key, so indexed results keep document order
+        self._positions = {}
+        self._next_position = 0
+        # While a snapshot is encoded: key -> document as it was when the snapshot started
+        self._preserved = None
+        for key in self.data:
+            self._assign_position(key)
+    
+    def create_index(self, field, kind="hash"):
+        """Create a secondary index on a (dotted) field path"""
+        index = INDEX_TYPES[kind](field)
+        for key, value in self.data.items():
+            index.add(key, value)
+        self.indexes[field] = index
+        return field
+    
+    def subscribe(self, listener):
+        """Call listener(operation, key, doc, update) after each insert or update"""
+        self.listeners.append(listener)
+    
+    def find(self, query=None, projection=None, sort=None, skip=0, limit=0, view=False):
+        """Find documents matching query
+        
+        - projection: {"field": 1, ...} to include or {"field": 0, ...} to exclude fields
+        - sort: list of (field, direction) pairs, direction 1 or -1
+        - skip/limit: page through the (sorted) results; limit=0 means no limit
+        
+        With view=True documents are returned as read-only DocumentViews that
+        share storage with the collection instead of being copied.
+        
+        Returns a Cursor: iterate it for the documents, or call its explain().
+        """
+        return Cursor(self, query, projection, sort, skip, limit, view)
     
-    def find(self, query=None):
-        """Find documents matching query"""
+    def _find(self, query, projection, sort, skip, limit, view, operation, explain=None):
+        """Generator behind find() and aggregate(); fills in explain (a dict) if given"""
+        started = time.perf_counter()
+        # Counts the documents examined: each one pulled from the candidates advances it
+        scanned = None
         if not query:
             # Return all documents with _id as the key
-            for key, value in self.data.items():
-                doc = value.copy()
-                doc['_id'] = key
-                yield doc
+            plan = {'stage': 'COLLSCAN'}
+            items = self.data.items()
         else:
-            # Simple query implementation
-            for key, value in self.data.items():
-                if self._matches_query(value, query):
-                    doc = value.copy()
-                    doc['_id'] = key
-                    yield doc
-    
-    def find_one(self, query):
+            scanned = count()
+            matches = compile_query(query)
+            plan, candidates = self._plan(query)
+            items = (
+                (key, value) for (key, value), _ in zip(candidates, scanned)
+                if matches(value, key)
+            )
+        
+        if sort:
+            items = self._sort(items, sort, skip + limit if limit else None)
+        if skip or limit:
+            items = islice(items, skip, skip + limit if limit else None)
+        
+        returned = 0
+        copies = not view or bool(projection)
+        try:
+            for key, value in items:
+                returned += 1
+                if projection:
+                    yield self._project(key, value, projection)
+                else:
+                    yield self._document(key, value, view)
+        finally:
+            if scanned is None:
+                # Unfiltered: a sort reads every document, otherwise only up to the last one returned
+                examined = len(self.data) if sort else min(len(self.data), skip + returned)
+            else:
+                examined = next(scanned)
+            self.stats.record(operation, examined, returned, returned if copies else 0)
+            if explain is not None:
+                explain.update(plan=plan, documents_examined=examined, documents_returned=returned)
+            elif operation == 'find':
+                # aggregate() times the whole pipeline itself
+                self._check_slow('find', query, started)
+    
+    def find_one(self, query, view=False):
         """Find one document matching query"""
-        if isinstance(query, dict) and '_id' in query:
-            # Direct lookup by _id
-            key = query['_id']
-            if key in self.data:
-                doc = self.data[key].copy()
-                doc['_id'] = key
-                return doc
+        started = time.perf_counter()
+        key, scanned = self._find_key(query)
+        self._check_slow('find_one', query, started)
+        if key is None:
+            self.stats.record('find_one', scanned)
             return None
-        
-        # Search through documents
-        for doc in self.find(query):
-            return doc
-        return None
+        self.stats.record('find_one', scanned, 1, 0 if view else 1)
+        return self._document(key, self.data[key], view)
     
     def update_one(self, query, update):
-        """Update one document"""
-        if isinstance(query, dict) and '_id' in query:
-            key = query['_id']
-            if key in self.data:
-                if '$push' in update:
-                    for field, value in update['$push'].items():
-                        if field in self.data[key]:
-                            self.data[key][field].append(value)
-                        else:
-                            self.data[key][field] = [value]
-                elif '$pull' in update:
-                    for field, value in update['$pull'].items():
-                        if field in self.data[key] and value in self.data[key][field]:
-                            self.data[key][field].remove(value)
-                elif '$set' in update:
-                    for field, value in update['$set'].items():
-                        self.data[key][field] = value
-                return type('UpdateResult', (), {'modified_count': 1})()
-        return type('UpdateResult', (), {'modified_count': 0})()
+        """Update one document
+        
+        The query is evaluated and the update applied under the collection's
+        write lock, so conditional updates such as
+        {"_id": name, "$expr": {"$lt": [{"$size": "$participants"}, "$max_participants"]}}
+        combined with $addToSet are atomic with respect to concurrent writers.
+        """
+        result, lsn = self._update_one(query, update)
+        self._wait_durable(lsn)
+        return result
+    
+    def update_many(self, query, update):
+        """Update every document matching query"""
+        result, lsn = self._update_many(query, update)
+        self._wait_durable(lsn)
+        return result
     
     def insert_one(self, document):
         """Insert a new document"""
-        if '_id' in document:
-            key = document['_id']
-            doc = document.copy()
-            del doc['_id']
-            self.data[key] = doc
-            return type('InsertResult', (), {'inserted_id': key})()
-        return None
+        result, lsn = self._insert_one(document)
+        self._wait_durable(lsn)
+        return result
+    
+    def insert_many(self, documents):
+        """Insert several documents with a single log write"""
+        result, lsn = self._insert_many(documents)
+        self._wait_durable(lsn)
+        return result
+    
+    def bulk_write(self, requests):
+        """Apply a list of writes in order, under one hold of the write lock and with a single log write
+        
+        Each request is one of
+        {"insert_one": {"document": doc}},
+        {"update_one": {"filter": query, "update": update}} or
+        {"update_many": {"filter": query, "update": update}}.
+        The result lists the matched and modified counts of every request.
+        
+        Every request is checked before any is applied, so an unsupported
+        operation or update operator raises ValueError and changes nothing.
+        Writes are not rolled back: if a request fails while being applied
+        (say $push to a field holding a string), the requests before it stay
+        applied and logged, and the error is raised.
+        """
+        result, lsn = self._bulk_write(requests)
+        self._wait_durable(lsn)
+        return result
     
     def aggregate(self, pipeline):
-        """Simple aggregation pipeline"""
-        # For getting unique days from schedule_details.days
-        if len(pipeline) == 2 and '$unwind' in pipeline[0] and '$group' in pipeline[1]:
-            days = set()
-            for value in self.data.values():
-                if 'schedule_details' in value and 'days' in value['schedule_details']:
-                    days.update(value['schedule_details']['days'])
-            return [{'_id': day} for day in sorted(days)]
-        return []
-    
-    def _matches_query(self, doc, query):
-        """Simple query matching"""
-        for key, condition in query.items():
-            if key.startswith('schedule_details.'):
-                field_path = key.split('.')
-                if len(field_path) == 2:
-                    nested_field = field_path[1]
-                    if 'schedule_details' not in doc or nested_field not in doc['schedule_details']:
-                        return False
-                    
-                    value = doc['schedule_details'][nested_field]
-                    if isinstance(condition, dict):
-                        if '$in' in condition:
-                            if value not in condition['$in']:
-                                return False
-                        elif '$gte' in condition:
-                            if value < condition['$gte']:
-                                return False
-                        elif '$lte' in condition:
-                            if value > condition['$lte']:
-                                return False
-                    elif value != condition:
-                        return False
-            elif key in doc:
-                if doc[key] != condition:
-                    return False
-            else:
-                return False
-        return True
+        """Run an aggregation pipeline, yielding result documents (see aggregation.py)"""
+        started = time.perf_counter()
+        try:
+            yield from run_pipeline(self, pipeline)
+        finally:
+            self._check_slow('aggregate', pipeline, started)
+    
+    # Writes: applied in memory under the lock, returning (result, log sequence
+    # number) so the sync and async APIs can each wait for durability their own way
+    
+    @contextmanager
+    def _writing(self):
+        """Hold the write locks: the storage engine's (cross-process when shared), then the collection's"""
+        started = time.perf_counter()
+        if self.storage is None:
+            with self._lock:
+                self.stats.lock_wait.observe(time.perf_counter() - started)
+                yield
+        else:
+            with self.storage.writing(), self._lock:
+                self.stats.lock_wait.observe(time.perf_counter() - started)
+                yield
+    
+    def _update_one(self, query, update):
+        _check_update(update)
+        with self._writing():
+            started = time.perf_counter()
+            key, scanned = self._find_key(query)
+            self._check_slow('update_one', query, started)
+            if key is None:
+                self.stats.record('update_one', scanned)
+                return UpdateResult(0, 0, self._unmatched_by(query)), 0
+            if not self._update_document(key, update):
+                self.stats.record('update_one', scanned)
+                return UpdateResult(1, 0), 0
+            self.stats.record('update_one', scanned, 1)
+            lsn = self._log('update_one', {'_id': key}, update)
+        return UpdateResult(1, 1), lsn
+    
+    def _update_many(self, query, update):
+        _check_update(update)
+        with self._writing():
+            started = time.perf_counter()
+            items, scanned = self._matching_items(query)
+            keys = [key for key, _ in items]
+            modified = []
+            try:
+                for key in keys:
+                    if self._update_document(key, update):
+                        modified.append(key)
+            finally:
+                # Log whatever was applied, even if a later document failed
+                self.stats.record('update_many', scanned, len(modified))
+                self._check_slow('update_many', query, started)
+                lsn = self._log('bulk_write', [
+                    {'update_one': {'filter': {'_id': key}, 'update': update}} for key in modified
+                ]) if modified else 0
+        return UpdateResult(len(keys), len(modified)), lsn
+    
+    def _insert_one(self, document):
+        if '_id' not in document:
+            return None, 0
+        with self._writing():
+            key = self._insert_document(document)
+            self.stats.record('insert_one', returned=1)
+            lsn = self._log('insert_one', document)
+        return InsertResult(key), lsn
+    
+    def _insert_many(self, documents):
+        documents = [document for document in documents if '_id' in document]
+        with self._writing():
+            keys = [self._insert_document(document) for document in documents]
+            self.stats.record('insert_many', returned=len(keys))
+            lsn = self._log('bulk_write', [
+                {'insert_one': {'document': document}} for document in documents
+            ]) if documents else 0
+        return InsertManyResult(keys), lsn
+    
+    def _bulk_write(self, requests):
+        requests = list(requests)
+        for request in requests:
+            _check_bulk_request(request)
+        results = []
+        logged = []
+        scanned = 0
+        with self._writing():
+            started = time.perf_counter()
+            try:
+                for request in requests:
+                    (operation, arguments), = request.items()
+                    if operation == 'insert_one':
+                        key = self._insert_document(arguments['document'])
+                        logged.append(request)
+                        results.append(InsertResult(key))
+                        continue
+                    query, update = arguments['filter'], arguments['update']
+                    unmatched_by = None
+                    if operation == 'update_one':
+                        key, request_scanned = self._find_key(query)
+                        keys = [] if key is None else [key]
+                        if key is None:
+                            # Diagnosed now: later requests may change the document
+                            unmatched_by = self._unmatched_by(query)
+                    else:
+                        items, request_scanned = self._matching_items(query)
+                        keys = [key for key, _ in items]
+                    scanned += request_scanned
+                    modified = 0
+                    for key in keys:
+                        if self._update_document(key, update):
+                            modified += 1
+                            logged.append({'update_one': {'filter': {'_id': key}, 'update': update}})
+                    results.append(UpdateResult(len(keys), modified, unmatched_by))
+            finally:
+                # Log whatever was applied, even if a later request failed
+                self.stats.record('bulk_write', scanned, len(logged))
+                self._check_slow('bulk_write', {}, started)
+                lsn = self._log('bulk_write', logged) if logged else 0
+        return BulkWriteResult(results), lsn
+    
+    def _document(self, key, value, view):
+        """Build a result document with its _id injected"""
+        if view:
+            return DocumentView(value, key)
+        doc = value.copy()
+        doc['_id'] = key
+        return doc
+    
+    def _insert_document(self, document):
+        """Store a document; the caller holds the write lock and logs it"""
+        key = document['_id']
+        doc = document.copy()
+        del doc['_id']
+        if self.normalize is not None:
+            doc = self.normalize(doc)
+        old = self.data.get(key, MISSING)
+        # Indexed before it is stored, so a failing index leaves the collection as it was
+        if old is not MISSING:
+            self._unindex(key, old)
+        try:
+            self._index(key, doc, self.indexes.values())
+        except BaseException:
+            if old is not MISSING:
+                self._index(key, old, self.indexes.values())
+            raise
+        if old is not MISSING:
+            if self._preserved is not None:
+                # The replaced document is no longer changed, so a snapshot can keep it as it is
+                self._preserved.setdefault(key, old)
+        else:
+            self._assign_position(key)
+        self.data[key] = doc
+        self.version += 1
+        self._notify('insert', key, doc, None)
+        return key
+    
+    def _update_document(self, key, update):
+        """Apply an update to one document; the caller holds the write lock and logs it"""
+        doc = self.data[key]
+        if self._preserved is not None and key not in self._preserved:
+            self._preserved[key] = copy_document(doc)
+        reindex = self._indexes_touched(update)
+        # The indexed fields as they were, to undo the update if it cannot be indexed
+        saved = {field: copy.deepcopy(doc.get(field, MISSING)) for field in _updated_fields(update)} if reindex else {}
+        for index in reindex:
+            index.remove(key, doc)
+        try:
+            modified = _apply_update(doc, update)
+            if modified and '$set' in update and self.normalize is not None:
+                self.normalize(doc)
+            self._index(key, doc, reindex)
+        except BaseException:
+            for field, value in saved.items():
+                if value is MISSING:
+                    doc.pop(field, None)
+                else:
+                    doc[field] = value
+            self._index(key, doc, reindex)
+            raise
+        if modified:
+            self.version += 1
+            self._notify('update', key, doc, update)
+        return modified
+    
+    def _matching_items(self, query):
+        """(key, document) pairs matching query, and the number of documents examined"""
+        if not query:
+            return list(self.data.items()), len(self.data)
+        matches = compile_query(query)
+        candidates = self._candidates(query)
+        items = [(key, value) for key, value in candidates if matches(value, key)]
+        return items, len(candidates)
+    
+    def _unmatched_by(self, query):
+        """Why a filter naming an _id matched nothing: '_id' if there is no such
+        document, else the first of its conditions (in filter order) the document fails
+        
+        None when the filter names no single _id. Called under the write lock, so
+        the answer describes the document the write saw.
+        """
+        key = (query or {}).get('_id', MISSING)
+        if key is MISSING or isinstance(key, (dict, list)):
+            return None
+        doc = self.data.get(key)
+        if doc is None:
+            return '_id'
+        for field, condition in query.items():
+            if field != '_id' and not compile_query({field: condition})(doc, key):
+                return field
+        return None
+    
+    def _find_key(self, query):
+        """Key of the first document matching query (or None), and the number of documents examined"""
+        query = query or {}
+        matches = compile_query(query)
+        scanned = 0
+        for key, value in self._candidates(query):
+            scanned += 1
+            if matches(value, key):
+                return key, scanned
+        return None, scanned
+    
+    def _log(self, operation, *args):
+        """Append a write to the storage engine's log, if the collection is persisted"""
+        if self.storage is None:
+            return 0
+        return self.storage.append(self.name, operation, *args)
+    
+    def _wait_durable(self, lsn):
+        # Called after releasing the write lock so concurrent writes share one fsync
+        if lsn:
+            self.storage.wait(lsn)
+    
+    def _check_slow(self, operation, query, started):
+        """Report an operation that began at started (perf_counter) to the slow-operation log"""
+        duration = time.perf_counter() - started
+        if duration >= slow_operations.threshold:
+            slow_operations.record(self.name, operation, query, duration)
+    
+    def _notify(self, operation, key, doc, update):
+        for listener in self.listeners:
+            listener(operation, key, doc, update)
+    
+    def _project(self, key, value, projection):
+        """Build a result document holding only the projected fields"""
+        include_id = projection.get('_id', 1)
+        fields = [field for field in projection if field != '_id']
+        if projection[fields[0]] if fields else include_id:
+            doc = {}
+            for field in fields:
+                field_value = get_field(value, field)
+                if field_value is not MISSING:
+                    _set_field(doc, field, field_value)
+        else:
+            excluded = set(fields)
+            doc = {field: field_value for field, field_value in value.items() if field not in excluded}
+        if include_id:
+            doc['_id'] = key
+        return doc
+    
+    def _sort(self, items, sort, bound):
+        """Order (key, value) pairs; keep only the first `bound` when given"""
+        def sort_key(field):
+            def key_func(item):
+                field_value = item[0] if field == '_id' else get_field(item[1], field)
+                # Documents missing the field sort first, as in MongoDB
+                return (0, None) if field_value is MISSING else (1, field_value)
+            return key_func
+        
+        if len(sort) == 1 and bound is not None:
+            field, direction = sort[0]
+            select = heapq.nsmallest if direction >= 0 else heapq.nlargest
+            return select(bound, items, key=sort_key(field))
+        
+        items = list(items)
+        # Stable sorts applied from the least to the most significant field
+        for field, direction in reversed(sort):
+            items.sort(key=sort_key(field), reverse=direction < 0)
+        return items
+    
+    def _candidates(self, query):
+        """(key, document) pairs that may match query, from the query plan"""
+        return self._plan(query)[1]
+    
+    def _plan(self, query):
+        """Plan a query: intersect index lookups, falling back to a full scan
+        
+        Returns a description of the access path and the candidate (key, document) pairs.
+        """
+        matches = []
+        condition = query.get('_id', MISSING)
+        if condition is not MISSING:
+            # Keys act as a unique index on _id
+            if not isinstance(condition, dict):
+                matches.append(('_id', {condition} if condition in self.data else set()))
+            elif set(condition) == {'$in'}:
+                matches.append(('_id', {key for key in condition['$in'] if key in self.data}))
+        for field, condition in query.items():
+            index = self.indexes.get(field)
+            if index is not None:
+                keys = index.lookup(condition)
+                if keys is not None:
+                    matches.append((field, keys))
+        
+        if not matches:
+            return {'stage': 'COLLSCAN'}, self.data.items()
+        
+        # Intersect starting from the most selective index
+        matches.sort(key=lambda match: len(match[1]))
+        keys = matches[0][1]
+        for _, other in matches[1:]:
+            if not keys:
+                break
+            keys = keys & other
+        
+        plan = {
+            'stage': 'ID_LOOKUP' if matches[0][0] == '_id' and len(matches) == 1 else 'IXSCAN',
+            'indexes': [field for field, _ in matches],
+            'index_keys': [len(match_keys) for _, match_keys in matches],
+        }
+        positions = self._positions
+        return plan, [(key, self.data[key]) for key in sorted(keys, key=positions.__getitem__)]
+    
+    def _indexes_touched(self, update):
+        """Indexes whose field is modified by an update"""
+        fields = _updated_fields(update)
+        return [
+            index for path, index in self.indexes.items()
+            if path.split('.')[0] in fields
+        ]
+    
+    def _index(self, key, doc, indexes):
+        """Add a document to indexes, or to none of them if one fails"""
+        added = []
+        try:
+            for index in indexes:
+                index.add(key, doc)
+                added.append(index)
+        except BaseException:
+            for index in added:
+                index.remove(key, doc)
+            raise
+    
+    def _unindex(self, key, doc):
+        for index in self.indexes.values():
+            index.remove(key, doc)
+    
+    def _assign_position(self, key):
+        self._positions[key] = self._next_position
+        self._next_position += 1
+
+class InsertResult:
+    def __init__(self, inserted_id):
+        self.inserted_id = inserted_id
+
+class InsertManyResult:
+    def __init__(self, inserted_ids):
+        self.inserted_ids = inserted_ids
+
+class UpdateResult:
+    def __init__(self, matched_count, modified_count, unmatched_by=None):
+        self.matched_count = matched_count
+        self.modified_count = modified_count
+        # For an update_one whose filter names an _id and matched nothing: '_id' if
+        # the document does not exist, else the first filter condition it failed
+        self.unmatched_by = unmatched_by
+
+class BulkWriteResult:
+    def __init__(self, results):
+        # One InsertResult or UpdateResult per request, in request order
+        self.results = results
+        updates = [result for result in results if isinstance(result, UpdateResult)]
+        self.inserted_count = len(results) - len(updates)
+        self.matched_count = sum(result.matched_count for result in updates)
+        self.modified_count = sum(result.modified_count for result in updates)
+
+class Cursor:
+    """Result of InMemoryCollection.find: iterate it for the documents, or explain() the query"""
+
+    def __init__(self, collection, query, projection, sort, skip, limit, view):
+        self.collection = collection
+        self.query = query
+        self.projection = projection
+        self.sort = sort
+        self.skip = skip
+        self.limit = limit
+        self.view = view
+        self._documents = None
+
+    def __iter__(self):
+        if self._documents is None:
+            self._documents = self._run('find')
+        return self._documents
+
+    def __next__(self):
+        return next(iter(self))
+
+    def close(self):
+        if self._documents is not None:
+            self._documents.close()
+
+    def explain(self):
+        """Run the query and report how: the access path, documents examined and returned, time taken
+        
+        The access path (plan) is COLLSCAN (every document), ID_LOOKUP (by _id) or
+        IXSCAN, listing the indexes whose matches were intersected and how many keys
+        each matched.
+        """
+        report = {}
+        started = time.perf_counter()
+        for _ in self._run('explain', report):
+            pass
+        report['duration_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        return {
+            'collection': self.collection.name,
+            'query': query_shape(self.query),
+            'sort': self.sort,
+            'skip': self.skip,
+            'limit': self.limit,
+            **report,
+        }
+
+    def _run(self, operation, explain=None):
+        return self.collection._find(self.query, self.projection, self.sort, self.skip,
+                                     self.limit, self.view, operation, explain)
+
+# Update operators _apply_update supports, and the operations bulk_write accepts
+UPDATE_OPERATORS = ('$set', '$push', '$addToSet', '$pull')
+BULK_OPERATIONS = ('insert_one', 'update_one', 'update_many')
+
+def _check_update(update):
+    """Raise ValueError for an update _apply_update cannot apply"""
+    if not isinstance(update, dict):
+        raise ValueError("An update must be a document of update operators")
+    for operator, changes in update.items():
+        if operator not in UPDATE_OPERATORS:
+            raise ValueError(f"Unsupported update operator: {operator}")
+        if not isinstance(changes, dict):
+            raise ValueError(f"{operator} takes a document of fields")
+
+def _check_bulk_request(request):
+    """Raise ValueError for a bulk_write request that cannot be applied"""
+    if not isinstance(request, dict) or len(request) != 1:
+        raise ValueError("Each bulk request must name exactly one operation")
+    (operation, arguments), = request.items()
+    if operation not in BULK_OPERATIONS:
+        raise ValueError(f"Unsupported bulk operation: {operation}")
+    if operation == 'insert_one':
+        if not isinstance(arguments.get('document'), dict) or '_id' not in arguments['document']:
+            raise ValueError("insert_one needs a document with an _id")
+        return
+    if not isinstance(arguments.get('filter'), dict) or 'update' not in arguments:
+        raise ValueError(f"{operation} needs a filter and an update")
+    _check_update(arguments['update'])
+
+def _updated_fields(update):
+    """Top-level fields an update changes"""
+    fields = set()
+    for changes in update.values():
+        fields.update(changes)
+    return fields
+
+def _apply_update(doc, update):
+    """Apply update operators to doc in place; returns whether anything changed
+    
+    Raises ValueError, before changing anything, if an array operator targets
+    a field that holds something other than an array.
+    """
+    for operator in ('$push', '$addToSet', '$pull'):
+        for field in update.get(operator, ()):
+            values = doc.get(field, MISSING)
+            if values is MISSING or (values is None and operator == '$pull'):
+                continue
+            if not isinstance(values, (list, ParticipantList)):
+                raise ValueError(f"Cannot apply {operator} to {field!r}, which is not an array")
+    modified = False
+    for field, value in update.get('$set', {}).items():
+        if doc.get(field, MISSING) != value:
+            doc[field] = value
+            modified = True
+    for field, value in update.get('$push', {}).items():
+        values = doc.setdefault(field, [])
+        length = len(values)
+        values.append(value)
+        # A ParticipantList ignores an email it already has
+        if len(values) != length:
+            modified = True
+    for field, value in update.get('$addToSet', {}).items():
+        values = doc.setdefault(field, [])
+        if value not in values:
+            values.append(value)
+            modified = True
+    for field, value in update.get('$pull', {}).items():
+        values = doc.get(field)
+        if values is not None and value in values:
+            values.remove(value)
+            modified = True
+    return modified
+
+def _set_field(doc, path, value):
+    """Set a value at a dotted field path, creating sub-documents"""
+    parts = path.split('.')
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+# Store activities as compact slotted records instead of dicts (see records.py)
+COMPACT_RECORDS = os.environ.get("MERGINGTON_COMPACT_RECORDS", "").lower() in ("1", "true", "yes")
+
+def normalize_activity(doc):
+    """Canonical form of an activity: participant set and zero-padded times"""
+    if COMPACT_RECORDS:
+        # Records keep times as minutes and participants as a set of ids already
+        record = compact_activity(doc)
+        record.setdefault("participants", [])
+        return record
+    return normalize_schedule(normalize_participants(doc))
 
 # Create in-memory collections
-activities_collection = InMemoryCollection(activities_data)
-teachers_collection = InMemoryCollection(teachers_data)
-students_collection = InMemoryCollection(students_data)
+activities_collection = InMemoryCollection(activities_data, normalize=normalize_activity, name="activities")
+teachers_collection = InMemoryCollection(teachers_data, name="teachers")
+students_collection = InMemoryCollection(students_data, name="students")
 
-# Methods
-def hash_password(password):
-    """Hash password using Argon2"""
-    ph = PasswordHasher()
-    return ph.hash(password)
-
-def verify_password(password, hashed_password):
-    """Verify password against hash"""
-    ph = PasswordHasher()
-    try:
-        return ph.verify(hashed_password, password)
-    except:
-        return False
+# Report the collections and the reset tokens on GET /metrics
+for collection in (activities_collection, teachers_collection, students_collection):
+    registry.collections[collection.name] = collection.stats
+registry.stores["password_reset_tokens"] = password_reset_tokens
+
+def _index_reset_tokens(operation, key, doc, update):
+    """Collection listener mirroring the students' reset tokens into password_reset_tokens"""
+    if operation == 'update' and 'password_reset_tokens' not in update.get('$set', {}):
+        return
+    password_reset_tokens.discard_owner(key)
+    now = time.time()
+    for entry in doc.get('password_reset_tokens', ()):
+        remaining = entry['expires_at'] / 1000 - now
+        if remaining > 0:
+            password_reset_tokens.set(entry['token'], key, owner=key, ttl=remaining)
+
+students_collection.subscribe(_index_reset_tokens)
+
+# Async APIs over the same collections, for async endpoints (see async_collection.py)
+async_activities_collection = AsyncCollection(activities_collection)
+async_teachers_collection = AsyncCollection(teachers_collection)
+async_students_collection = AsyncCollection(students_collection)
+
+# Number of server processes (see app.py); more than one share the data directory
+WORKERS = int(os.environ.get("MERGINGTON_WORKERS", "1"))
+
+# Persist the collections when a data directory is configured
+storage = None
+if os.environ.get("MERGINGTON_DATA_DIR"):
+    storage = StorageEngine(os.environ["MERGINGTON_DATA_DIR"], shared=WORKERS > 1)
+    storage.attach("activities", activities_collection)
+    storage.attach("teachers", teachers_collection)
+    storage.attach("students", students_collection)
+
+# Indexes backing the schedule filters of GET /activities
+activities_collection.create_index("schedule_details.days", kind="hash")
+activities_collection.create_index("schedule_details.start_time", kind="sorted")
+activities_collection.create_index("schedule_details.end_time", kind="sorted")
 
+# Full-text index backing GET /activities/search
+activities_search = SearchIndex({
+    "_id": 3,
+    "description": 1,
+    "schedule": 1,
+    "schedule_details.days": 1,
+}).attach(activities_collection)
+
+# Reverse index from student email to the activities they are signed up for
+activity_memberships = MembershipIndex("participants").attach(activities_collection)
+
+# Live participant changes, streamed by GET /activities/stream
+activity_events = OccupancyStream("participants").attach(activities_collection)
+
+# Weekly schedules in minutes, backing GET /activities/running and /activities/conflicts
+activity_schedules = ScheduleIndex("schedule_details").attach(activities_collection)
+
+# Methods
 def generate_reset_token():
     """Generate a random reset token"""
     import secrets
     return secrets.token_urlsafe(32)
 
-def store_reset_token(email, token):
+def _reset_token_hash(token):
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+async def _update_reset_tokens(email, change):
+    """Replace a student's unexpired reset tokens with change(tokens), atomically
+
+    change() returns the new list, or None to leave the tokens as they are.
+    The update only applies if the tokens are still the ones read (another
+    request, or another worker, may have changed them meanwhile); otherwise
+    they are read again. Returns the unexpired tokens the change was based
+    on, or None if there is no such student.
+    """
+    while True:
+        student = await async_students_collection.find_one({"_id": email}, view=True)
+        if student is None:
+            return None
+        current = student.get("password_reset_tokens")
+        current = list(current) if current is not None else None
+        now = int(time.time() * 1000)
+        entries = [entry for entry in current or () if entry["expires_at"] > now]
+        changed = change(entries)
+        if changed is None:
+            return entries
+        result = await async_students_collection.update_one(
+            {"_id": email, "password_reset_tokens": {"$eq": current}},
+            {"$set": {"password_reset_tokens": changed[-RESET_TOKENS_PER_STUDENT:]}}
+        )
+        if result.matched_count:
+            return entries
+
+async def store_reset_token(email, token):
     """Store password reset token with expiration"""
-    import time
-    password_reset_tokens[token] = {
-        'email': email,
-        'expires': time.time() + 3600  # 1 hour expiration
-    }
+    entry = {"token": _reset_token_hash(token), "expires_at": int((time.time() + RESET_TOKEN_SECONDS) * 1000)}
+    await _update_reset_tokens(email, lambda entries: entries + [entry])
     return token
 
 def validate_reset_token(token):
     """Validate and return email for reset token"""
-    import time
-    if token in password_reset_tokens:
-        token_data = password_reset_tokens[token]
-        if time.time() < token_data['expires']:
-            return token_data['email']
-        else:
-            # Token expired, remove it
-            del password_reset_tokens[token]
-    return None
+    return password_reset_tokens.get(_reset_token_hash(token))
+
+async def redeem_reset_token(token):
+    """Remove a reset token; returns the student's email if this call removed it, else None
 
-def clear_reset_token(token):
-    """Clear used reset token"""
-    if token in password_reset_tokens:
-        del password_reset_tokens[token]
+    Of several requests redeeming the same token, only one gets the email.
+    """
+    hashed = _reset_token_hash(token)
+    email = password_reset_tokens.get(hashed)
+    if email is None:
+        return None
+
+    def remove(entries):
+        kept = [entry for entry in entries if entry["token"] != hashed]
+        return kept if len(kept) < len(entries) else None
+
+    entries = await _update_reset_tokens(email, remove)
+    if entries is None or all(entry["token"] != hashed for entry in entries):
+        return None
+    return email
 
 def init_database():
     """Initialize database if empty"""
+    if storage is not None and not storage.is_open:
+        # Load the persisted data first so it is not replaced by the sample data
+        storage.open()
+    
+    # Insert through the collections so indexes and the storage log see the data.
+    # Holding the write lock, only the first of several worker processes seeds.
+    with storage.writing() if storage is not None else nullcontext():
+        _seed_database()
+
+def _seed_database():
     if not activities_data:
-        activities_data.update(initial_activities)
+        for name, activity in initial_activities.items():
+            activities_collection.insert_one({"_id": name, **activity})
     
     if not teachers_data:
         for teacher in initial_teachers:
-            username = teacher.pop('username')
-            teachers_data[username] = teacher
+            doc = {"_id": teacher["username"], **teacher}
+            del doc["username"]
+            teachers_collection.insert_one(doc)
     
     if not students_data:
         for student in initial_students:
-            email = student.pop('email')
-            students_data[email] = student
+            doc = {"_id": student["email"], **student}
+            del doc["email"]
+            students_collection.insert_one(doc)
+
+def close_database():
+    """Flush and close persistent storage, if configured"""
+    if storage is not None:
+        storage.close()
 
 # Initial database data
 initial_activities = {
@@ -332,23 +1022,26 @@ initial_activities = {
     }
 }
 
+# Seed passwords are stored pre-hashed so that starting a worker does not
+# spend seconds of CPU on Argon2. Hashes made with older parameters are
+# upgraded the next time the user logs in.
 initial_teachers = [
     {
         "username": "mrodriguez",
         "display_name": "Ms. Rodriguez",
-        "password": hash_password("art123"),
+        "password": "$argon2id$v=19$m=65536,t=3,p=4$r6DkajaxXucVcUKHBvGOjg$37+vL3e53eyeSXmjiwa8mQt9QNXKxLe+xn9PtgRBQbc",  # art123
         "role": "teacher"
      },
     {
         "username": "mchen",
         "display_name": "Mr. Chen",
-        "password": hash_password("chess456"),
+        "password": "$argon2id$v=19$m=65536,t=3,p=4$m+WkdWKBgbgv4tK6+2Bgfg$DngPC3zvTaSoIhLuUVVNkOPcFAQMUhGHO80d7t6yfsY",  # chess456
         "role": "teacher"
     },
     {
         "username": "principal",
         "display_name": "Principal Martinez",
-        "password": hash_password("admin789"),
+        "password": "$argon2id$v=19$m=65536,t=3,p=4$2HFCXoIj30ZgA7D4t9zGnQ$X3XqnQy55x35DtKry82t7JwwRfTFLOaFXaeip/WlboU",  # admin789
         "role": "admin"
     }
 ]
@@ -358,7 +1051,7 @@ initial_students = [
         "email": "alex@mergington.edu",
         "first_name": "Alex",
         "last_name": "Smith",
-        "password": hash_password("student123"),
+        "password": "$argon2id$v=19$m=65536,t=3,p=4$BqVLBcjpLYdgW5ifzNEe6Q$l/USFCRhi/tF2GJvaBrUoJiMYG3GtzezyoHn2cB+PMk",  # student123
         "grade": "10",
         "phone": "555-0101"
     },
@@ -366,7 +1059,7 @@ initial_students = [
         "email": "sarah@mergington.edu",
         "first_name": "Sarah",
         "last_name": "Johnson",
-        "password": hash_password("student456"),
+        "password": "$argon2id$v=19$m=65536,t=3,p=4$1MiIw7hSfI9gdWHz/PvGyw$Z01457M3bgJN5T2WRlFL15rl0s3uQBIlsnYgWNLANlk",  # student456
         "grade": "11",
         "phone": "555-0102"
     },
@@ -374,7 +1067,7 @@ initial_students = [
         "email": "emma@mergington.edu",
         "first_name": "Emma",
         "last_name": "Williams",
-        "password": hash_password("student789"),
+        "password": "$argon2id$v=19$m=65536,t=3,p=4$/c3RKqEw7cHJhd4rp8QpDQ$95vUsH9mDM2P1aoKiBOSLENQtE2YlkN+nRxmCERKzyw",  # student789
         "grade": "12",
         "phone": "555-0103"
     }
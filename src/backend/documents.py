@@ -0,0 +1,183 @@
+"""
+Read-only document views for the in-memory collections
+
+A view shares the stored document instead of copying it. The first write
+through a view copies the document (copy-on-write), so callers can still
+treat results as their own without paying for a copy on every read.
+
+Responses are encoded straight from views to JSON bytes by dumps(), with
+orjson when it is installed (several times faster on large listings) and the
+json module otherwise. Both write the same JSON, except that orjson spells
+very large floats differently (1e300) and encodes NaN as null instead of
+failing. iter_dumps() encodes a mapping in batches, for streaming responses.
+"""
+
+import json
+import time
+from collections.abc import MutableMapping
+from itertools import islice
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from .indexes import MISSING
+from .metrics import registry
+from .participants import ParticipantList
+from .records import ActivityRecord
+
+
+class DocumentView(MutableMapping):
+    """Mapping over a stored document, optionally with its _id injected
+
+    Nested values (lists, sub-documents) are shared with the collection and
+    must not be mutated through a view.
+    """
+
+    __slots__ = ('_doc', '_id', '_owned')
+
+    def __init__(self, doc, _id=MISSING):
+        self._doc = doc
+        self._id = _id
+        self._owned = False
+
+    def __getitem__(self, field):
+        if field == '_id' and not self._owned:
+            if self._id is MISSING:
+                raise KeyError(field)
+            return self._id
+        return self._doc[field]
+
+    def __iter__(self):
+        yield from self._doc
+        if not self._owned and self._id is not MISSING:
+            yield '_id'
+
+    def __len__(self):
+        if self._owned or self._id is MISSING:
+            return len(self._doc)
+        return len(self._doc) + 1
+
+    def __contains__(self, field):
+        if field == '_id' and not self._owned:
+            return self._id is not MISSING
+        return field in self._doc
+
+    def __setitem__(self, field, value):
+        self._own()[field] = value
+
+    def __delitem__(self, field):
+        del self._own()[field]
+
+    def __repr__(self):
+        return f"DocumentView({dict(self)!r})"
+
+    def _own(self):
+        """Copy the shared document before the first write"""
+        if not self._owned:
+            doc = dict(self._doc)
+            if self._id is not MISSING:
+                doc['_id'] = self._id
+            self._doc = doc
+            self._owned = True
+        return self._doc
+
+    def copy(self):
+        """Return a plain dict copy"""
+        return dict(self)
+
+    def without_id(self):
+        """Lightweight projection of the document without its _id"""
+        if self._owned:
+            doc = dict(self._doc)
+            doc.pop('_id', None)
+            return DocumentView(doc)
+        return DocumentView(self._doc)
+
+    def raw(self):
+        """The underlying dict when it is exactly this view, else None"""
+        if self._owned or self._id is MISSING:
+            return self._doc
+        return None
+
+
+def copy_document(value):
+    """Copy of a stored document and its nested containers, as plain dicts and lists"""
+    kind = type(value)
+    if kind is dict:
+        return {field: copy_document(item) for field, item in value.items()}
+    if kind is list:
+        return [copy_document(item) for item in value]
+    if isinstance(value, ParticipantList):
+        # Emails are strings, so a shallow copy will do
+        return list(value)
+    if isinstance(value, MutableMapping):
+        return {field: copy_document(item) for field, item in value.items()}
+    return value
+
+
+def json_default(obj):
+    """json.dumps hook that encodes views without copying them"""
+    if isinstance(obj, DocumentView):
+        raw = obj.raw()
+        return raw if raw is not None else dict(obj)
+    if isinstance(obj, ParticipantList):
+        return list(obj)
+    if isinstance(obj, ActivityRecord):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def json_dumps(content):
+    """Encode content the way FastAPI's JSONResponse does, accepting views"""
+    return json.dumps(
+        content,
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+        default=json_default,
+    ).encode("utf-8")
+
+
+def orjson_dumps(content):
+    """Same output as json_dumps, from orjson where it can encode the content"""
+    try:
+        return orjson.dumps(content, default=json_default)
+    except TypeError:
+        # Integers beyond 64 bits, non-string keys, NaN...: json_dumps
+        # encodes them or raises the error FastAPI would
+        return json_dumps(content)
+
+
+encode = orjson_dumps if orjson is not None else json_dumps
+
+
+def dumps(content):
+    """Encode a response body as JSON bytes"""
+    started = time.perf_counter()
+    encoded = encode(content)
+    registry.encode_seconds.observe(time.perf_counter() - started)
+    return encoded
+
+
+def iter_dumps(items, batch_size=500):
+    """Encode (key, value) pairs as one JSON object, batch_size pairs per chunk
+
+    The chunks joined are the bytes dumps(dict(items)) would return.
+    """
+    items = iter(items)
+    elapsed = 0.0
+    opening = b"{"
+    while True:
+        batch = dict(islice(items, batch_size))
+        if not batch:
+            break
+        started = time.perf_counter()
+        chunk = opening + encode(batch)[1:-1]
+        elapsed += time.perf_counter() - started
+        opening = b","
+        yield chunk
+    yield b"{}" if opening == b"{" else b"}"
+    registry.encode_seconds.observe(elapsed)
@@ -0,0 +1,167 @@
+"""
+Live occupancy updates for activities, streamed as server-sent events
+
+OccupancyStream listens to the activities collection and turns each change
+into a compact delta:
+
+    {"activity": "Chess Club", "count": 3, "added": ["new@mergington.edu"], "removed": []}
+
+Inserted or replaced documents send their full "participants" list instead
+of added/removed.
+
+Every connected client has its own pending deltas, keyed by activity, so a
+burst of changes to one activity reaches the client as a single merged
+delta. Deltas are handed over without ever blocking the writer: a client that
+falls too far behind (more pending activities than max_pending) is sent one
+"resync" event, telling it to reload the catalog, instead of an unbounded
+backlog.
+"""
+
+import asyncio
+import json
+
+from .indexes import MISSING
+
+
+class Subscriber:
+    """Pending deltas for one connected client"""
+
+    def __init__(self, max_pending):
+        self.max_pending = max_pending
+        self.pending = {}
+        self.overflowed = False
+        self.ready = asyncio.Event()
+
+    def push(self, delta):
+        # Runs on the event loop
+        if not self.overflowed:
+            current = self.pending.get(delta["activity"])
+            if current is not None:
+                _merge(current, delta)
+            elif len(self.pending) < self.max_pending:
+                self.pending[delta["activity"]] = _copy_delta(delta)
+            else:
+                self.overflowed = True
+                self.pending.clear()
+        self.ready.set()
+
+    def drain(self):
+        """Return ("resync", None) or ("occupancy", deltas) and reset"""
+        self.ready.clear()
+        if self.overflowed:
+            self.overflowed = False
+            return "resync", None
+        deltas = [_encode_delta(delta) for delta in self.pending.values()]
+        self.pending.clear()
+        return "occupancy", deltas
+
+
+def _copy_delta(delta):
+    copy = dict(delta)
+    if "participants" in copy:
+        copy["participants"] = dict.fromkeys(copy["participants"])
+    else:
+        copy["added"] = dict.fromkeys(copy["added"])
+        copy["removed"] = dict.fromkeys(copy["removed"])
+    return copy
+
+
+def _merge(current, delta):
+    """Fold a later delta for the same activity into a pending one"""
+    current["count"] = delta["count"]
+    if "participants" in delta:
+        current.pop("added", None)
+        current.pop("removed", None)
+        current["participants"] = dict.fromkeys(delta["participants"])
+        return
+    if "participants" in current:
+        for email in delta["added"]:
+            current["participants"][email] = None
+        for email in delta["removed"]:
+            current["participants"].pop(email, None)
+        return
+    # A removal cancels a pending addition of the same email, and vice versa
+    for email in delta["added"]:
+        if current["removed"].pop(email, MISSING) is MISSING:
+            current["added"][email] = None
+    for email in delta["removed"]:
+        if current["added"].pop(email, MISSING) is MISSING:
+            current["removed"][email] = None
+
+
+def _encode_delta(delta):
+    encoded = {"activity": delta["activity"], "count": delta["count"]}
+    if "participants" in delta:
+        encoded["participants"] = list(delta["participants"])
+    else:
+        encoded["added"] = list(delta["added"])
+        encoded["removed"] = list(delta["removed"])
+    return encoded
+
+
+class OccupancyStream:
+    """Fans out participant changes of a collection to connected clients"""
+
+    def __init__(self, field="participants", max_pending=256, coalesce_seconds=0.1, keepalive_seconds=15):
+        self.field = field
+        # Pending activities per client before it is told to resync
+        self.max_pending = max_pending
+        # How long to gather a burst of changes into one event
+        self.coalesce_seconds = coalesce_seconds
+        # Interval of comment lines that keep idle connections open
+        self.keepalive_seconds = keepalive_seconds
+        self.subscribers = set()
+        self._loop = None
+
+    def attach(self, collection):
+        """Publish the changes of a collection"""
+        collection.subscribe(self.on_change)
+        return self
+
+    def on_change(self, operation, key, doc, update):
+        """Collection listener: build the delta and hand it to the event loop"""
+        if self._loop is None or not self.subscribers:
+            return
+        participants = doc.get(self.field, ())
+        delta = {"activity": key, "count": len(participants)}
+        if update is None or self.field in update.get('$set', {}):
+            delta["participants"] = list(participants)
+        else:
+            added = [update[operator][self.field] for operator in ('$push', '$addToSet')
+                     if self.field in update.get(operator, {})]
+            removed = [update['$pull'][self.field]] if self.field in update.get('$pull', {}) else []
+            if not added and not removed:
+                return
+            delta["added"], delta["removed"] = added, removed
+        # Writes happen on worker threads as well as on the loop
+        try:
+            self._loop.call_soon_threadsafe(self._publish, delta)
+        except RuntimeError:
+            # The event loop has been closed
+            self._loop = None
+
+    def _publish(self, delta):
+        for subscriber in self.subscribers:
+            subscriber.push(delta)
+
+    async def events(self, is_disconnected=None):
+        """Server-sent event messages (bytes) for one client, until it disconnects"""
+        self._loop = asyncio.get_running_loop()
+        subscriber = Subscriber(self.max_pending)
+        self.subscribers.add(subscriber)
+        try:
+            yield b"retry: 3000\n\n"
+            while True:
+                try:
+                    await asyncio.wait_for(subscriber.ready.wait(), self.keepalive_seconds)
+                except asyncio.TimeoutError:
+                    if is_disconnected is not None and await is_disconnected():
+                        return
+                    yield b": keepalive\n\n"
+                    continue
+                # Let the rest of a burst arrive, then send it as one event
+                await asyncio.sleep(self.coalesce_seconds)
+                event, data = subscriber.drain()
+                yield f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode("utf-8")
+        finally:
+            self.subscribers.discard(subscriber)
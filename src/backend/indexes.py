@@ -0,0 +1,163 @@
+"""
+Secondary indexes for the in-memory collections
+
+Indexes map field values to document keys so that queries only visit the
+documents that can possibly match instead of scanning the whole collection.
+"""
+
+import bisect
+
+# Marker for a field that is not present in a document
+MISSING = object()
+
+
+def get_field(doc, path):
+    """Return the value at a dotted field path, or MISSING"""
+    value = doc
+    for part in path.split('.'):
+        # Works for dicts and dict-like views; lists and scalars have no fields
+        try:
+            value = value[part]
+        except (KeyError, TypeError, IndexError):
+            return MISSING
+    return value
+
+
+class HashIndex:
+    """Index for equality and $in lookups
+
+    Array fields are indexed per element, so a document with
+    days ["Monday", "Friday"] is found by a lookup for either day.
+    """
+
+    kind = "hash"
+
+    def __init__(self, field):
+        self.field = field
+        self.entries = {}
+
+    def _values(self, doc):
+        value = get_field(doc, self.field)
+        if value is MISSING:
+            return ()
+        if isinstance(value, list):
+            return value
+        return (value,)
+
+    def add(self, key, doc):
+        for value in self._values(doc):
+            try:
+                self.entries.setdefault(value, set()).add(key)
+            except TypeError:
+                # Unhashable (a sub-document or nested array): only found by a scan
+                continue
+
+    def remove(self, key, doc):
+        for value in self._values(doc):
+            try:
+                keys = self.entries.get(value)
+            except TypeError:
+                continue
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.entries[value]
+
+    def lookup(self, condition):
+        """Return the keys matching condition, or None if it cannot be answered"""
+        try:
+            if isinstance(condition, dict):
+                if set(condition) != {'$in'} or None in condition['$in']:
+                    return None
+                keys = set()
+                for value in condition['$in']:
+                    keys.update(self.entries.get(value, ()))
+                return keys
+            if condition is None:
+                # Also matches documents without the field, which are not indexed
+                return None
+            return set(self.entries.get(condition, ()))
+        except TypeError:
+            # An unhashable value (e.g. a whole array to compare with): leave it to a scan
+            return None
+
+
+class SortedIndex:
+    """Index for range lookups ($gt, $gte, $lt, $lte) and equality
+
+    Arrays, sub-documents and values that do not compare with the indexed
+    ones cannot be kept in order. Their documents are returned by every
+    lookup instead, so the query's own matching decides, as in a scan.
+    """
+
+    kind = "sorted"
+
+    def __init__(self, field):
+        self.field = field
+        # Parallel lists kept in value order
+        self.values = []
+        self.keys = []
+        # Keys of documents whose value is not in the lists
+        self.unindexed = set()
+
+    def add(self, key, doc):
+        value = get_field(doc, self.field)
+        if value is MISSING or value is None:
+            # Never in a range; lookups for None fall back to a scan
+            return
+        if isinstance(value, (list, dict)):
+            self.unindexed.add(key)
+            return
+        try:
+            position = bisect.bisect_right(self.values, value)
+        except TypeError:
+            self.unindexed.add(key)
+            return
+        self.values.insert(position, value)
+        self.keys.insert(position, key)
+
+    def remove(self, key, doc):
+        if key in self.unindexed:
+            self.unindexed.discard(key)
+            return
+        value = get_field(doc, self.field)
+        if value is MISSING or value is None:
+            return
+        low = bisect.bisect_left(self.values, value)
+        high = bisect.bisect_right(self.values, value)
+        for position in range(low, high):
+            if self.keys[position] == key:
+                del self.values[position]
+                del self.keys[position]
+                return
+
+    def lookup(self, condition):
+        """Return the keys matching condition, or None if it cannot be answered"""
+        if condition is None:
+            # Also matches documents without the field, which are not indexed
+            return None
+        if not isinstance(condition, dict):
+            condition = {'$gte': condition, '$lte': condition}
+        elif not condition or not set(condition) <= {'$gt', '$gte', '$lt', '$lte'}:
+            return None
+
+        low, high = 0, len(self.values)
+        try:
+            if '$gte' in condition:
+                low = max(low, bisect.bisect_left(self.values, condition['$gte']))
+            if '$gt' in condition:
+                low = max(low, bisect.bisect_right(self.values, condition['$gt']))
+            if '$lte' in condition:
+                high = min(high, bisect.bisect_right(self.values, condition['$lte']))
+            if '$lt' in condition:
+                high = min(high, bisect.bisect_left(self.values, condition['$lt']))
+        except TypeError:
+            # Bound is not comparable with the indexed values
+            return None
+        return set(self.keys[low:high]) | self.unindexed
+
+
+INDEX_TYPES = {
+    HashIndex.kind: HashIndex,
+    SortedIndex.kind: SortedIndex,
+}
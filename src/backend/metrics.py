@@ -0,0 +1,313 @@
+"""
+Request and collection metrics, exposed in the Prometheus text format
+
+MetricsMiddleware records, per route template (for example
+/activities/{activity_name}/signup) rather than per URL:
+
+- http_requests_total by method, route and status code
+- http_request_duration_seconds, a histogram by method and route
+- http_requests_in_flight
+
+It also makes the request's scope available to the code handling it through
+the current_request context variable (see slowlog.py).
+
+Each InMemoryCollection keeps a CollectionStats with, per operation, the
+number of calls and of documents scanned, returned and copied, plus a
+histogram of the time writes wait for the write lock. Password hashing
+(hash_seconds) and JSON encoding of responses (encode_seconds) have their
+own histograms, so a slow request can be attributed to Argon2, to scans or
+to serialization. render() formats everything for GET /metrics.
+
+Recording is a few counter increments under a lock, cheap next to the work
+being measured.
+
+With MERGINGTON_PROFILING=1, a request sent with the header "X-Profile: 1"
+runs under cProfile. The response carries an X-Profile-Id header, and
+GET /metrics/profiles/{id} returns the statistics for an hour. With several
+worker processes, profiles are also written to the shared data directory,
+so any worker can return them. The profiler
+sees everything the event loop runs meanwhile, so profile one request at a
+time on an otherwise quiet server; concurrent profile requests are refused.
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import secrets
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from .ttl import TTLStore
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PROFILING = os.environ.get("MERGINGTON_PROFILING", "").lower() in ("1", "true", "yes")
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label values, as Prometheus expects"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # labels -> [count in each bucket (the last one is +Inf), sum]
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        with self._lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def samples(self, name, label_names):
+        """(name, labels, value) lines of the _bucket, _sum and _count series"""
+        with self._lock:
+            series = {labels: list(values) for labels, values in self.series.items()}
+        for labels, values in sorted(series.items()):
+            pairs = list(zip(label_names, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values):
+                cumulative += count
+                yield f"{name}_bucket", pairs + [("le", str(bound))], cumulative
+            yield f"{name}_sum", pairs, values[-1]
+            yield f"{name}_count", pairs, cumulative
+
+
+class CollectionStats:
+    """Per-operation counters of one collection"""
+
+    FIELDS = ('calls', 'scanned', 'returned', 'copied')
+
+    def __init__(self):
+        # operation -> [calls, scanned, returned, copied]
+        self.operations = {}
+        self.lock_wait = Histogram()
+        self._lock = threading.Lock()
+
+    def record(self, operation, scanned=0, returned=0, copied=0):
+        with self._lock:
+            counters = self.operations.get(operation)
+            if counters is None:
+                counters = self.operations[operation] = [0, 0, 0, 0]
+            counters[0] += 1
+            counters[1] += scanned
+            counters[2] += returned
+            counters[3] += copied
+
+    def snapshot(self):
+        with self._lock:
+            return {operation: dict(zip(self.FIELDS, counters)) for operation, counters in self.operations.items()}
+
+
+class Registry:
+    """Everything GET /metrics reports"""
+
+    def __init__(self):
+        # (method, route, status) -> count
+        self.requests = {}
+        self.in_flight = 0
+        self.durations = Histogram()
+        self.hash_seconds = Histogram()
+        self.encode_seconds = Histogram()
+        # name -> CollectionStats
+        self.collections = {}
+        # name -> TTLStore
+        self.stores = {}
+        # name -> function returning a number, read at scrape time
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def count_request(self, method, route, status):
+        key = (method, route, str(status))
+        with self._lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format"""
+        lines = []
+
+        def family(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample_name, labels, value in samples:
+                label_text = ",".join(f'{label}="{_escape(str(label_value))}"' for label, label_value in labels)
+                lines.append(f"{sample_name}{{{label_text}}} {value}" if label_text else f"{sample_name} {value}")
+
+        with self._lock:
+            requests = dict(self.requests)
+            in_flight = self.in_flight
+        family("http_requests_total", "counter", "HTTP requests by method, route and status code",
+               (("http_requests_total", list(zip(("method", "route", "status"), key)), count)
+                for key, count in sorted(requests.items())))
+        family("http_requests_in_flight", "gauge", "HTTP requests being handled",
+               [("http_requests_in_flight", [], in_flight)])
+        family("http_request_duration_seconds", "histogram", "HTTP request latency by method and route",
+               self.durations.samples("http_request_duration_seconds", ("method", "route")))
+        family("password_hash_seconds", "histogram", "Time spent hashing or verifying passwords, including queueing",
+               self.hash_seconds.samples("password_hash_seconds", ("operation",)))
+        family("response_encode_seconds", "histogram", "Time spent encoding responses as JSON",
+               self.encode_seconds.samples("response_encode_seconds", ()))
+
+        operations = {name: stats.snapshot() for name, stats in sorted(self.collections.items())}
+        for field, help_text in (("calls", "Collection operations"),
+                                 ("scanned", "Documents examined by collection operations"),
+                                 ("returned", "Documents returned or modified by collection operations"),
+                                 ("copied", "Documents copied for callers by collection operations")):
+            name = "collection_operations_total" if field == "calls" else f"collection_documents_{field}_total"
+            family(name, "counter", help_text, (
+                (name, [("collection", collection), ("operation", operation)], counters[field])
+                for collection, by_operation in operations.items()
+                for operation, counters in sorted(by_operation.items())))
+        family("collection_write_lock_wait_seconds", "histogram", "Time writes waited for the write lock", (
+            sample for collection, stats in sorted(self.collections.items())
+            for sample in _with_label(stats.lock_wait.samples("collection_write_lock_wait_seconds", ()),
+                                      "collection", collection)))
+
+        store_stats = {name: store.stats() for name, store in sorted(self.stores.items())}
+        family("ttl_store_entries", "gauge", "Entries held by expiring stores",
+               (("ttl_store_entries", [("store", name)], stats["entries"]) for name, stats in store_stats.items()))
+        family("ttl_store_expired_total", "counter", "Entries removed from expiring stores on expiry",
+               (("ttl_store_expired_total", [("store", name)], stats["expired_total"]) for name, stats in store_stats.items()))
+        family("ttl_store_evicted_total", "counter", "Entries evicted from expiring stores by their caps",
+               (("ttl_store_evicted_total", [("store", name)], stats["evicted_total"]) for name, stats in store_stats.items()))
+
+        for name, read in sorted(self.gauges.items()):
+            family(name, "gauge", read.__doc__ or name, [(name, [], read())])
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _with_label(samples, label, value):
+    for name, labels, sample_value in samples:
+        yield name, [(label, value)] + labels, sample_value
+
+
+registry = Registry()
+
+# Scope of the request being handled, so collection operations can tell which route made them
+current_request = ContextVar("current_request", default=None)
+
+# Recent profiles by id, kept for an hour (see the module docstring)
+PROFILE_SECONDS = 3600
+profiles = TTLStore(ttl=PROFILE_SECONDS, max_entries=50)
+_profiling = threading.Lock()
+
+# Where worker processes sharing a data directory exchange profiles (see app.py)
+PROFILE_DIRECTORY = (
+    os.path.join(os.environ["MERGINGTON_DATA_DIR"], "profiles")
+    if int(os.environ.get("MERGINGTON_WORKERS", "1")) > 1 and os.environ.get("MERGINGTON_DATA_DIR") else None
+)
+
+
+def save_profile(profile_id, report):
+    """Keep a profile report for PROFILE_SECONDS, where every worker can find it"""
+    profiles.set(profile_id, report)
+    if PROFILE_DIRECTORY is None:
+        return
+    os.makedirs(PROFILE_DIRECTORY, exist_ok=True)
+    # Remove expired reports, then write this one atomically
+    cutoff = time.time() - PROFILE_SECONDS
+    for entry in os.scandir(PROFILE_DIRECTORY):
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.unlink(entry.path)
+        except FileNotFoundError:
+            pass
+    path = os.path.join(PROFILE_DIRECTORY, profile_id + ".txt")
+    with open(path + ".tmp", "w", encoding="utf-8") as report_file:
+        report_file.write(report)
+    os.replace(path + ".tmp", path)
+
+
+def load_profile(profile_id):
+    """A profile report saved by any worker, or None if unknown or expired"""
+    report = profiles.get(profile_id)
+    if report is not None or PROFILE_DIRECTORY is None or not profile_id.replace("-", "").replace("_", "").isalnum():
+        return report
+    path = os.path.join(PROFILE_DIRECTORY, profile_id + ".txt")
+    try:
+        if os.path.getmtime(path) < time.time() - PROFILE_SECONDS:
+            return None
+        with open(path, encoding="utf-8") as report_file:
+            return report_file.read()
+    except FileNotFoundError:
+        return None
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request metrics and, on request, profiles"""
+
+    def __init__(self, app, registry=registry):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        registry = self.registry
+        status = 500
+        profile_id = None
+        profiler = None
+        if PROFILING and (b"x-profile", b"1") in scope["headers"] and _profiling.acquire(blocking=False):
+            profile_id = secrets.token_urlsafe(8)
+            profiler = cProfile.Profile()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if profile_id is not None:
+                    message = {**message, "headers": list(message.get("headers", [])) + [
+                        (b"x-profile-id", profile_id.encode())]}
+            await send(message)
+
+        with registry._lock:
+            registry.in_flight += 1
+        request_token = current_request.set(scope)
+        started = time.perf_counter()
+        try:
+            if profiler is not None:
+                profiler.enable()
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                _profiling.release()
+                save_profile(profile_id, _format_profile(profiler, scope))
+            elapsed = time.perf_counter() - started
+            current_request.reset(request_token)
+            route = route_template(scope)
+            with registry._lock:
+                registry.in_flight -= 1
+            registry.count_request(scope["method"], route, status)
+            registry.durations.observe(elapsed, (scope["method"], route))
+
+
+def route_template(scope):
+    """The path template of the route that handled a request"""
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    if "app_root_path" in scope:
+        # Mounted applications such as /static
+        return scope.get("root_path", "")[len(scope["app_root_path"]):] or "/"
+    return "unmatched"
+
+
+def _format_profile(profiler, scope):
+    output = io.StringIO()
+    output.write(f"{scope['method']} {scope['path']}\n\n")
+    stats = pstats.Stats(profiler, stream=output)
+    stats.sort_stats("cumulative").print_stats(60)
+    return output.getvalue()
@@ -0,0 +1,135 @@
+"""
+Participant storage for activities
+
+Participants used to be plain lists, so checking, adding and removing a
+student scanned the whole list. ParticipantList keeps them in an
+insertion-ordered dict instead: membership, add and remove are O(1) while
+iteration (and JSON output) still follows signup order.
+
+MembershipIndex is the reverse mapping, from a student's email to the
+activities they are signed up for.
+"""
+
+from collections.abc import Sequence
+
+
+class ParticipantList(Sequence):
+    """Ordered collection of unique participant emails
+
+    Encodes to JSON as a plain list (see documents.json_default).
+    """
+
+    __slots__ = ('_members',)
+
+    def __init__(self, emails=()):
+        self._members = dict.fromkeys(emails)
+
+    def __contains__(self, email):
+        return email in self._members
+
+    def __iter__(self):
+        return iter(self._members)
+
+    def __reversed__(self):
+        return reversed(self._members)
+
+    def __len__(self):
+        return len(self._members)
+
+    def __getitem__(self, index):
+        return list(self._members)[index]
+
+    def __eq__(self, other):
+        if isinstance(other, ParticipantList):
+            return list(self._members) == list(other._members)
+        if isinstance(other, (list, tuple)):
+            return list(self._members) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return f"ParticipantList({list(self._members)!r})"
+
+    def append(self, email):
+        """Add a participant at the end (no-op if already present)"""
+        self._members[email] = None
+
+    add = append
+
+    def remove(self, email):
+        """Remove a participant; raises ValueError if not present"""
+        try:
+            del self._members[email]
+        except KeyError:
+            raise ValueError(f"{email!r} is not a participant") from None
+
+    def discard(self, email):
+        """Remove a participant if present"""
+        self._members.pop(email, None)
+
+    def copy(self):
+        return ParticipantList(self._members)
+
+
+def normalize_participants(doc, field="participants"):
+    """Store a document's participants as a ParticipantList"""
+    participants = doc.get(field)
+    if participants is None:
+        doc[field] = ParticipantList()
+    elif not isinstance(participants, ParticipantList):
+        doc[field] = ParticipantList(participants)
+    return doc
+
+
+class MembershipIndex:
+    """Reverse index from member (email) to the documents listing it"""
+
+    def __init__(self, field="participants"):
+        self.field = field
+        self.entries = {}
+        self._indexed = set()
+
+    def attach(self, collection):
+        """Index a collection and keep the index up to date with its changes"""
+        for key, doc in collection.data.items():
+            self._add_all(key, doc)
+        collection.subscribe(self.on_change)
+        return self
+
+    def on_change(self, operation, key, doc, update):
+        """Collection listener: apply membership changes"""
+        if update is None or self.field in update.get('$set', {}):
+            # Whole document or member list replaced
+            if key in self._indexed:
+                self._remove_all(key)
+            self._add_all(key, doc)
+            return
+
+        for operator in ('$push', '$addToSet'):
+            email = update.get(operator, {}).get(self.field)
+            if email is not None:
+                self.entries.setdefault(email, set()).add(key)
+        email = update.get('$pull', {}).get(self.field)
+        if email is not None:
+            keys = self.entries.get(email)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.entries[email]
+
+    def lookup(self, email):
+        """Keys of the documents email is a member of"""
+        return set(self.entries.get(email, ()))
+
+    def _add_all(self, key, doc):
+        for email in doc.get(self.field, ()):
+            self.entries.setdefault(email, set()).add(key)
+        self._indexed.add(key)
+
+    def _remove_all(self, key):
+        # Rare (documents replaced wholesale), so a scan is acceptable
+        for email in [email for email, keys in self.entries.items() if key in keys]:
+            keys = self.entries[email]
+            keys.discard(key)
+            if not keys:
+                del self.entries[email]
+        self._indexed.discard(key)
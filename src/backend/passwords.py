@@ -0,0 +1,124 @@
+"""
+Password hashing for the High School Management System API
+
+Argon2 is deliberately slow, so the async helpers run it on a small,
+dedicated process pool instead of the request threadpool. A burst of logins
+then queues up behind the pool rather than stalling every other request, and
+once too many jobs are waiting new ones are refused with PasswordHashingBusy.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from argon2 import PasswordHasher, profiles
+from argon2.exceptions import InvalidHashError, VerificationError
+
+from .metrics import registry
+
+# Size of the hashing pool and how many jobs may wait for it
+HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+HASH_QUEUE_LIMIT = int(os.environ.get("PASSWORD_HASH_QUEUE_LIMIT", 64))
+
+# Seconds a client is asked to wait when the pool is saturated
+RETRY_AFTER_SECONDS = 1
+
+# Argon2 cost parameters; changing them makes existing hashes get upgraded on login
+_DEFAULTS = profiles.RFC_9106_LOW_MEMORY
+ARGON2_TIME_COST = int(os.environ.get("ARGON2_TIME_COST", _DEFAULTS.time_cost))
+ARGON2_MEMORY_COST = int(os.environ.get("ARGON2_MEMORY_COST", _DEFAULTS.memory_cost))
+ARGON2_PARALLELISM = int(os.environ.get("ARGON2_PARALLELISM", _DEFAULTS.parallelism))
+
+# One configured hasher shared by every call (and inherited by pool workers)
+password_hasher = PasswordHasher(
+    time_cost=ARGON2_TIME_COST,
+    memory_cost=ARGON2_MEMORY_COST,
+    parallelism=ARGON2_PARALLELISM
+)
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = 0
+_pending_lock = threading.Lock()
+
+
+class PasswordHashingBusy(Exception):
+    """Raised when the hashing queue is full"""
+
+    def __init__(self, retry_after=RETRY_AFTER_SECONDS):
+        super().__init__("Password hashing queue is full")
+        self.retry_after = retry_after
+
+
+def hash_password(password):
+    """Hash password using Argon2"""
+    return password_hasher.hash(password)
+
+def verify_password(password, hashed_password):
+    """Verify password against hash"""
+    try:
+        return password_hasher.verify(hashed_password, password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+def password_needs_rehash(hashed_password):
+    """Whether a hash was made with other parameters than the current ones"""
+    try:
+        return password_hasher.check_needs_rehash(hashed_password)
+    except InvalidHashError:
+        return True
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=HASH_WORKERS)
+        return _executor
+
+def shutdown_pool():
+    """Stop the hashing pool (it is recreated on next use)"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+def pending_jobs():
+    """Number of hashing jobs running or waiting"""
+    return _pending
+
+registry.gauges["password_hash_jobs_pending"] = pending_jobs
+
+async def _run(func, *args):
+    """Run func(*args) on the hashing pool; returns (result, elapsed milliseconds)"""
+    global _pending
+    with _pending_lock:
+        if _pending >= HASH_QUEUE_LIMIT:
+            raise PasswordHashingBusy()
+        _pending += 1
+    try:
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(_get_executor(), func, *args)
+        elapsed = time.perf_counter() - start
+        registry.hash_seconds.observe(elapsed, (func.__name__,))
+        return result, elapsed * 1000
+    finally:
+        with _pending_lock:
+            _pending -= 1
+
+async def hash_password_async(password):
+    """Hash password on the hashing pool; returns (hash, elapsed milliseconds)"""
+    return await _run(hash_password, password)
+
+async def verify_password_async(password, hashed_password):
+    """Verify password on the hashing pool; returns (is_valid, elapsed milliseconds)"""
+    return await _run(verify_password, password, hashed_password)
+
+
+def server_timing(elapsed_ms):
+    """Server-Timing header value reporting time spent hashing"""
+    return f"hash;dur={elapsed_ms:.1f}"
@@ -0,0 +1,257 @@
+"""
+Compiled query matchers for the in-memory collections
+
+A query dict is compiled once into a tree of small closures instead of being
+re-interpreted for every document. Compilation is keyed by the query's
+shape (its fields and operators, with the values taken out), so
+{"schedule_details.days": {"$in": ["Monday"]}} and the same filter for
+"Tuesday" share one compiled plan from a small LRU cache. The values are
+bound to the plan afterwards, once per query.
+
+Supported: equality, $eq, $ne, $in, $nin, $gt, $gte, $lt, $lte, $exists,
+$size on any dotted path (several operators per field are all applied),
+plus $and, $or, $nor and $expr at the top level. Array fields match when
+any element matches, as in MongoDB.
+"""
+
+from functools import lru_cache
+
+from .aggregation import evaluate_expression
+from .indexes import MISSING
+from .participants import ParticipantList
+
+ARRAY_TYPES = (list, tuple, ParticipantList)
+
+LOGICAL_OPERATORS = ('$and', '$or', '$nor')
+
+
+def compile_query(query):
+    """Return predicate(doc, key=MISSING) -> bool for a query dict
+
+    key is the document's _id when it is stored outside the document.
+    """
+    if not query:
+        return _match_all
+    values = []
+    shape = _parameterize(query, values)
+    node, preparers = _compile_shape(shape)
+    params = tuple(prepare(value) for prepare, value in zip(preparers, values))
+
+    def predicate(doc, key=MISSING):
+        return node(doc, key, params)
+    return predicate
+
+
+def _match_all(doc, key=MISSING):
+    return True
+
+
+def query_shape(query):
+    """The query with its values replaced by "?", as reported by explain() and the slow-operation log"""
+    shape = {}
+    for field, condition in (query or {}).items():
+        if field in LOGICAL_OPERATORS:
+            shape[field] = [query_shape(sub_query) for sub_query in condition]
+        elif isinstance(condition, dict) and condition and all(op.startswith('$') for op in condition):
+            shape[field] = {operator: "?" for operator in condition}
+        else:
+            shape[field] = "?"
+    return shape
+
+
+# Shapes: queries with their values replaced by parameter slots
+
+def _parameterize(query, values):
+    shape = []
+    for field, condition in query.items():
+        if field in LOGICAL_OPERATORS:
+            shape.append((field, tuple(_parameterize(sub_query, values) for sub_query in condition)))
+        elif field == '$expr':
+            values.append(condition)
+            shape.append((field, len(values) - 1))
+        elif isinstance(condition, dict) and condition and all(op.startswith('$') for op in condition):
+            operators = []
+            for operator, operand in condition.items():
+                values.append(operand)
+                operators.append((operator, len(values) - 1))
+            shape.append((field, tuple(operators)))
+        else:
+            values.append(condition)
+            shape.append((field, (('$eq', len(values) - 1),)))
+    return tuple(shape)
+
+
+@lru_cache(maxsize=256)
+def _compile_shape(shape):
+    """Compile a query shape into (node, preparers), cached by shape"""
+    preparers = {}
+    node = _compile_query(shape, preparers)
+    return node, [preparers[slot] for slot in range(len(preparers))]
+
+
+def _compile_query(shape, preparers):
+    nodes = [_compile_clause(field, spec, preparers) for field, spec in shape]
+    if len(nodes) == 1:
+        return nodes[0]
+
+    def match_all(doc, key, params):
+        for node in nodes:
+            if not node(doc, key, params):
+                return False
+        return True
+    return match_all
+
+
+def _compile_clause(field, spec, preparers):
+    if field in LOGICAL_OPERATORS:
+        nodes = [_compile_query(sub_shape, preparers) for sub_shape in spec]
+        if field == '$and':
+            return lambda doc, key, params: all(node(doc, key, params) for node in nodes)
+        if field == '$or':
+            return lambda doc, key, params: any(node(doc, key, params) for node in nodes)
+        return lambda doc, key, params: not any(node(doc, key, params) for node in nodes)
+
+    if field == '$expr':
+        preparers[spec] = _identity
+        return lambda doc, key, params: bool(evaluate_expression(doc, params[spec]))
+
+    getter = _compile_getter(field)
+    tests = []
+    for operator, slot in spec:
+        if operator not in _OPERATORS:
+            raise ValueError(f"Unsupported query operator: {operator}")
+        make_test, prepare = _OPERATORS[operator]
+        preparers[slot] = prepare
+        tests.append(make_test(slot))
+
+    if len(tests) == 1:
+        test = tests[0]
+        return lambda doc, key, params: test(getter(doc, key), params)
+
+    def match_field(doc, key, params):
+        value = getter(doc, key)
+        for test in tests:
+            if not test(value, params):
+                return False
+        return True
+    return match_field
+
+
+def _compile_getter(path):
+    """Return getter(doc, key) for a dotted path, split once at compile time"""
+    if path == '_id':
+        def get_id(doc, key):
+            if key is not MISSING:
+                return key
+            return doc.get('_id', MISSING)
+        return get_id
+
+    parts = tuple(path.split('.'))
+    if len(parts) == 1:
+        field = parts[0]
+        return lambda doc, key: doc.get(field, MISSING)
+
+    def get_path(doc, key):
+        value = doc
+        for part in parts:
+            try:
+                value = value[part]
+            except (KeyError, TypeError, IndexError):
+                return MISSING
+        return value
+    return get_path
+
+
+# Operators: (make_test(slot) -> test(value, params), prepare(operand))
+
+def _identity(operand):
+    return operand
+
+
+def _prepare_in(operand):
+    """Keep $in values as a set for O(1) lookups, plus the list for unhashable ones"""
+    values = list(operand)
+    try:
+        return frozenset(values), values
+    except TypeError:
+        return None, values
+
+
+def _contains(prepared, value):
+    lookup, values = prepared
+    if lookup is not None:
+        try:
+            return value in lookup
+        except TypeError:
+            pass
+    return value in values
+
+
+def _equals(value, target):
+    if value is MISSING:
+        return target is None
+    if value == target:
+        return True
+    if isinstance(value, ARRAY_TYPES):
+        try:
+            return target in value
+        except TypeError:
+            return False
+    return False
+
+
+def _make_eq(slot):
+    return lambda value, params: _equals(value, params[slot])
+
+def _make_ne(slot):
+    return lambda value, params: not _equals(value, params[slot])
+
+def _make_in(slot):
+    def test(value, params):
+        prepared = params[slot]
+        if value is MISSING:
+            return _contains(prepared, None)
+        if isinstance(value, ARRAY_TYPES):
+            return any(_contains(prepared, item) for item in value)
+        return _contains(prepared, value)
+    return test
+
+def _make_nin(slot):
+    test_in = _make_in(slot)
+    return lambda value, params: not test_in(value, params)
+
+def _make_comparison(compare):
+    def make(slot):
+        def test(value, params):
+            if value is MISSING or value is None:
+                return False
+            bound = params[slot]
+            try:
+                if isinstance(value, ARRAY_TYPES):
+                    return any(compare(item, bound) for item in value)
+                return compare(value, bound)
+            except TypeError:
+                # Values of different types never match a comparison
+                return False
+        return test
+    return make
+
+def _make_exists(slot):
+    return lambda value, params: (value is not MISSING) == bool(params[slot])
+
+def _make_size(slot):
+    return lambda value, params: isinstance(value, ARRAY_TYPES) and len(value) == params[slot]
+
+
+_OPERATORS = {
+    '$eq': (_make_eq, _identity),
+    '$ne': (_make_ne, _identity),
+    '$in': (_make_in, _prepare_in),
+    '$nin': (_make_nin, _prepare_in),
+    '$gt': (_make_comparison(lambda a, b: a > b), _identity),
+    '$gte': (_make_comparison(lambda a, b: a >= b), _identity),
+    '$lt': (_make_comparison(lambda a, b: a < b), _identity),
+    '$lte': (_make_comparison(lambda a, b: a <= b), _identity),
+    '$exists': (_make_exists, _identity),
+    '$size': (_make_size, _identity),
+}
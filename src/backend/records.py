@@ -0,0 +1,293 @@
+"""
+Compact storage for activity documents
+
+A plain activity document is a dict holding a sub-dict for its schedule, a
+human-readable schedule string that repeats the same information and the
+full email address of every participant. ActivityRecord stores the same
+activity in fixed slots instead:
+
+- days are interned strings in a tuple and times are minutes since midnight
+- the schedule string is only kept when it differs from the one
+  format_schedule() would produce from the days and times
+- participants are ids into a shared table of emails, held in an array
+
+Records are MutableMappings, so the collection, its indexes and the routers
+use them exactly like dicts; nested values such as schedule_details are
+built on access. They are enabled with MERGINGTON_COMPACT_RECORDS=1 (see
+database.normalize_activity).
+"""
+
+import sys
+from array import array
+from collections.abc import MutableMapping
+
+from .indexes import MISSING
+from .participants import ParticipantList
+from .schedule import format_schedule, format_time, parse_time
+
+
+class InternTable:
+    """Two-way mapping between values and small integer ids"""
+
+    def __init__(self):
+        self.values = []
+        self.ids = {}
+
+    def intern(self, value):
+        """Id for value, assigning the next one if it is new"""
+        value_id = self.ids.get(value)
+        if value_id is None:
+            value_id = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return value_id
+
+    def lookup(self, value):
+        """Id for value, or None if it was never interned"""
+        return self.ids.get(value)
+
+    def __len__(self):
+        return len(self.values)
+
+
+# Participant emails shared by every compact record
+student_ids = InternTable()
+
+
+# Lists longer than this also keep a set of their ids for membership tests.
+# Scanning the array costs about 30ns per id, while a set costs at least
+# 700 bytes, more than a whole small record (see benchmarks.participants)
+ID_SET_THRESHOLD = 32
+
+
+class InternedParticipantList(ParticipantList):
+    """ParticipantList holding student ids (4 bytes each) instead of emails
+
+    Membership tests scan the array while it is short and use a set of the
+    ids once it grows past ID_SET_THRESHOLD; use MembershipIndex for lookups
+    across activities.
+    """
+
+    __slots__ = ('_ids', '_id_set')
+
+    def __init__(self, emails=()):
+        self._ids = array('I')
+        self._id_set = None
+        for email in emails:
+            self.append(email)
+
+    def _has(self, student_id):
+        if self._id_set is not None:
+            return student_id in self._id_set
+        return student_id in self._ids
+
+    def __contains__(self, email):
+        student_id = student_ids.lookup(email)
+        return student_id is not None and self._has(student_id)
+
+    def __iter__(self):
+        values = student_ids.values
+        return (values[student_id] for student_id in self._ids)
+
+    def __reversed__(self):
+        values = student_ids.values
+        return (values[student_id] for student_id in reversed(self._ids))
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [student_ids.values[student_id] for student_id in self._ids[index]]
+        return student_ids.values[self._ids[index]]
+
+    def __eq__(self, other):
+        if isinstance(other, (ParticipantList, list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return f"InternedParticipantList({list(self)!r})"
+
+    def append(self, email):
+        """Add a participant at the end (no-op if already present)"""
+        student_id = student_ids.intern(email)
+        if self._has(student_id):
+            return
+        self._ids.append(student_id)
+        if self._id_set is not None:
+            self._id_set.add(student_id)
+        elif len(self._ids) > ID_SET_THRESHOLD:
+            self._id_set = set(self._ids)
+
+    add = append
+
+    def remove(self, email):
+        """Remove a participant; raises ValueError if not present"""
+        student_id = student_ids.lookup(email)
+        if student_id is None or not self._has(student_id):
+            raise ValueError(f"{email!r} is not a participant")
+        self._ids.remove(student_id)
+        if self._id_set is not None:
+            self._id_set.discard(student_id)
+
+    def discard(self, email):
+        """Remove a participant if present"""
+        if email in self:
+            self.remove(email)
+
+    def copy(self):
+        return ParticipantList(self)
+
+
+_FIELDS = ('description', 'schedule', 'schedule_details', 'max_participants', 'participants')
+
+
+class ActivityRecord(MutableMapping):
+    """Slotted, dict-compatible activity document"""
+
+    __slots__ = ('_description', '_schedule', '_days', '_start', '_end',
+                 '_max_participants', '_participants', '_extra')
+
+    def __init__(self, doc=()):
+        self._description = MISSING
+        self._schedule = MISSING
+        self._days = MISSING
+        self._start = self._end = 0
+        self._max_participants = MISSING
+        self._participants = MISSING
+        # Fields other than the known ones, and schedules that do not fit the slots
+        self._extra = None
+        self.update(doc)
+
+    def __getitem__(self, field):
+        if field == 'description' and self._description is not MISSING:
+            return self._description
+        if field == 'schedule':
+            if self._schedule is None:
+                return format_schedule(self._days, self._start, self._end)
+            if self._schedule is not MISSING:
+                return self._schedule
+        elif field == 'schedule_details' and self._days is not MISSING:
+            return {
+                'days': list(self._days),
+                'start_time': format_time(self._start),
+                'end_time': format_time(self._end),
+            }
+        elif field == 'max_participants' and self._max_participants is not MISSING:
+            return self._max_participants
+        elif field == 'participants' and self._participants is not MISSING:
+            return self._participants
+        if self._extra is not None and field in self._extra:
+            return self._extra[field]
+        raise KeyError(field)
+
+    def __setitem__(self, field, value):
+        if field == 'description' and isinstance(value, str):
+            self._description = value
+        elif field == 'schedule' and isinstance(value, str):
+            self._schedule = value
+            self._compact_schedule()
+        elif field == 'schedule_details' and self._set_schedule_details(value):
+            pass
+        elif field == 'max_participants' and isinstance(value, int):
+            self._max_participants = value
+        elif field == 'participants' and not isinstance(value, (str, dict)):
+            self._participants = value if isinstance(value, InternedParticipantList) else InternedParticipantList(value)
+        else:
+            self._discard_slot(field)
+            if self._extra is None:
+                self._extra = {}
+            self._extra[field] = value
+            return
+        if self._extra is not None:
+            self._extra.pop(field, None)
+
+    def __delitem__(self, field):
+        if field not in self:
+            raise KeyError(field)
+        self._discard_slot(field)
+        if self._extra is not None:
+            self._extra.pop(field, None)
+
+    def __iter__(self):
+        for field in _FIELDS:
+            if self._has_slot(field):
+                yield field
+        if self._extra is not None:
+            yield from self._extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __contains__(self, field):
+        return self._has_slot(field) or (self._extra is not None and field in self._extra)
+
+    def __repr__(self):
+        return f"ActivityRecord({self.to_dict()!r})"
+
+    def setdefault(self, field, default=None):
+        # Return the stored value: participants are converted on assignment
+        if field not in self:
+            self[field] = default
+        return self[field]
+
+    def copy(self):
+        """Return a plain dict copy"""
+        doc = self.to_dict()
+        if 'participants' in doc:
+            doc['participants'] = self._participants.copy()
+        return doc
+
+    def to_dict(self):
+        return {field: self[field] for field in self}
+
+    def _has_slot(self, field):
+        if field == 'schedule':
+            return self._schedule is not MISSING
+        if field == 'schedule_details':
+            return self._days is not MISSING
+        if field in _FIELDS:
+            return getattr(self, '_' + field) is not MISSING
+        return False
+
+    def _discard_slot(self, field):
+        if field == 'schedule_details':
+            self._expand_schedule()
+            self._days = MISSING
+        elif field in _FIELDS:
+            setattr(self, '_' + field, MISSING)
+
+    def _set_schedule_details(self, value):
+        """Store a schedule in the day/time slots; False if it does not fit them"""
+        if not isinstance(value, dict) or set(value) != {'days', 'start_time', 'end_time'}:
+            return False
+        days = value['days']
+        if not isinstance(days, (list, tuple)) or not all(isinstance(day, str) for day in days):
+            return False
+        try:
+            start, end = parse_time(value['start_time']), parse_time(value['end_time'])
+        except ValueError:
+            return False
+        self._expand_schedule()
+        self._days = tuple(sys.intern(day) for day in days)
+        self._start, self._end = start, end
+        self._compact_schedule()
+        return True
+
+    def _compact_schedule(self):
+        # Drop the schedule string when the days and times reproduce it
+        if (isinstance(self._schedule, str) and self._days is not MISSING
+                and self._schedule == format_schedule(self._days, self._start, self._end)):
+            self._schedule = None
+
+    def _expand_schedule(self):
+        # Keep the schedule string before the days and times it is derived from change
+        if self._schedule is None:
+            self._schedule = format_schedule(self._days, self._start, self._end)
+
+
+def compact_activity(doc):
+    """ActivityRecord holding doc's fields (doc itself if it already is one)"""
+    if isinstance(doc, ActivityRecord):
+        return doc
+    return ActivityRecord(doc)
@@ -2,23 +2,124 @@
 Endpoints for the High School Management System API
 """
 
-from fastapi import APIRouter, HTTPException, Query
-from fastapi.responses import RedirectResponse
-from typing import Dict, Any, Optional, List
+import base64
+import csv
+import io
 
-from ..database import activities_collection, teachers_collection
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
+from pydantic import BaseModel, ConfigDict, ValidationError
+from typing import Dict, Any, Optional, List, Literal
+
+from ..database import (
+    activities_collection, activities_search, activity_events, activity_memberships, activity_schedules,
+    async_activities_collection
+)
+from ..cache import ResponseCache, cached_json_response
+from ..documents import dumps, iter_dumps
+from ..schedule import MINUTES_PER_DAY, format_time, parse_time
+from ..sessions import Session, current_teacher
 
 router = APIRouter(
     prefix="/activities",
     tags=["activities"]
 )
 
-@router.get("", response_model=Dict[str, Any])
-@router.get("/", response_model=Dict[str, Any])
-def get_activities(
+# Encoded GET responses, rebuilt when the activities change
+response_cache = ResponseCache()
+
+# Short names accepted by the sort= parameter
+SORT_FIELDS = {
+    "name": "_id",
+    "start_time": "schedule_details.start_time",
+    "end_time": "schedule_details.end_time",
+    "max_participants": "max_participants",
+}
+
+# Response schemas. Endpoints return documents already encoded to JSON, so
+# these only describe the responses in the OpenAPI docs; no model instance is
+# built or validated per request.
+
+class ScheduleDetails(BaseModel):
+    days: List[str]
+    start_time: str
+    end_time: str
+
+class Activity(BaseModel):
+    """An activity; fields= may leave out any field"""
+    model_config = ConfigDict(extra="allow")
+
+    description: Optional[str] = None
+    schedule: Optional[str] = None
+    schedule_details: Optional[ScheduleDetails] = None
+    max_participants: Optional[int] = None
+    participants: Optional[List[str]] = None
+
+class DayOccupancy(BaseModel):
+    day: str
+    activities: int
+    enrolled: int
+    capacity: int
+    fill_rate: Optional[float]
+
+class ScheduleConflict(BaseModel):
+    day: str
+    start_time: str
+    end_time: str
+    activities: List[str]
+
+def encode_cursor(offset: int) -> str:
+    """Encode a page offset as an opaque cursor"""
+    return base64.urlsafe_b64encode(str(offset).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> int:
+    """Decode a cursor produced by encode_cursor"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        offset = int(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if offset < 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return offset
+
+def parse_time_param(name: str, value: Optional[str], default: int) -> int:
+    """Minutes since midnight for a time query parameter, 400 if malformed"""
+    if not value:
+        return default
+    try:
+        return parse_time(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be a time like '15:30'")
+
+def build_schedule_query(day: Optional[str], start_time: Optional[str], end_time: Optional[str]) -> Dict[str, Any]:
+    """Build the collection query for the day and time filters, 400 if a time is malformed"""
+    query = {}
+    
+    if day:
+        query["schedule_details.days"] = {"$in": [day]}
+    
+    # Stored times are zero-padded "HH:MM", so '9:00' is compared as '09:00'
+    if start_time:
+        query["schedule_details.start_time"] = {"$gte": format_time(parse_time_param("start_time", start_time, 0))}
+    
+    if end_time:
+        query["schedule_details.end_time"] = {"$lte": format_time(parse_time_param("end_time", end_time, 0))}
+    
+    return query
+
+@router.get("", response_model=Dict[str, Activity])
+@router.get("/", response_model=Dict[str, Activity])
+async def get_activities(
+    request: Request,
     day: Optional[str] = None,
     start_time: Optional[str] = None,
-    end_time: Optional[str] = None
+    end_time: Optional[str] = None,
+    fields: Optional[str] = None,
+    sort: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    stream: bool = False
 ) -> Dict[str, Any]:
     """
     Get all activities with their details, with optional filtering by day and time
@@ -26,103 +127,367 @@ def get_activities(
     - day: Filter activities occurring on this day (e.g., 'Monday', 'Tuesday')
     - start_time: Filter activities starting at or after this time (24-hour format, e.g., '14:30')
     - end_time: Filter activities ending at or before this time (24-hour format, e.g., '17:00')
+    - fields: Comma-separated fields to return (e.g., 'description,schedule_details')
+    - sort: Field to sort by (name, start_time, end_time, max_participants), prefix with '-' for descending
+    - limit: Maximum number of activities to return
+    - cursor: Continue from a previous page, as given by the X-Next-Cursor header
+    - stream: Send the activities in chunks as they are encoded, for large listings
+    
+    Responses carry an ETag; send it back in If-None-Match to get 304 Not Modified.
+    Streamed responses are neither cached nor given an ETag.
     """
     # Build the query based on provided filters
-    query = {}
+    query = build_schedule_query(day, start_time, end_time)
     
-    if day:
-        query["schedule_details.days"] = {"$in": [day]}
+    projection = None
+    if fields:
+        projection = {field.strip(): 1 for field in fields.split(",") if field.strip()}
     
-    if start_time:
-        query["schedule_details.start_time"] = {"$gte": start_time}
+    sort_spec = None
+    if sort:
+        direction = -1 if sort.startswith("-") else 1
+        sort_name = sort.lstrip("-")
+        if sort_name not in SORT_FIELDS:
+            raise HTTPException(status_code=400, detail=f"Cannot sort by '{sort_name}'")
+        sort_spec = [(SORT_FIELDS[sort_name], direction)]
     
-    if end_time:
-        query["schedule_details.end_time"] = {"$lte": end_time}
+    skip = decode_cursor(cursor) if cursor else 0
+    
+    def select():
+        # Query the database, sharing the stored documents instead of copying them.
+        # One extra document is fetched to learn whether another page follows.
+        activities = {}
+        has_more = False
+        for activity in activities_collection.find(
+            query,
+            projection=projection,
+            sort=sort_spec,
+            skip=skip,
+            limit=limit + 1 if limit else 0,
+            view=True
+        ):
+            if limit and len(activities) == limit:
+                has_more = True
+                break
+            if projection is None:
+                activities[activity['_id']] = activity.without_id()
+            else:
+                activities[activity.pop('_id')] = activity
+        
+        headers = {"X-Next-Cursor": encode_cursor(skip + limit)} if has_more else {}
+        return activities, headers
+    
+    def build():
+        activities, headers = select()
+        return dumps(activities), headers
     
-    # Query the database
+    if stream:
+        activities, headers = select()
+        
+        async def chunks():
+            # Encoded between sends, so other requests run while a large listing goes out
+            for chunk in iter_dumps(activities.items()):
+                yield chunk
+        
+        return StreamingResponse(chunks(), media_type="application/json", headers=headers)
+    
+    # Equivalent requests share a cache entry however their parameters were written
+    cache_key = (
+        "activities",
+        dumps(query),
+        tuple(sorted(projection)) if projection else None,
+        tuple(sort_spec) if sort_spec else None,
+        skip,
+        limit
+    )
+    return cached_json_response(request, response_cache, cache_key, activities_collection.version, build)
+
+@router.get("/search", response_model=Dict[str, Activity])
+async def search_activities(
+    q: str,
+    day: Optional[str] = None,
+    start_time: Optional[str] = None,
+    end_time: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Search activities by name, description and schedule, best matches first
+    
+    - q: Search text; each word also matches longer words it is the start of
+    - day, start_time, end_time: Same filters as GET /activities
+    - limit: Maximum number of activities to return
+    - cursor: Continue from a previous page, as given by the X-Next-Cursor header
+    
+    When more matches follow, the response carries an X-Next-Cursor header.
+    """
+    query = build_schedule_query(day, start_time, end_time)
+    skip = decode_cursor(cursor) if cursor else 0
+    
+    # Matches before the cursor are skipped; one match past the page means another page follows
+    activities = {}
+    matched = 0
+    has_more = False
+    for name, _score in activities_search.search(q):
+        activity = await async_activities_collection.find_one({"_id": name, **query}, view=True)
+        if activity is None:
+            continue
+        matched += 1
+        if matched <= skip:
+            continue
+        if len(activities) == limit:
+            has_more = True
+            break
+        activities[name] = activity.without_id()
+    
+    headers = {"X-Next-Cursor": encode_cursor(skip + limit)} if has_more else {}
+    return Response(content=dumps(activities), media_type="application/json", headers=headers)
+
+@router.get("/enrolled", response_model=Dict[str, Activity])
+async def get_student_activities(email: str) -> Dict[str, Any]:
+    """Get the activities a student is signed up for"""
     activities = {}
-    for activity in activities_collection.find(query):
-        name = activity.pop('_id')
-        activities[name] = activity
+    for name in sorted(activity_memberships.lookup(email)):
+        activity = await async_activities_collection.find_one({"_id": name}, view=True)
+        if activity is not None:
+            activities[name] = activity.without_id()
     
-    return activities
+    return Response(content=dumps(activities), media_type="application/json")
+
+@router.get("/stream")
+async def stream_occupancy(request: Request) -> StreamingResponse:
+    """
+    Stream participant changes as server-sent events
+    
+    'occupancy' events carry a list of deltas, one per changed activity:
+    {"activity", "count", "added", "removed"}, or {"activity", "count",
+    "participants"} when the whole list was replaced. A 'resync' event means
+    changes were dropped because the client fell behind; reload /activities.
+    """
+    return StreamingResponse(
+        activity_events.events(request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/running", response_model=Dict[str, Activity])
+async def get_running_activities(
+    request: Request,
+    day: str,
+    start_time: Optional[str] = None,
+    end_time: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Get the activities running on a day at any time within a window, earliest first
+    
+    - day: Day of the week (e.g., 'Tuesday')
+    - start_time, end_time: The window (24-hour format); defaults to the whole day
+    """
+    start = parse_time_param("start_time", start_time, 0)
+    end = parse_time_param("end_time", end_time, MINUTES_PER_DAY)
+    
+    def build():
+        keys = activity_schedules.running(day, start, end)
+        activities = {}
+        for activity in activities_collection.find(
+            {"_id": {"$in": list(keys)}},
+            sort=[("schedule_details.start_time", 1), ("_id", 1)],
+            view=True
+        ):
+            activities[activity["_id"]] = activity.without_id()
+        return dumps(activities), {}
+    
+    cache_key = ("running", day, start, end)
+    return cached_json_response(request, response_cache, cache_key, activities_collection.version, build)
+
+@router.get("/conflicts", response_model=List[ScheduleConflict])
+async def get_schedule_conflicts(email: str) -> List[Dict[str, Any]]:
+    """
+    Get the overlapping activities in a student's schedule
+    
+    Each conflict names two activities the student is signed up for that
+    meet at the same time, with the day and the overlapping time span.
+    """
+    conflicts = [
+        {
+            "day": day,
+            "start_time": format_time(start),
+            "end_time": format_time(end),
+            "activities": [first, second]
+        }
+        for day, start, end, first, second in activity_schedules.conflicts(activity_memberships.lookup(email))
+    ]
+    return Response(content=dumps(conflicts), media_type="application/json")
 
 @router.get("/days", response_model=List[str])
-def get_available_days() -> List[str]:
+async def get_available_days(request: Request) -> List[str]:
     """Get a list of all days that have activities scheduled"""
-    # Aggregate to get unique days across all activities
-    pipeline = [
-        {"$unwind": "$schedule_details.days"},
-        {"$group": {"_id": "$schedule_details.days"}},
-        {"$sort": {"_id": 1}}  # Sort days alphabetically
-    ]
+    def build():
+        # Aggregate to get unique days across all activities
+        pipeline = [
+            {"$unwind": "$schedule_details.days"},
+            {"$group": {"_id": "$schedule_details.days"}},
+            {"$sort": {"_id": 1}}  # Sort days alphabetically
+        ]
+        
+        days = []
+        for day_doc in activities_collection.aggregate(pipeline):
+            days.append(day_doc["_id"])
+        
+        return dumps(days), {}
     
-    days = []
-    for day_doc in activities_collection.aggregate(pipeline):
-        days.append(day_doc["_id"])
+    return cached_json_response(request, response_cache, ("days",), activities_collection.version, build)
+
+@router.get("/reports/occupancy", response_model=List[DayOccupancy])
+async def get_occupancy_report(request: Request) -> List[Dict[str, Any]]:
+    """Get enrolment, capacity and fill rate per day of the week"""
+    def build():
+        pipeline = [
+            {"$unwind": "$schedule_details.days"},
+            {"$group": {
+                "_id": "$schedule_details.days",
+                "activities": {"$count": {}},
+                "enrolled": {"$sum": {"$size": "$participants"}},
+                "capacity": {"$sum": "$max_participants"}
+            }},
+            {"$project": {
+                "_id": 0,
+                "day": "$_id",
+                "activities": 1,
+                "enrolled": 1,
+                "capacity": 1,
+                "fill_rate": {"$divide": ["$enrolled", "$capacity"]}
+            }},
+            {"$sort": {"day": 1}}
+        ]
+        return dumps(list(activities_collection.aggregate(pipeline))), {}
     
-    return days
+    return cached_json_response(request, response_cache, ("occupancy",), activities_collection.version, build)
+
+class Enrolment(BaseModel):
+    activity: str
+    email: str
+    action: Literal["signup", "unregister"] = "signup"
+
+class BulkEnrolment(BaseModel):
+    items: List[Enrolment]
+
+# Largest number of enrolment changes accepted in one bulk request
+MAX_BULK_ITEMS = 5000
+
+def enrolment_write(activity_name: str, email: str, action: str) -> Dict[str, Any]:
+    """The collection write that signs a student up for, or removes them from, an activity"""
+    if action == "signup":
+        # Add the student only if not already signed up and a spot is free. The
+        # checks and the change happen atomically, so concurrent signups cannot
+        # double-book a student or overfill the activity. The conditions are in
+        # the order their failures are reported (see enrolment_error).
+        return {
+            "filter": {
+                "_id": activity_name,
+                "participants": {"$ne": email},
+                "$expr": {"$lt": [{"$size": "$participants"}, "$max_participants"]}
+            },
+            "update": {"$addToSet": {"participants": email}}
+        }
+    return {
+        "filter": {"_id": activity_name, "participants": email},
+        "update": {"$pull": {"participants": email}}
+    }
+
+# Why an enrolment write matched nothing, by the filter condition that failed
+ENROLMENT_ERRORS = {
+    ("signup", "_id"): (404, "Activity not found"),
+    ("signup", "participants"): (400, "Already signed up for this activity"),
+    ("signup", "$expr"): (400, "Activity is full"),
+    ("unregister", "_id"): (404, "Activity not found"),
+    ("unregister", "participants"): (400, "Not registered for this activity"),
+}
+
+def enrolment_error(action: str, result) -> Optional[HTTPException]:
+    """Why an enrolment write changed nothing (None if it succeeded)
+    
+    The collection diagnoses a failed write while applying it, so the reason
+    holds even when later writes of the same batch change the activity.
+    """
+    if result.modified_count:
+        return None
+    status_code, detail = ENROLMENT_ERRORS[(action, result.unmatched_by)]
+    return HTTPException(status_code=status_code, detail=detail)
 
 @router.post("/{activity_name}/signup")
-def signup_for_activity(activity_name: str, email: str, teacher_username: Optional[str] = Query(None)):
+async def signup_for_activity(activity_name: str, email: str, teacher: Session = Depends(current_teacher)):
     """Sign up a student for an activity - requires teacher authentication"""
-    # Check teacher authentication
-    if not teacher_username:
-        raise HTTPException(status_code=401, detail="Authentication required for this action")
-    
-    teacher = teachers_collection.find_one({"_id": teacher_username})
-    if not teacher:
-        raise HTTPException(status_code=401, detail="Invalid teacher credentials")
-    
-    # Get the activity
-    activity = activities_collection.find_one({"_id": activity_name})
-    if not activity:
-        raise HTTPException(status_code=404, detail="Activity not found")
-
-    # Validate student is not already signed up
-    if email in activity["participants"]:
-        raise HTTPException(
-            status_code=400, detail="Already signed up for this activity")
-
-    # Add student to participants
-    result = activities_collection.update_one(
-        {"_id": activity_name},
-        {"$push": {"participants": email}}
-    )
-
-    if result.modified_count == 0:
-        raise HTTPException(status_code=500, detail="Failed to update activity")
+    write = enrolment_write(activity_name, email, "signup")
+    result = await async_activities_collection.update_one(write["filter"], write["update"])
+    error = enrolment_error("signup", result)
+    if error:
+        raise error
     
     return {"message": f"Signed up {email} for {activity_name}"}
 
 @router.post("/{activity_name}/unregister")
-def unregister_from_activity(activity_name: str, email: str, teacher_username: Optional[str] = Query(None)):
+async def unregister_from_activity(activity_name: str, email: str, teacher: Session = Depends(current_teacher)):
     """Remove a student from an activity - requires teacher authentication"""
-    # Check teacher authentication
-    if not teacher_username:
-        raise HTTPException(status_code=401, detail="Authentication required for this action")
-    
-    teacher = teachers_collection.find_one({"_id": teacher_username})
-    if not teacher:
-        raise HTTPException(status_code=401, detail="Invalid teacher credentials")
-    
-    # Get the activity
-    activity = activities_collection.find_one({"_id": activity_name})
-    if not activity:
-        raise HTTPException(status_code=404, detail="Activity not found")
-
-    # Validate student is signed up
-    if email not in activity["participants"]:
-        raise HTTPException(
-            status_code=400, detail="Not registered for this activity")
-
-    # Remove student from participants
-    result = activities_collection.update_one(
-        {"_id": activity_name},
-        {"$pull": {"participants": email}}
-    )
+    write = enrolment_write(activity_name, email, "unregister")
+    result = await async_activities_collection.update_one(write["filter"], write["update"])
+    error = enrolment_error("unregister", result)
+    if error:
+        raise error
+    
+    return {"message": f"Unregistered {email} from {activity_name}"}
+
+async def apply_enrolments(items: List[Enrolment]) -> Dict[str, Any]:
+    """Apply enrolment changes in one bulk write and report each item's outcome"""
+    if len(items) > MAX_BULK_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_ITEMS} items per request")
+    
+    requests = [{"update_one": enrolment_write(item.activity, item.email, item.action)} for item in items]
+    bulk_result = await async_activities_collection.bulk_write(requests)
+    
+    results = []
+    for item, result in zip(items, bulk_result.results):
+        error = enrolment_error(item.action, result)
+        outcome = {"activity": item.activity, "email": item.email, "action": item.action}
+        if error:
+            outcome.update({"status": "error", "status_code": error.status_code, "detail": error.detail})
+        else:
+            outcome["status"] = "ok"
+        results.append(outcome)
+    
+    succeeded = sum(1 for outcome in results if outcome["status"] == "ok")
+    return {"succeeded": succeeded, "failed": len(results) - succeeded, "results": results}
 
-    if result.modified_count == 0:
-        raise HTTPException(status_code=500, detail="Failed to update activity")
+@router.post("/bulk")
+async def bulk_enrol(enrolments: BulkEnrolment, teacher: Session = Depends(current_teacher)) -> Dict[str, Any]:
+    """
+    Sign up or remove many students at once - requires teacher authentication
+    
+    Each item names an activity, a student email and an action ('signup' or
+    'unregister'). Items are applied in order; failures do not stop later
+    items and are reported per item.
+    """
+    return await apply_enrolments(enrolments.items)
+
+@router.post("/bulk/csv")
+async def bulk_enrol_csv(request: Request, teacher: Session = Depends(current_teacher)) -> Dict[str, Any]:
+    """
+    Sign up or remove many students from a CSV upload - requires teacher authentication
+    
+    The request body is CSV text with a header row of activity,email and an
+    optional action column ('signup' by default).
+    """
+    text = (await request.body()).decode("utf-8-sig")
+    reader = csv.DictReader(io.StringIO(text))
+    if not reader.fieldnames or not {"activity", "email"} <= {name.strip() for name in reader.fieldnames}:
+        raise HTTPException(status_code=400, detail="CSV must have activity and email columns")
+    
+    items = []
+    for line_number, row in enumerate(reader, start=2):
+        row = {key.strip(): (value or "").strip() for key, value in row.items() if key}
+        try:
+            items.append(Enrolment(activity=row["activity"], email=row["email"], action=row.get("action") or "signup"))
+        except ValidationError:
+            raise HTTPException(status_code=400, detail=f"Invalid row on line {line_number}")
     
-    return {"message": f"Unregistered {email} from {activity_name}"}
\ No newline at end of file
+    return await apply_enrolments(items)
@@ -2,12 +2,15 @@
 Authentication endpoints for the High School Management System API
 """
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from typing import Dict, Any
 import hashlib
+import hmac
 from pydantic import BaseModel
 
-from ..database import teachers_collection, students_collection, hash_password, verify_password, generate_reset_token, store_reset_token, validate_reset_token, clear_reset_token
+from ..database import async_teachers_collection, async_students_collection, generate_reset_token, store_reset_token, validate_reset_token, redeem_reset_token
+from ..passwords import hash_password_async, verify_password_async, password_needs_rehash, server_timing
+from ..sessions import Session, current_session, current_student, current_teacher, session_manager, student_profile, teacher_profile
 
 router = APIRouter(
     prefix="/auth",
@@ -38,54 +41,87 @@ def hash_password_legacy(password):
     """Hash password using SHA-256 (for legacy teacher accounts)"""
     return hashlib.sha256(password.encode()).hexdigest()
 
+def is_legacy_hash(stored_hash: str) -> bool:
+    """Whether a stored password is a legacy SHA-256 hex digest"""
+    return len(stored_hash) == 64 and not stored_hash.startswith("$")
+
+async def check_password(collection, key: str, password: str, stored_hash: str):
+    """
+    Verify a password, upgrading legacy or outdated hashes on success
+    
+    Returns (is_valid, milliseconds spent hashing).
+    """
+    legacy = is_legacy_hash(stored_hash)
+    if legacy:
+        valid = hmac.compare_digest(stored_hash, hash_password_legacy(password))
+        hash_ms = 0.0
+    else:
+        valid, hash_ms = await verify_password_async(password, stored_hash)
+    
+    if valid and (legacy or password_needs_rehash(stored_hash)):
+        new_hash, rehash_ms = await hash_password_async(password)
+        await collection.update_one({"_id": key}, {"$set": {"password": new_hash}})
+        hash_ms += rehash_ms
+    
+    return valid, hash_ms
+
+def with_token(profile: Dict[str, Any], user_type: str, user_id: str) -> Dict[str, Any]:
+    """A login response: the user's profile and a new session token"""
+    return {
+        **profile,
+        "token": session_manager.issue(user_type, user_id),
+        "expires_in": session_manager.lifetime
+    }
+
 @router.post("/login")
-def login(username: str, password: str) -> Dict[str, Any]:
+async def login(username: str, password: str, response: Response) -> Dict[str, Any]:
     """Login a teacher account"""
-    # Hash the provided password
-    hashed_password = hash_password_legacy(password)
-    
     # Find the teacher in the database
-    teacher = teachers_collection.find_one({"_id": username})
+    teacher = await async_teachers_collection.find_one({"_id": username})
     
-    if not teacher or teacher["password"] != hashed_password:
+    if not teacher:
         raise HTTPException(status_code=401, detail="Invalid username or password")
     
-    # Return teacher information (excluding password)
-    return {
-        "username": teacher["username"],
-        "display_name": teacher["display_name"],
-        "role": teacher["role"],
-        "user_type": "teacher"
-    }
+    # Verify password on the hashing pool
+    valid, hash_ms = await check_password(async_teachers_collection, username, password, teacher["password"])
+    if not valid:
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid username or password",
+            headers={"Server-Timing": server_timing(hash_ms)}
+        )
+    response.headers["Server-Timing"] = server_timing(hash_ms)
+    
+    # Return teacher information (excluding password) and a session token
+    return with_token(teacher_profile(teacher), "teacher", username)
 
 @router.post("/student-login")
-def student_login(login_data: StudentLogin) -> Dict[str, Any]:
+async def student_login(login_data: StudentLogin, response: Response) -> Dict[str, Any]:
     """Login a student account"""
     # Find the student in the database
-    student = students_collection.find_one({"_id": login_data.email})
+    student = await async_students_collection.find_one({"_id": login_data.email})
     
     if not student:
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
-    # Verify password
-    if not verify_password(login_data.password, student["password"]):
-        raise HTTPException(status_code=401, detail="Invalid email or password")
-    
-    # Return student information (excluding password)
-    return {
-        "email": login_data.email,
-        "first_name": student["first_name"],
-        "last_name": student["last_name"],
-        "grade": student["grade"],
-        "phone": student["phone"],
-        "user_type": "student"
-    }
+    # Verify password on the hashing pool
+    valid, hash_ms = await check_password(async_students_collection, login_data.email, login_data.password, student["password"])
+    if not valid:
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid email or password",
+            headers={"Server-Timing": server_timing(hash_ms)}
+        )
+    response.headers["Server-Timing"] = server_timing(hash_ms)
+    
+    # Return student information (excluding password) and a session token
+    return with_token(student_profile(student), "student", login_data.email)
 
 @router.post("/register")
-def register_student(student_data: StudentRegistration) -> Dict[str, Any]:
+async def register_student(student_data: StudentRegistration, response: Response) -> Dict[str, Any]:
     """Register a new student account"""
     # Check if student already exists
-    existing_student = students_collection.find_one({"_id": student_data.email})
+    existing_student = await async_students_collection.find_one({"_id": student_data.email})
     if existing_student:
         raise HTTPException(status_code=400, detail="Student with this email already exists")
     
@@ -93,8 +129,9 @@ def register_student(student_data: StudentRegistration) -> Dict[str, Any]:
     if not student_data.email.endswith("@mergington.edu"):
         raise HTTPException(status_code=400, detail="Email must be from mergington.edu domain")
     
-    # Hash password
-    hashed_password = hash_password(student_data.password)
+    # Hash password on the hashing pool
+    hashed_password, hash_ms = await hash_password_async(student_data.password)
+    response.headers["Server-Timing"] = server_timing(hash_ms)
     
     # Create student document
     student_doc = {
@@ -107,7 +144,7 @@ def register_student(student_data: StudentRegistration) -> Dict[str, Any]:
     }
     
     # Insert student
-    students_collection.insert_one(student_doc)
+    await async_students_collection.insert_one(student_doc)
     
     # Return success response
     return {
@@ -118,17 +155,17 @@ def register_student(student_data: StudentRegistration) -> Dict[str, Any]:
     }
 
 @router.post("/forgot-password")
-def forgot_password(request: PasswordResetRequest) -> Dict[str, Any]:
+async def forgot_password(request: PasswordResetRequest) -> Dict[str, Any]:
     """Request password reset token"""
     # Check if student exists
-    student = students_collection.find_one({"_id": request.email})
+    student = await async_students_collection.find_one({"_id": request.email})
     if not student:
         # Don't reveal whether email exists or not for security
         return {"message": "If the email exists, a reset token will be sent"}
     
     # Generate reset token
     token = generate_reset_token()
-    store_reset_token(request.email, token)
+    await store_reset_token(request.email, token)
     
     # In a real application, you would send this token via email
     # For demo purposes, we'll return it in the response
@@ -139,18 +176,23 @@ def forgot_password(request: PasswordResetRequest) -> Dict[str, Any]:
     }
 
 @router.post("/reset-password")
-def reset_password(reset_data: PasswordReset) -> Dict[str, Any]:
+async def reset_password(reset_data: PasswordReset, response: Response) -> Dict[str, Any]:
     """Reset password using token"""
     # Validate token
-    email = validate_reset_token(reset_data.token)
-    if not email:
+    if not validate_reset_token(reset_data.token):
         raise HTTPException(status_code=400, detail="Invalid or expired reset token")
     
-    # Hash new password
-    hashed_password = hash_password(reset_data.new_password)
+    # Hash new password on the hashing pool
+    hashed_password, hash_ms = await hash_password_async(reset_data.new_password)
+    response.headers["Server-Timing"] = server_timing(hash_ms)
+    
+    # Use up the token; of concurrent resets with one token, only one gets here
+    email = await redeem_reset_token(reset_data.token)
+    if not email:
+        raise HTTPException(status_code=400, detail="Invalid or expired reset token")
     
     # Update student password
-    result = students_collection.update_one(
+    result = await async_students_collection.update_one(
         {"_id": email},
         {"$set": {"password": hashed_password}}
     )
@@ -158,39 +200,24 @@ def reset_password(reset_data: PasswordReset) -> Dict[str, Any]:
     if result.modified_count == 0:
         raise HTTPException(status_code=500, detail="Failed to update password")
     
-    # Clear the used token
-    clear_reset_token(reset_data.token)
+    # Sign out sessions that knew the old password
+    await session_manager.revoke("student", email, async_students_collection)
     
     return {"message": "Password reset successfully"}
 
+@router.post("/logout")
+async def logout(session: Session = Depends(current_session)) -> Dict[str, Any]:
+    """End every session of the calling user"""
+    collection = async_teachers_collection if session.user_type == "teacher" else async_students_collection
+    await session_manager.revoke(session.user_type, session.user_id, collection)
+    return {"message": "Logged out"}
+
 @router.get("/check-session")
-def check_session(username: str) -> Dict[str, Any]:
-    """Check if a session is valid by username"""
-    teacher = teachers_collection.find_one({"_id": username})
-    
-    if not teacher:
-        raise HTTPException(status_code=404, detail="Teacher not found")
-    
-    return {
-        "username": teacher["username"],
-        "display_name": teacher["display_name"],
-        "role": teacher["role"],
-        "user_type": "teacher"
-    }
+async def check_session(session: Session = Depends(current_teacher)) -> Dict[str, Any]:
+    """Check that the caller's teacher session is valid"""
+    return session.profile
 
 @router.get("/check-student-session")
-def check_student_session(email: str) -> Dict[str, Any]:
-    """Check if a student session is valid by email"""
-    student = students_collection.find_one({"_id": email})
-    
-    if not student:
-        raise HTTPException(status_code=404, detail="Student not found")
-    
-    return {
-        "email": email,
-        "first_name": student["first_name"],
-        "last_name": student["last_name"],
-        "grade": student["grade"],
-        "phone": student["phone"],
-        "user_type": "student"
-    }
\ No newline at end of file
+async def check_student_session(session: Session = Depends(current_student)) -> Dict[str, Any]:
+    """Check that the caller's student session is valid"""
+    return session.profile
@@ -0,0 +1,33 @@
+"""
+Monitoring endpoints for the High School Management System API
+"""
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
+from typing import Any, Dict, List
+
+from ..metrics import load_profile, registry
+from ..slowlog import slow_operations
+
+router = APIRouter(
+    prefix="/metrics",
+    tags=["metrics"]
+)
+
+@router.get("", response_class=PlainTextResponse)
+async def get_metrics() -> PlainTextResponse:
+    """Request, collection and password hashing metrics in the Prometheus text format"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@router.get("/slow-operations")
+async def get_slow_operations() -> List[Dict[str, Any]]:
+    """Recent collection operations slower than MERGINGTON_SLOW_OPERATION_MS, most recent first"""
+    return slow_operations.entries()
+
+@router.get("/profiles/{profile_id}", response_class=PlainTextResponse, include_in_schema=False)
+async def get_profile(profile_id: str) -> PlainTextResponse:
+    """cProfile statistics of a request sent with X-Profile: 1 (see metrics.py)"""
+    profile = load_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found or expired")
+    return PlainTextResponse(profile)
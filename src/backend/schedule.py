@@ -0,0 +1,178 @@
+"""
+Weekly schedules of activities as integer intervals
+
+Activity documents keep their schedule as readable "HH:MM" strings, but
+comparing strings for every activity on every filtered request is slow and
+only correct while every time is zero-padded. ScheduleIndex converts each
+schedule once, when the activity is written, into (day, start, end)
+intervals in minutes since midnight and files them into fixed-size time
+buckets per weekday. "What is running on Tuesday between 15:00 and 17:00"
+then only looks at the few buckets covering that window, and overlapping
+activities (schedule conflicts) are found with a sweep over a student's
+own intervals.
+"""
+
+import re
+
+MINUTES_PER_DAY = 24 * 60
+
+WEEKDAYS = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+_DAY_ORDER = {day: position for position, day in enumerate(WEEKDAYS)}
+
+_TIME_PATTERN = re.compile(r"^(\d{1,2}):(\d{2})$")
+
+
+def parse_time(value):
+    """Minutes since midnight for an "HH:MM" time; raises ValueError if invalid"""
+    match = _TIME_PATTERN.match(value.strip()) if isinstance(value, str) else None
+    if match is None:
+        raise ValueError(f"Invalid time: {value!r}")
+    hours, minutes = int(match.group(1)), int(match.group(2))
+    if hours > 24 or minutes > 59 or hours * 60 + minutes > MINUTES_PER_DAY:
+        raise ValueError(f"Invalid time: {value!r}")
+    return hours * 60 + minutes
+
+
+def format_time(minutes):
+    """Zero-padded "HH:MM" for minutes since midnight"""
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def format_clock(minutes):
+    """12-hour clock time for minutes since midnight, e.g. "3:15 PM" """
+    hours, minutes = divmod(minutes % MINUTES_PER_DAY, 60)
+    return f"{hours % 12 or 12}:{minutes:02d} {'AM' if hours < 12 else 'PM'}"
+
+
+def format_schedule(days, start, end):
+    """Human-readable schedule, e.g. "Mondays and Fridays, 3:15 PM - 4:45 PM" """
+    plural = [f"{day}s" for day in days]
+    if len(plural) == 2:
+        days_text = " and ".join(plural)
+    else:
+        days_text = ", ".join(plural)
+    return f"{days_text}, {format_clock(start)} - {format_clock(end)}"
+
+
+def normalize_schedule(doc, field="schedule_details"):
+    """Zero-pad a document's schedule times, so "9:00" sorts before "15:00" """
+    details = doc.get(field)
+    if not isinstance(details, dict):
+        return doc
+    for time_field in ("start_time", "end_time"):
+        value = details.get(time_field)
+        try:
+            canonical = format_time(parse_time(value))
+        except ValueError:
+            continue
+        if canonical != value:
+            doc[field] = details = {**details, time_field: canonical}
+    return doc
+
+
+def schedule_intervals(doc, field="schedule_details"):
+    """(day, start, end) intervals of a document's weekly schedule
+
+    Schedules without valid times have no intervals. An end time at or
+    before the start time is taken to run until midnight.
+    """
+    details = doc.get(field)
+    if not isinstance(details, dict):
+        return ()
+    try:
+        start = parse_time(details.get("start_time"))
+        end = parse_time(details.get("end_time"))
+    except ValueError:
+        return ()
+    if end <= start:
+        end = MINUTES_PER_DAY
+    return tuple((day, start, end) for day in dict.fromkeys(details.get("days") or ()))
+
+
+class ScheduleIndex:
+    """Index of weekly schedule intervals, bucketed by weekday and time"""
+
+    def __init__(self, field="schedule_details", bucket_minutes=30):
+        self.field = field
+        self.bucket_minutes = bucket_minutes
+        # key -> its (day, start, end) intervals
+        self.intervals = {}
+        # (day, bucket number) -> keys with an interval touching that bucket
+        self.buckets = {}
+
+    def attach(self, collection):
+        """Index a collection and keep the index up to date with its changes"""
+        for key, doc in collection.data.items():
+            self.add(key, doc)
+        collection.subscribe(self.on_change)
+        return self
+
+    def on_change(self, operation, key, doc, update):
+        """Collection listener: reindex documents whose schedule was replaced"""
+        if update is None or self.field in update.get('$set', {}):
+            self.remove(key)
+            self.add(key, doc)
+
+    def add(self, key, doc):
+        intervals = schedule_intervals(doc, self.field)
+        if not intervals:
+            return
+        self.intervals[key] = intervals
+        for day, start, end in intervals:
+            for bucket in self._bucket_range(start, end):
+                self.buckets.setdefault((day, bucket), set()).add(key)
+
+    def remove(self, key):
+        intervals = self.intervals.pop(key, ())
+        for day, start, end in intervals:
+            for bucket in self._bucket_range(start, end):
+                keys = self.buckets.get((day, bucket))
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.buckets[(day, bucket)]
+
+    def running(self, day, start=0, end=MINUTES_PER_DAY):
+        """Keys of the documents scheduled on day at any time in [start, end)"""
+        if end <= start:
+            return set()
+        candidates = set()
+        for bucket in self._bucket_range(start, end):
+            candidates.update(self.buckets.get((day, bucket), ()))
+        # Buckets are coarse; check the exact intervals of the candidates
+        return {
+            key for key in candidates
+            if any(
+                interval_day == day and interval_start < end and interval_end > start
+                for interval_day, interval_start, interval_end in self.intervals[key]
+            )
+        }
+
+    def conflicts(self, keys):
+        """Overlapping pairs among the schedules of keys
+
+        Returns (day, start, end, first key, second key) tuples, where start
+        and end bound the overlap, ordered by day then time.
+        """
+        by_day = {}
+        for key in keys:
+            for day, start, end in self.intervals.get(key, ()):
+                by_day.setdefault(day, []).append((start, end, key))
+
+        overlaps = []
+        for day, intervals in by_day.items():
+            intervals.sort()
+            # Sweep in start order, keeping the intervals that have not ended yet
+            active = []
+            for start, end, key in intervals:
+                active = [interval for interval in active if interval[1] > start]
+                for other_start, other_end, other_key in active:
+                    overlaps.append((day, start, min(end, other_end), other_key, key))
+                active.append((start, end, key))
+        overlaps.sort(key=lambda overlap: (
+            _DAY_ORDER.get(overlap[0], len(WEEKDAYS)), overlap[0], overlap[1], overlap[3], overlap[4]
+        ))
+        return overlaps
+
+    def _bucket_range(self, start, end):
+        return range(start // self.bucket_minutes, (max(end, start + 1) - 1) // self.bucket_minutes + 1)
@@ -0,0 +1,130 @@
+"""
+Full-text search index for the in-memory collections
+
+An inverted index maps each word to the documents containing it, weighted
+by the field it appears in. The sorted vocabulary makes prefix matching a
+range lookup, so results can be shown while the user is still typing.
+"""
+
+import bisect
+import math
+import re
+
+from .indexes import get_field, MISSING
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """Split text into lowercase words"""
+    return WORD_PATTERN.findall(text.lower())
+
+
+class SearchIndex:
+    """Inverted index over weighted document fields
+
+    fields maps a (dotted) field path to its weight; "_id" indexes the
+    document key itself (the activity name).
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+        # word -> {key: weighted term frequency}
+        self.postings = {}
+        # key -> words indexed for it, so a document can be removed
+        self.documents = {}
+        # Sorted list of all indexed words, for prefix lookups
+        self.vocabulary = []
+
+    def attach(self, collection):
+        """Index a collection and keep the index up to date with its changes"""
+        for key, doc in collection.data.items():
+            self.add(key, doc)
+        collection.subscribe(self.on_change)
+        return self
+
+    def on_change(self, operation, key, doc, update):
+        """Collection listener: re-index the changed document"""
+        if update is not None and not any(
+            path.split('.')[0] in fields
+            for fields in update.values()
+            for path in self.fields
+        ):
+            # The update did not touch any searchable field
+            return
+        self.add(key, doc)
+
+    def add(self, key, doc):
+        """Index (or re-index) a document"""
+        if key in self.documents:
+            self.remove(key)
+
+        weights = {}
+        for field, weight in self.fields.items():
+            value = key if field == '_id' else get_field(doc, field)
+            if value is MISSING:
+                continue
+            if isinstance(value, list):
+                value = " ".join(str(item) for item in value)
+            for word in tokenize(str(value)):
+                weights[word] = weights.get(word, 0) + weight
+
+        for word, weight in weights.items():
+            postings = self.postings.get(word)
+            if postings is None:
+                postings = self.postings[word] = {}
+                bisect.insort(self.vocabulary, word)
+            postings[key] = weight
+        self.documents[key] = list(weights)
+
+    def remove(self, key):
+        """Remove a document from the index"""
+        for word in self.documents.pop(key, ()):
+            postings = self.postings[word]
+            del postings[key]
+            if not postings:
+                del self.postings[word]
+                position = bisect.bisect_left(self.vocabulary, word)
+                del self.vocabulary[position]
+
+    def _expand(self, term):
+        """Indexed words equal to or starting with term"""
+        start = bisect.bisect_left(self.vocabulary, term)
+        end = bisect.bisect_left(self.vocabulary, term + "\uffff", start)
+        return self.vocabulary[start:end]
+
+    def search(self, text, limit=None):
+        """Return [(key, score)] for documents matching every term, best first
+
+        Each term matches whole words or word prefixes; exact words score
+        higher than prefix matches and rare words higher than common ones.
+        """
+        terms = tokenize(text)
+        if not terms:
+            return []
+
+        total = len(self.documents)
+        scores = None
+        for term in terms:
+            term_scores = {}
+            for word in self._expand(term):
+                postings = self.postings[word]
+                boost = 1.0 if word == term else 0.5
+                idf = math.log(1 + total / len(postings))
+                for key, weight in postings.items():
+                    score = weight * idf * boost
+                    if score > term_scores.get(key, 0):
+                        term_scores[key] = score
+
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {
+                    key: score + term_scores[key]
+                    for key, score in scores.items() if key in term_scores
+                }
+            if not scores:
+                return []
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit] if limit else ranked
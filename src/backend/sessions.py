@@ -0,0 +1,232 @@
+"""
+Signed session tokens for teachers and students
+
+/auth/login and /auth/student-login issue a token of the form
+base64(payload).base64(HMAC-SHA256 signature), where the payload names the
+user, their type and when the token was issued and expires. Requests send it
+as "Authorization: Bearer <token>".
+
+Checking the signature and expiry needs no lookup. The first request with a
+token also loads the user, to confirm they still exist and have not logged
+out since the token was issued; the result (with the user's public profile)
+is then cached for CACHE_SECONDS. Authenticated requests therefore cost no
+collection lookup, and a revocation (logout or password reset) takes effect
+everywhere within CACHE_SECONDS at most, and immediately in the process that
+handled it.
+
+The signing key comes from MERGINGTON_SESSION_SECRET, else from a key file in
+the data directory (shared by all worker processes), else it is generated at
+startup.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+from typing import Optional
+
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+from .database import storage, students_collection, teachers_collection
+from .metrics import registry
+from .ttl import TTLStore
+
+# How long a token is valid
+SESSION_SECONDS = int(os.environ.get("MERGINGTON_SESSION_SECONDS", str(8 * 3600)))
+# How long a verified token is trusted without looking at the user again
+CACHE_SECONDS = int(os.environ.get("MERGINGTON_SESSION_CACHE_SECONDS", "60"))
+
+KEY_FILE = "session.key"
+
+
+class InvalidSession(Exception):
+    """Raised for a token that is malformed, forged, expired or revoked"""
+
+
+class Session:
+    """A verified session: who the caller is and their public profile"""
+
+    __slots__ = ('user_type', 'user_id', 'profile', 'issued_at')
+
+    def __init__(self, user_type, user_id, profile, issued_at):
+        self.user_type = user_type
+        self.user_id = user_id
+        self.profile = profile
+        self.issued_at = issued_at
+
+
+def teacher_profile(teacher):
+    """Public details of a teacher document"""
+    return {
+        "username": teacher["_id"],
+        "display_name": teacher["display_name"],
+        "role": teacher["role"],
+        "user_type": "teacher"
+    }
+
+
+def student_profile(student):
+    """Public details of a student document"""
+    return {
+        "email": student["_id"],
+        "first_name": student["first_name"],
+        "last_name": student["last_name"],
+        "grade": student["grade"],
+        "phone": student["phone"],
+        "user_type": "student"
+    }
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+class SessionManager:
+    """Issues and verifies session tokens, caching verified ones"""
+
+    def __init__(self, secret, users, lifetime=SESSION_SECONDS, cache_seconds=CACHE_SECONDS, max_cached=10000):
+        self.secret = secret
+        # user type -> (collection, profile builder)
+        self.users = users
+        self.lifetime = lifetime
+        self.cache_seconds = cache_seconds
+        # token -> Session, owned by (user type, user id)
+        self.cache = TTLStore(ttl=cache_seconds, max_entries=max_cached)
+        for user_type, (collection, _) in users.items():
+            collection.subscribe(self._user_listener(user_type))
+
+    def issue(self, user_type, user_id):
+        """Return a new token for a user"""
+        issued_at = _now_ms()
+        payload = {"typ": user_type, "sub": user_id, "iat": issued_at, "exp": issued_at + self.lifetime * 1000}
+        body = _b64encode(json.dumps(payload, separators=(",", ":")).encode())
+        return f"{body}.{self._sign(body)}"
+
+    def verify(self, token) -> Session:
+        """Return the session for a token; raises InvalidSession"""
+        session = self.cache.get(token)
+        if session is not None:
+            return session
+
+        payload = self._decode(token)
+        if payload["typ"] not in self.users:
+            raise InvalidSession("Unknown user type")
+        collection, profile = self.users[payload["typ"]]
+        user = collection.find_one({"_id": payload["sub"]}, view=True)
+        if user is None:
+            raise InvalidSession("User no longer exists")
+        if user.get("sessions_revoked_at", 0) > payload["iat"]:
+            raise InvalidSession("Session has been revoked")
+
+        session = Session(payload["typ"], payload["sub"], profile(user), payload["iat"])
+        # Never trusted past the token's own expiry
+        ttl = min(self.cache_seconds, payload["exp"] / 1000 - time.time())
+        self.cache.set(token, session, owner=(session.user_type, session.user_id), ttl=ttl)
+        return session
+
+    async def revoke(self, user_type, user_id, collection):
+        """End every session of a user issued until now"""
+        await collection.update_one({"_id": user_id}, {"$set": {"sessions_revoked_at": _now_ms()}})
+        self.forget(user_type, user_id)
+
+    def forget(self, user_type, user_id):
+        """Drop the cached sessions of a user"""
+        self.cache.discard_owner((user_type, user_id))
+
+    def _user_listener(self, user_type):
+        # Revocations written by other worker processes arrive through the shared log
+        def on_change(operation, key, doc, update):
+            if update is None or "sessions_revoked_at" in update.get("$set", {}):
+                self.forget(user_type, key)
+        return on_change
+
+    def _sign(self, body):
+        return _b64encode(hmac.new(self.secret, body.encode(), hashlib.sha256).digest())
+
+    def _decode(self, token):
+        try:
+            body, signature = token.split(".")
+            # compare_digest only takes ASCII strings, so compare bytes (UnicodeError is a ValueError)
+            signature = signature.encode("ascii")
+        except ValueError:
+            raise InvalidSession("Malformed token") from None
+        if not hmac.compare_digest(signature, self._sign(body).encode("ascii")):
+            raise InvalidSession("Bad signature")
+        try:
+            payload = json.loads(_b64decode(body))
+        except ValueError:
+            raise InvalidSession("Malformed token") from None
+        if payload["exp"] <= _now_ms():
+            raise InvalidSession("Session has expired")
+        return payload
+
+
+def load_secret():
+    """The token signing key (see the module docstring)"""
+    if os.environ.get("MERGINGTON_SESSION_SECRET"):
+        return os.environ["MERGINGTON_SESSION_SECRET"].encode()
+    if storage is None:
+        return secrets.token_bytes(32)
+
+    # Every worker process must sign with the same key: the first one creates it
+    os.makedirs(storage.directory, exist_ok=True)
+    path = os.path.join(storage.directory, KEY_FILE)
+    if not os.path.exists(path):
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as key_file:
+            key_file.write(secrets.token_bytes(32))
+        try:
+            # Fails if another process created the key first
+            os.link(temporary_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temporary_path)
+    with open(path, "rb") as key_file:
+        return key_file.read()
+
+
+session_manager = SessionManager(load_secret(), {
+    "teacher": (teachers_collection, teacher_profile),
+    "student": (students_collection, student_profile),
+})
+
+registry.stores["sessions"] = session_manager.cache
+
+_bearer = HTTPBearer(auto_error=False)
+
+
+async def current_session(credentials: Optional[HTTPAuthorizationCredentials] = Depends(_bearer)) -> Session:
+    """FastAPI dependency: the caller's verified session, 401 without one"""
+    if credentials is None:
+        raise HTTPException(status_code=401, detail="Authentication required for this action")
+    try:
+        return session_manager.verify(credentials.credentials)
+    except InvalidSession:
+        raise HTTPException(status_code=401, detail="Invalid or expired session")
+
+
+async def current_teacher(session: Session = Depends(current_session)) -> Session:
+    """FastAPI dependency: the calling teacher's session, 403 for students"""
+    if session.user_type != "teacher":
+        raise HTTPException(status_code=403, detail="Only teachers can do this")
+    return session
+
+
+async def current_student(session: Session = Depends(current_session)) -> Session:
+    """FastAPI dependency: the calling student's session, 403 for teachers"""
+    if session.user_type != "student":
+        raise HTTPException(status_code=403, detail="Only students can do this")
+    return session
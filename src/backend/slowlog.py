@@ -0,0 +1,72 @@
+"""
+Log of slow collection operations
+
+Every find, find_one, aggregate and write that takes at least
+MERGINGTON_SLOW_OPERATION_MS milliseconds (100 by default, 0 logs every
+operation) is recorded with:
+
+- the collection and operation
+- the query shape (values replaced by "?") or the pipeline's stages
+- the route and method of the request that made it, if any
+- the duration in milliseconds
+
+Entries are logged on the "mergington.slow_operations" logger and the most
+recent ones are kept for GET /metrics/slow-operations.
+
+A find is timed from its first document to its last. That includes the
+caller's work between documents, as callers iterate the results lazily.
+"""
+
+import datetime
+import logging
+import os
+import threading
+from collections import deque
+
+from .metrics import current_request, route_template
+from .query import query_shape
+
+logger = logging.getLogger("mergington.slow_operations")
+
+
+def pipeline_shape(pipeline):
+    """Stage names of a pipeline, with the shape of its $match filters"""
+    shape = []
+    for stage in pipeline:
+        (operator, spec), = stage.items()
+        shape.append({operator: query_shape(spec)} if operator == '$match' else operator)
+    return shape
+
+
+class SlowOperationLog:
+    """Recent collection operations slower than a threshold"""
+
+    def __init__(self, threshold_ms=100.0, capacity=200):
+        # Compared with durations in seconds
+        self.threshold = threshold_ms / 1000
+        self.recent = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+
+    def record(self, collection, operation, query, duration):
+        """Add an operation that took duration seconds (at least the threshold)"""
+        request = current_request.get()
+        entry = {
+            "at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "collection": collection,
+            "operation": operation,
+            "query": pipeline_shape(query) if operation == 'aggregate' else query_shape(query),
+            "route": None if request is None else f"{request['method']} {route_template(request)}",
+            "duration_ms": round(duration * 1000, 3),
+        }
+        with self._lock:
+            self.recent.append(entry)
+        logger.warning("slow %s on %s: %.1f ms for %s (%s)", operation, collection, entry["duration_ms"],
+                       entry["query"], entry["route"] or "no request")
+
+    def entries(self):
+        """The recorded operations, most recent first"""
+        with self._lock:
+            return list(reversed(self.recent))
+
+
+slow_operations = SlowOperationLog(float(os.environ.get("MERGINGTON_SLOW_OPERATION_MS", "100")))
@@ -0,0 +1,589 @@
+"""
+Persistent storage for the in-memory collections
+
+Every insert_one/update_one is appended to a write-ahead log before the
+request that made it returns. A background thread writes the log in batches
+and fsyncs once per batch (group commit), so concurrent writers share the
+cost of each fsync. Coroutines wait for their record with wait_async(), which
+the log writer resolves through the event loop instead of tying up a thread
+per waiting request. Once the log grows past a threshold, the collections are
+written to a compacted snapshot and the log starts over.
+
+On startup the snapshot is read through a memory map and the log tail is
+replayed through the collections, which also rebuilds their indexes.
+
+In shared mode several server processes use the same directory as one
+dataset. A write takes an exclusive lock on a lock file, first applies the
+records other processes have appended since it last looked, then appends and
+fsyncs its own record before releasing the lock. Each process also tails the
+log in the background (and on demand through catch_up()), so writes made
+through one process become visible to reads in all of them. Snapshots
+replace the log with a new file instead of truncating it, so a process still
+reading the old log can finish it first.
+
+Once bind_loop() has been called, only the event loop's thread changes the
+collections in shared mode. The tailer schedules catch-ups on the loop
+instead of applying records itself, and writing_async() takes the locks and
+fsyncs on a thread but runs the write on the loop, so reads on the loop
+never see a collection or index half-updated.
+"""
+
+import asyncio
+import json
+import mmap
+import os
+import threading
+from contextlib import asynccontextmanager, contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: shared mode is unavailable
+    fcntl = None
+
+from .documents import json_default
+
+SNAPSHOT_FILE = "snapshot.jsonl"
+LOG_FILE = "wal.jsonl"
+LOCK_FILE = "wal.lock"
+# Documents a snapshot encodes per hold of a collection's lock
+SNAPSHOT_CHUNK = 1000
+
+
+def _encode(record):
+    return (json.dumps(record, separators=(",", ":"), default=json_default) + "\n").encode("utf-8")
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class StorageEngine:
+    """Write-ahead log and snapshots for a set of named collections"""
+
+    def __init__(self, directory, commit_delay=0.002, snapshot_every=10000, shared=False, poll_interval=0.05):
+        self.directory = directory
+        # How long the log writer waits for more records before an fsync
+        self.commit_delay = commit_delay
+        # Log records after which a new snapshot is written
+        self.snapshot_every = snapshot_every
+        # Whether other processes share the directory (shared mode)
+        self.shared = shared
+        # How often a shared engine looks for records appended by other processes
+        self.poll_interval = poll_interval
+
+        self.collections = {}
+        self._lock = threading.Condition()
+        self._buffer = []
+        self._last_lsn = 0        # Last log sequence number handed out
+        self._durable_lsn = 0     # Last log sequence number known to be on disk
+        self._snapshot_lsn = 0    # Last log sequence number contained in the snapshot
+        self._log = None
+        # Background thread: the log writer, or the log tailer in shared mode
+        self._writer = None
+        # (lsn, event loop, future) of coroutines in wait_async()
+        self._async_waiters = []
+        self._closed = False
+        # Thread replaying records (which are not logged again), if any
+        self._replaying = None
+
+        # Shared mode: held while reading the log, applying records or committing
+        self._shared_lock = threading.RLock()
+        # Shared mode: serializes this process's writers; unlike _shared_lock,
+        # any thread may release it, so coroutines can hold it across threads
+        self._process_lock = threading.Lock()
+        self._lock_file = None
+        # Thread (or event loop thread) holding the write locks
+        self._write_owner = None
+        self._pending = False
+        # Coroutines queue here for _process_lock, so they do not tie up threads waiting on it
+        self._async_lock = None
+        # Event loop that applies other processes' records (see bind_loop)
+        self._loop = None
+        self._catch_up_scheduled = False
+        # Read position in the log and the log file it belongs to
+        self._reader = None
+        self._reader_inode = None
+        self._offset = 0
+
+    @property
+    def snapshot_path(self):
+        return os.path.join(self.directory, SNAPSHOT_FILE)
+
+    @property
+    def log_path(self):
+        return os.path.join(self.directory, LOG_FILE)
+
+    @property
+    def is_open(self):
+        return self._writer is not None
+
+    def attach(self, name, collection):
+        """Persist a collection under the given name"""
+        self.collections[name] = collection
+        collection.storage = self
+        collection.name = name
+
+    def open(self):
+        """Recover the collections from disk and start the log writer"""
+        os.makedirs(self.directory, exist_ok=True)
+        if self.shared:
+            self._open_shared()
+            return
+        self._replaying = threading.get_ident()
+        try:
+            self._load_snapshot()
+            self._replay_log()
+        finally:
+            self._replaying = None
+        self._durable_lsn = self._last_lsn
+
+        self._log = open(self.log_path, "ab")
+        self._writer = threading.Thread(target=self._write_loop, name="wal-writer", daemon=True)
+        self._writer.start()
+
+    def bind_loop(self, loop):
+        """Apply other processes' records on this event loop's thread from now on (shared mode)"""
+        self._loop = loop
+
+    def close(self):
+        """Flush the log, write a final snapshot and stop the log writer"""
+        if self._writer is None:
+            return
+        with self._lock:
+            self._closed = True
+            self._lock.notify_all()
+        self._writer.join()
+        if self.shared:
+            with self.writing():
+                self.snapshot()
+        self._writer = None
+        with self._lock:
+            self._wake_async_waiters()
+        if not self.shared:
+            self.snapshot()
+        self._log.close()
+        self._log = None
+        if self.shared:
+            self._reader.close()
+            self._reader = None
+            self._lock_file.close()
+            self._lock_file = None
+
+    # Writing
+
+    def append(self, collection_name, operation, *args):
+        """Queue a log record; returns its sequence number for wait()"""
+        if self._replaying == threading.get_ident():
+            return 0
+        if self.shared:
+            return self._append_shared(collection_name, operation, *args)
+        with self._lock:
+            self._last_lsn += 1
+            self._buffer.append(_encode([self._last_lsn, collection_name, operation, *args]))
+            self._lock.notify_all()
+            return self._last_lsn
+
+    def wait(self, lsn):
+        """Block until the log record with this sequence number is on disk"""
+        if not lsn or self._write_owner == threading.get_ident():
+            # Inside writing(), whose exit commits the record
+            return
+        with self._lock:
+            while self._durable_lsn < lsn and self._writer is not None:
+                self._lock.wait()
+
+    async def wait_async(self, lsn):
+        """Like wait(), but suspends the calling coroutine instead of blocking its thread"""
+        if not lsn:
+            return
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._durable_lsn >= lsn or self._writer is None:
+                return
+            future = loop.create_future()
+            self._async_waiters.append((lsn, loop, future))
+        await future
+
+    def _wake_async_waiters(self):
+        # Caller holds self._lock
+        pending = []
+        for lsn, loop, future in self._async_waiters:
+            if self._durable_lsn >= lsn or self._writer is None:
+                try:
+                    loop.call_soon_threadsafe(_resolve, future)
+                except RuntimeError:
+                    # The waiting event loop has been closed
+                    pass
+            else:
+                pending.append((lsn, loop, future))
+        self._async_waiters = pending
+
+    def _write_loop(self):
+        while True:
+            with self._lock:
+                while not self._buffer and not self._closed:
+                    self._lock.wait()
+                if not self._buffer and self._closed:
+                    return
+            # Give concurrent writers a moment to join this batch
+            if self.commit_delay:
+                self._wait_for_batch()
+
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+                batch_lsn = self._last_lsn
+
+            self._log.write(b"".join(batch))
+            self._log.flush()
+            os.fsync(self._log.fileno())
+
+            with self._lock:
+                self._durable_lsn = batch_lsn
+                self._lock.notify_all()
+                self._wake_async_waiters()
+
+            if batch_lsn - self._snapshot_lsn >= self.snapshot_every:
+                self.snapshot()
+
+    def _wait_for_batch(self):
+        with self._lock:
+            if not self._closed:
+                self._lock.wait(self.commit_delay)
+
+    # Snapshots
+
+    def snapshot(self):
+        """Write all collections to a new snapshot and truncate the log"""
+        # Hold every collection's write lock so the snapshot matches an exact log position,
+        # but only to list the documents: writes resume while they are encoded, and
+        # keep a copy of each document they change first (see InMemoryCollection._preserved)
+        locks = [collection._lock for collection in self.collections.values()]
+        for lock in locks:
+            lock.acquire()
+        try:
+            with self._lock:
+                # Records not yet written by the log writer are covered by the snapshot
+                self._buffer = []
+                lsn = self._last_lsn
+            items = {name: list(collection.data.items()) for name, collection in self.collections.items()}
+            for collection in self.collections.values():
+                collection._preserved = {}
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+        lines = [_encode({"lsn": lsn})]
+        try:
+            for name, collection in self.collections.items():
+                preserved = collection._preserved
+                documents = items[name]
+                for start in range(0, len(documents), SNAPSHOT_CHUNK):
+                    # Documents are changed under the lock, so none changes while being encoded
+                    with collection._lock:
+                        for key, doc in documents[start:start + SNAPSHOT_CHUNK]:
+                            lines.append(_encode([name, key, preserved.get(key, doc)]))
+        finally:
+            for collection in self.collections.values():
+                with collection._lock:
+                    collection._preserved = None
+
+        temporary_path = self.snapshot_path + ".tmp"
+        with open(temporary_path, "wb") as snapshot_file:
+            snapshot_file.writelines(lines)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(temporary_path, self.snapshot_path)
+        self._fsync_directory()
+
+        with self._lock:
+            self._snapshot_lsn = lsn
+            if self.shared:
+                self._rotate_log()
+            elif self._log is not None:
+                self._log.truncate(0)
+                self._log.seek(0)
+            self._durable_lsn = max(self._durable_lsn, lsn)
+            self._lock.notify_all()
+            self._wake_async_waiters()
+
+    def _fsync_directory(self):
+        descriptor = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(descriptor)
+        finally:
+            os.close(descriptor)
+
+    # Shared mode
+
+    @contextmanager
+    def writing(self):
+        """Hold the cross-process write lock around a write (no-op unless shared)
+
+        On entry the collections are caught up with other processes' writes,
+        so conditional updates see the latest data; on exit the records
+        appended meanwhile are on disk.
+        """
+        if not self.shared or self._lock_file is None:
+            yield
+            return
+        thread = threading.get_ident()
+        if self._replaying == thread or self._write_owner == thread:
+            # Nested write, or a record being replayed: already covered
+            with self._shared_lock:
+                yield
+            return
+        self._acquire()
+        self._write_owner = thread
+        try:
+            with self._shared_lock:
+                self.catch_up(exclusive=True)
+                yield
+        finally:
+            self._write_owner = None
+            self._release()
+
+    @asynccontextmanager
+    async def writing_async(self):
+        """writing() for coroutines: waits for the locks and fsyncs on a thread
+
+        The body runs on the event loop and must not await, so the write it
+        makes is applied by the loop's thread.
+        """
+        if not self.shared or self._lock_file is None:
+            yield
+            return
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+        async with self._async_lock:
+            acquiring = asyncio.ensure_future(asyncio.to_thread(self._acquire))
+            try:
+                await asyncio.shield(acquiring)
+            except asyncio.CancelledError:
+                # Give the locks back once the thread has them
+                acquiring.add_done_callback(self._release_after_cancel)
+                raise
+            self._write_owner = threading.get_ident()
+            try:
+                with self._shared_lock:
+                    self.catch_up(exclusive=True)
+                yield
+            finally:
+                self._write_owner = None
+                # The thread runs to the end even if this coroutine is cancelled meanwhile
+                await asyncio.to_thread(self._release)
+
+    def _acquire(self):
+        # This process's writers first, then the other processes'
+        self._process_lock.acquire()
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        except BaseException:
+            self._process_lock.release()
+            raise
+
+    def _release(self):
+        try:
+            with self._shared_lock:
+                self._commit_shared()
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._process_lock.release()
+
+    def _release_after_cancel(self, acquiring):
+        if not acquiring.cancelled() and acquiring.exception() is None:
+            threading.Thread(target=self._release, name="wal-release", daemon=True).start()
+
+    def has_new_records(self):
+        """Cheap check for records appended by other processes since the last catch-up"""
+        if not self.shared or self._reader is None:
+            return False
+        try:
+            status = os.stat(self.log_path)
+        except FileNotFoundError:
+            return False
+        return status.st_size > self._offset or status.st_ino != self._reader_inode
+
+    def catch_up(self, exclusive=False):
+        """Apply the records other processes have appended to the shared log"""
+        if not self.shared or self._reader is None:
+            return
+        with self._shared_lock:
+            while True:
+                # Checked before reading: once replaced, the old log never grows again
+                rotated = os.stat(self.log_path).st_ino != self._reader_inode
+                self._reader.seek(self._offset)
+                data = self._reader.read()
+                end = data.rfind(b"\n") + 1
+                if end:
+                    self._apply_records(data[:end])
+                    self._offset += end
+                if exclusive and end < len(data) and not rotated:
+                    # No other writer holds the lock, so this is a torn write from a crash
+                    self._log.truncate(self._offset)
+                if not rotated:
+                    return
+                self._reopen_log()
+                # If the log was replaced more than once since this process last looked,
+                # the records of the logs in between are only in the snapshot
+                self._replaying = threading.get_ident()
+                try:
+                    self._load_snapshot(after=self._last_lsn)
+                finally:
+                    self._replaying = None
+                # The snapshot that replaced the old log covers everything read from it
+                self._snapshot_lsn = self._last_lsn
+
+    def _open_shared(self):
+        if fcntl is None:
+            raise RuntimeError("Shared storage needs fcntl file locks, which this platform lacks")
+        self._lock_file = open(os.path.join(self.directory, LOCK_FILE), "a+b")
+        with self._shared_lock:
+            # Keep other processes from replacing the snapshot and log while they are read
+            fcntl.flock(self._lock_file, fcntl.LOCK_SH)
+            try:
+                self._replaying = threading.get_ident()
+                try:
+                    self._load_snapshot()
+                finally:
+                    self._replaying = None
+                self._reopen_log()
+                self.catch_up()
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        self._durable_lsn = self._last_lsn
+        self._writer = threading.Thread(target=self._tail_loop, name="wal-tailer", daemon=True)
+        self._writer.start()
+
+    def _append_shared(self, collection_name, operation, *args):
+        # Called inside writing(), caught up with the log: the record goes at its end
+        with self._lock:
+            self._last_lsn += 1
+            record = _encode([self._last_lsn, collection_name, operation, *args])
+            self._log.write(record)
+            self._offset += len(record)
+            self._pending = True
+            return self._last_lsn
+
+    def _commit_shared(self):
+        if not self._pending:
+            return
+        self._log.flush()
+        os.fsync(self._log.fileno())
+        self._pending = False
+        with self._lock:
+            self._durable_lsn = self._last_lsn
+            self._lock.notify_all()
+            self._wake_async_waiters()
+        if self._last_lsn - self._snapshot_lsn >= self.snapshot_every:
+            self.snapshot()
+
+    def _apply_records(self, data):
+        self._replaying = threading.get_ident()
+        try:
+            for line in data.splitlines():
+                lsn, name, operation, *args = json.loads(line)
+                if lsn <= self._last_lsn:
+                    # Already in the snapshot, or written by this process
+                    continue
+                collection = self.collections.get(name)
+                if collection is not None:
+                    getattr(collection, operation)(*args)
+                self._last_lsn = lsn
+        finally:
+            self._replaying = None
+        with self._lock:
+            self._durable_lsn = max(self._durable_lsn, self._last_lsn)
+
+    def _reopen_log(self):
+        for handle in (self._log, self._reader):
+            if handle is not None:
+                handle.close()
+        self._log = open(self.log_path, "ab")
+        self._reader = open(self.log_path, "rb")
+        self._reader_inode = os.fstat(self._reader.fileno()).st_ino
+        self._offset = 0
+
+    def _rotate_log(self):
+        # Replace the log with an empty file; processes still reading the old one finish it first
+        temporary_path = self.log_path + ".tmp"
+        open(temporary_path, "wb").close()
+        os.replace(temporary_path, self.log_path)
+        self._fsync_directory()
+        self._reopen_log()
+
+    def _tail_loop(self):
+        while True:
+            with self._lock:
+                if not self._closed:
+                    self._lock.wait(self.poll_interval)
+                if self._closed:
+                    return
+            if not self.has_new_records():
+                continue
+            if self._loop is None:
+                self.catch_up()
+            else:
+                self._schedule_catch_up()
+
+    def _schedule_catch_up(self):
+        # Once per batch of new records, however often the tailer polls meanwhile
+        if self._catch_up_scheduled:
+            return
+        self._catch_up_scheduled = True
+        try:
+            self._loop.call_soon_threadsafe(self._scheduled_catch_up)
+        except RuntimeError:
+            # The event loop has been closed: apply the records here
+            self._loop = None
+            self._catch_up_scheduled = False
+            self.catch_up()
+
+    def _scheduled_catch_up(self):
+        self._catch_up_scheduled = False
+        self.catch_up()
+
+    # Recovery
+
+    def _load_snapshot(self, after=None):
+        """Insert the snapshot's documents; with after, only if the snapshot is past
+        that log position, overwriting the documents already there"""
+        if not os.path.exists(self.snapshot_path) or os.path.getsize(self.snapshot_path) == 0:
+            return
+        with open(self.snapshot_path, "rb") as snapshot_file:
+            with mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                header = json.loads(mapped.readline())
+                if after is not None and header["lsn"] <= after:
+                    return
+                self._snapshot_lsn = self._last_lsn = header["lsn"]
+                for line in iter(mapped.readline, b""):
+                    name, key, doc = json.loads(line)
+                    collection = self.collections.get(name)
+                    if collection is None:
+                        continue
+                    if after is not None and key in collection.data:
+                        # Documents are never deleted and keep their fields, so $set restores them
+                        collection.update_one({"_id": key}, {"$set": doc})
+                    else:
+                        doc["_id"] = key
+                        collection.insert_one(doc)
+
+    def _replay_log(self):
+        if not os.path.exists(self.log_path):
+            return
+        valid_length = 0
+        with open(self.log_path, "rb") as log_file:
+            for line in log_file:
+                if not line.endswith(b"\n"):
+                    # Torn write from a crash: drop the incomplete record
+                    break
+                lsn, name, operation, *args = json.loads(line)
+                valid_length += len(line)
+                if lsn <= self._snapshot_lsn:
+                    continue
+                collection = self.collections.get(name)
+                if collection is not None:
+                    getattr(collection, operation)(*args)
+                self._last_lsn = lsn
+        with open(self.log_path, "ab") as log_file:
+            log_file.truncate(valid_length)
@@ -0,0 +1,199 @@
+"""
+Bounded key-value store whose entries expire
+
+TTLStore holds short-lived entries such as password reset tokens, verified
+sessions or rate-limit buckets. Memory stays bounded however fast entries
+are added:
+
+- a heap orders entries by expiry, so expired ones are found without a scan
+- sweeping is incremental: every set() removes a few expired entries, and a
+  background thread sweeps every registered store in small batches
+- an optional cap per owner (for example per email) drops that owner's
+  oldest entry, and a cap on the whole store drops the entry expiring first
+
+Deleted or replaced entries leave a stale item in the heap; the heap is
+rebuilt once stale items outnumber live entries.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+import weakref
+
+# Expired entries removed per set() call
+SWEEP_ON_SET = 4
+
+
+class TTLStore:
+    """Thread-safe mapping of keys to values that expire after ttl seconds"""
+
+    def __init__(self, ttl, max_entries=None, max_per_owner=None, sweep_batch=256, background=True, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_per_owner = max_per_owner
+        self.sweep_batch = sweep_batch
+        self.clock = clock
+        # key -> [expires, sequence, value, owner]
+        self._entries = {}
+        # owner -> {key: None}, oldest first
+        self._owners = {}
+        # (expires, sequence, key); stale when the sequence no longer matches the entry
+        self._heap = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self.expired_total = 0
+        self.evicted_total = 0
+        if background:
+            _sweeper.register(self)
+
+    def set(self, key, value, owner=None, ttl=None):
+        """Store value under key for ttl seconds (the store's ttl by default)"""
+        now = self.clock()
+        expires = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._sweep(now, SWEEP_ON_SET)
+            if key in self._entries:
+                self._remove(key)
+            if owner is not None and self.max_per_owner is not None:
+                owned = self._owners.get(owner, ())
+                while len(owned) >= self.max_per_owner:
+                    self._remove(next(iter(owned)))
+                    self.evicted_total += 1
+            if self.max_entries is not None:
+                while len(self._entries) >= self.max_entries:
+                    self._remove(self._earliest())
+                    self.evicted_total += 1
+
+            sequence = next(self._sequence)
+            self._entries[key] = [expires, sequence, value, owner]
+            if owner is not None:
+                self._owners.setdefault(owner, {})[key] = None
+            heapq.heappush(self._heap, (expires, sequence, key))
+            if len(self._heap) > 2 * len(self._entries) + 64:
+                self._rebuild_heap()
+
+    def get(self, key, default=None):
+        """Value stored under key, or default if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] <= self.clock():
+                self._remove(key)
+                self.expired_total += 1
+                return default
+            return entry[2]
+
+    def pop(self, key, default=None):
+        """Remove key and return its value (default if missing or expired)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            self._remove(key)
+            if entry[0] <= self.clock():
+                self.expired_total += 1
+                return default
+            return entry[2]
+
+    def discard_owner(self, owner):
+        """Remove every entry of an owner"""
+        with self._lock:
+            for key in list(self._owners.get(owner, ())):
+                self._remove(key)
+
+    def sweep(self, limit=None):
+        """Remove up to limit expired entries (sweep_batch by default); returns how many"""
+        with self._lock:
+            return self._sweep(self.clock(), self.sweep_batch if limit is None else limit)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._owners.clear()
+            self._heap.clear()
+
+    def stats(self):
+        """Counts for monitoring"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "owners": len(self._owners),
+                "heap_size": len(self._heap),
+                "expired_total": self.expired_total,
+                "evicted_total": self.evicted_total,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, _ABSENT) is not _ABSENT
+
+    # The caller holds the lock for everything below
+
+    def _sweep(self, now, limit):
+        removed = 0
+        heap = self._heap
+        while heap and removed < limit and heap[0][0] <= now:
+            _, sequence, key = heapq.heappop(heap)
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == sequence:
+                self._remove(key)
+                self.expired_total += 1
+                removed += 1
+        return removed
+
+    def _earliest(self):
+        """Key of the live entry expiring first, dropping stale heap items on the way"""
+        while True:
+            _, sequence, key = self._heap[0]
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == sequence:
+                return key
+            heapq.heappop(self._heap)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        owner = entry[3]
+        if owner is not None:
+            owned = self._owners[owner]
+            del owned[key]
+            if not owned:
+                del self._owners[owner]
+
+    def _rebuild_heap(self):
+        self._heap = [(entry[0], entry[1], key) for key, entry in self._entries.items()]
+        heapq.heapify(self._heap)
+
+
+_ABSENT = object()
+
+
+class _Sweeper:
+    """One daemon thread sweeping every live TTLStore in batches"""
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.stores = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def register(self, store):
+        with self._lock:
+            self.stores.add(store)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="ttl-sweeper", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            for store in list(self.stores):
+                # Keep each lock hold short: sweep a batch, then yield to writers
+                while store.sweep() == store.sweep_batch:
+                    time.sleep(0)
+
+
+_sweeper = _Sweeper()
@@ -0,0 +1,102 @@
+"""
+Throughput of sync and async endpoints under high concurrency
+
+Both kinds of endpoint do the same work: a read (find_one) or a durable write
+(update_one, waiting for the write-ahead log fsync). The sync endpoints run on
+anyio's thread pool, so at most ~40 are in flight and a write holds its thread
+while it waits for the disk. The async endpoints run on the event loop and
+wait for the log without holding a thread.
+
+Run from the src directory:
+
+    python -m benchmarks.async_endpoints --requests 4000 --concurrency 500
+
+Prints requests per second and latency percentiles for each endpoint as JSON.
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from . import common
+
+
+def build_app(database):
+    from fastapi import FastAPI
+
+    app = FastAPI()
+
+    @app.get("/sync/read")
+    def sync_read():
+        return {"found": database.activities_collection.find_one({"_id": "Chess Club"}, view=True) is not None}
+
+    @app.get("/async/read")
+    async def async_read():
+        return {"found": await database.async_activities_collection.find_one({"_id": "Chess Club"}, view=True) is not None}
+
+    @app.post("/sync/write/{n}")
+    def sync_write(n: int):
+        database.activities_collection.update_one({"_id": "Chess Club"}, {"$set": {"benchmark": n}})
+        return {}
+
+    @app.post("/async/write/{n}")
+    async def async_write(n: int):
+        await database.async_activities_collection.update_one({"_id": "Chess Club"}, {"$set": {"benchmark": n}})
+        return {}
+
+    return app
+
+
+async def drive(app, method, path, requests, concurrency):
+    """Send requests through the ASGI app, at most `concurrency` at a time"""
+    import httpx
+
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        async def one(n):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.request(method, path.format(n=n))
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(n) for n in range(requests)))
+        elapsed = time.perf_counter() - started
+
+    return {"requests_per_second": round(requests / elapsed, 1), **common.summarize(latencies)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--concurrency", type=int, default=500)
+    common.add_output_argument(parser)
+    args = parser.parse_args()
+
+    # Durable writes need a data directory; it must be set before the database is imported
+    os.environ.setdefault("MERGINGTON_DATA_DIR", tempfile.mkdtemp(prefix="mergington-benchmark-"))
+    from backend import database
+
+    database.init_database()
+    app = build_app(database)
+    try:
+        results = {}
+        for method, path in (
+            ("GET", "/sync/read"),
+            ("GET", "/async/read"),
+            ("POST", "/sync/write/{n}"),
+            ("POST", "/async/write/{n}"),
+        ):
+            results[path] = asyncio.run(drive(app, method, path, args.requests, args.concurrency))
+    finally:
+        database.close_database()
+    common.report("async_endpoints", {"requests": args.requests, "concurrency": args.concurrency}, results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Microbenchmarks of InMemoryCollection operations on a synthetic dataset
+
+Times the reads and writes the endpoints rely on (lookups by name, the
+schedule filters of GET /activities, participant scans, the capacity check of
+a signup, sorting, the aggregation reports and enrolment updates) against
+the activities collection of backend.database, with its indexes, and no
+persistent storage.
+
+Run from the src directory:
+
+    python -m benchmarks.collection_ops --activities 10000 --students 5000 --output ops.json
+
+Each operation runs --repeat times or for --budget seconds, whichever comes
+first, and reports p50/p99/mean latency and operations per second.
+"""
+
+import argparse
+import os
+import random
+import time
+
+from . import common, synthetic
+
+
+def operations(database, dataset, rng):
+    """(name, function) pairs; each call performs the operation once"""
+    collection = database.activities_collection
+    names = [doc["_id"] for doc in dataset["activities"]]
+    emails = [doc["_id"] for doc in dataset["students"]]
+    occupancy = [
+        {"$unwind": "$schedule_details.days"},
+        {"$group": {
+            "_id": "$schedule_details.days",
+            "enrolled": {"$sum": {"$size": "$participants"}},
+            "capacity": {"$sum": "$max_participants"}
+        }},
+        {"$sort": {"_id": 1}}
+    ]
+
+    def toggle_enrolment():
+        name, email = rng.choice(names), rng.choice(emails)
+        collection.update_one({"_id": name}, {"$addToSet": {"participants": email}})
+        collection.update_one({"_id": name}, {"$pull": {"participants": email}})
+
+    return [
+        ("find_one_by_id", lambda: collection.find_one({"_id": rng.choice(names)}, view=True)),
+        ("find_all", lambda: list(collection.find({}, view=True))),
+        ("find_by_day", lambda: list(collection.find({"schedule_details.days": rng.choice(synthetic.WEEKDAYS)}, view=True))),
+        ("find_by_time_range", lambda: list(collection.find({
+            "schedule_details.start_time": {"$gte": "15:00"},
+            "schedule_details.end_time": {"$lte": "17:00"}
+        }, view=True))),
+        ("find_by_participant", lambda: list(collection.find({"participants": rng.choice(emails)}, view=True))),
+        ("find_with_free_places", lambda: list(collection.find({
+            "$expr": {"$lt": [{"$size": "$participants"}, "$max_participants"]}
+        }, view=True))),
+        ("find_sorted_page", lambda: list(collection.find(
+            {}, sort=[("max_participants", -1)], limit=20, view=True))),
+        ("find_copies", lambda: list(collection.find({"schedule_details.days": "Monday"}))),
+        ("aggregate_occupancy", lambda: list(collection.aggregate(occupancy))),
+        ("signup_capacity_check", lambda: collection.update_one(
+            {"_id": rng.choice(names), "$expr": {"$lt": [{"$size": "$participants"}, "$max_participants"]}},
+            {"$set": {"benchmark": True}})),
+        ("signup_and_unregister", toggle_enrolment),
+    ]
+
+
+def measure(function, repeat, budget):
+    """Latencies (seconds) of up to repeat calls, stopping after budget seconds"""
+    function()  # Warm up caches such as compiled queries
+    latencies = []
+    deadline = time.perf_counter() + budget
+    while len(latencies) < repeat:
+        started = time.perf_counter()
+        function()
+        finished = time.perf_counter()
+        latencies.append(finished - started)
+        if finished > deadline and len(latencies) >= 5:
+            break
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    synthetic.add_dataset_arguments(parser)
+    parser.add_argument("--repeat", type=int, default=1000)
+    parser.add_argument("--budget", type=float, default=2.0, help="seconds per operation at most")
+    parser.add_argument("--only", help="comma-separated operation names to run")
+    common.add_output_argument(parser)
+    args = parser.parse_args()
+
+    # Benchmark the collections in memory, without persistent storage
+    os.environ.pop("MERGINGTON_DATA_DIR", None)
+    from backend import database
+
+    dataset = synthetic.generate(args.activities, args.students, args.participants, args.seed)
+    synthetic.populate(database, dataset)
+    only = set(args.only.split(",")) if args.only else None
+
+    rng = random.Random(args.seed)
+    results = {}
+    for name, function in operations(database, dataset, rng):
+        if only and name not in only:
+            continue
+        latencies = measure(function, args.repeat, args.budget)
+        summary = common.summarize(latencies)
+        summary["ops_per_second"] = round(len(latencies) / sum(latencies), 1)
+        results[name] = summary
+
+    parameters = {**synthetic.dataset_parameters(args), "repeat": args.repeat, "budget": args.budget}
+    common.report("collection_ops", parameters, results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Helpers shared by the benchmark scripts: latency summaries and result files
+
+Every script prints one JSON document:
+
+    {"benchmark": ..., "environment": {...}, "parameters": {...}, "results": {...}}
+
+and with --output also writes it to a file, so runs on different commits
+can be compared (the environment records the commit).
+"""
+
+import datetime
+import json
+import platform
+import subprocess
+import sys
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an ascending list"""
+    return ordered[max(0, min(len(ordered) - 1, round(fraction * len(ordered)) - 1))]
+
+
+def summarize(latencies):
+    """Count and p50/p99/mean in milliseconds of latencies in seconds"""
+    ordered = sorted(latencies)
+    if not ordered:
+        return {"count": 0}
+    return {
+        "count": len(ordered),
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+    }
+
+
+def environment():
+    """Where the benchmark ran, including the git commit if there is one"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+    }
+
+
+def add_output_argument(parser):
+    parser.add_argument("--output", help="also write the results to this JSON file")
+
+
+def report(benchmark, parameters, results, output=None):
+    """Print the results document and write it to output if given"""
+    document = {
+        "benchmark": benchmark,
+        "environment": environment(),
+        "parameters": parameters,
+        "results": results,
+    }
+    text = json.dumps(document, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as result_file:
+            result_file.write(text + "\n")
+    sys.stdout.write(text + "\n")
+    return document
@@ -0,0 +1,61 @@
+"""
+Compare two benchmark result files, for example from two commits
+
+    python -m benchmarks.compare before.json after.json
+
+Prints, for every measurement present in both files, the p50 and p99
+latencies and their change; with --fail-above, exits with status 1 if any
+p50 grew by more than that percentage.
+"""
+
+import argparse
+import json
+import sys
+
+
+def measurements(results, prefix=""):
+    """{"name": summary} for every summary (a dict with p50_ms) in a results tree"""
+    found = {}
+    for name, value in results.items():
+        if isinstance(value, dict):
+            if "p50_ms" in value:
+                found[prefix + name] = value
+            else:
+                found.update(measurements(value, f"{prefix}{name}."))
+    return found
+
+
+def change(before, after):
+    return (after - before) / before * 100 if before else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--fail-above", type=float, help="p50 regression, in percent, that fails the comparison")
+    args = parser.parse_args()
+
+    with open(args.before, encoding="utf-8") as before_file, open(args.after, encoding="utf-8") as after_file:
+        before, after = json.load(before_file), json.load(after_file)
+    if before["parameters"] != after["parameters"]:
+        print("warning: the runs used different parameters", file=sys.stderr)
+
+    old, new = measurements(before["results"]), measurements(after["results"])
+    print(f"{before['environment'].get('commit')} -> {after['environment'].get('commit')}")
+    print(f"{'measurement':<40} {'p50 ms':>18} {'change':>8} {'p99 ms':>18} {'change':>8}")
+    regressed = []
+    for name in sorted(old.keys() & new.keys()):
+        p50 = change(old[name]["p50_ms"], new[name]["p50_ms"])
+        p99 = change(old[name]["p99_ms"], new[name]["p99_ms"])
+        print(f"{name:<40} {old[name]['p50_ms']:>8} -> {new[name]['p50_ms']:<8} {p50:>+7.1f}%"
+              f" {old[name]['p99_ms']:>8} -> {new[name]['p99_ms']:<8} {p99:>+7.1f}%")
+        if args.fail_above is not None and p50 > args.fail_above:
+            regressed.append(name)
+    if regressed:
+        print(f"p50 regressed by more than {args.fail_above}%: {', '.join(sorted(regressed))}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+In-process load test of the API on a synthetic dataset
+
+Virtual users send a weighted mix of requests to the FastAPI app through
+httpx's ASGI transport (no network), each picking its next request with its
+own seeded random generator:
+
+- browse: GET /activities
+- filter: GET /activities with a day and time window
+- search: GET /activities/search
+- enrolled: GET /activities/enrolled for a student
+- login: POST /auth/student-login (Argon2 verification)
+- signup / unregister: POST /activities/{name}/signup or /unregister as a
+  teacher; unregister undoes the run's own signups when there are any
+
+Run from the src directory:
+
+    python -m benchmarks.load --activities 2000 --students 5000 --requests 5000 --concurrency 50 --output load.json
+
+Reports throughput and p50/p99 latency and status codes per request kind.
+Signups to full activities and other refused requests (4xx) are expected and
+counted, not treated as failures.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+
+from . import common, synthetic
+
+DEFAULT_MIX = "browse=30,filter=25,search=10,enrolled=10,login=5,signup=10,unregister=10"
+
+
+def parse_mix(text):
+    """{"kind": weight} from "kind=weight,..." """
+    mix = {}
+    for item in text.split(","):
+        kind, _, weight = item.partition("=")
+        if kind not in SCENARIOS:
+            raise ValueError(f"Unknown request kind {kind!r}; choose from {', '.join(SCENARIOS)}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+# Each scenario builds one request: (method, path, keyword arguments for httpx)
+
+def browse(rng, data):
+    return "GET", "/activities", {}
+
+
+def filter_activities(rng, data):
+    start = rng.choice(["07:00", "12:00", "15:00", "16:00"])
+    return "GET", "/activities", {"params": {
+        "day": rng.choice(synthetic.WEEKDAYS), "start_time": start, "end_time": "18:00"}}
+
+
+def search(rng, data):
+    return "GET", "/activities/search", {"params": {"q": rng.choice(synthetic.TOPICS).lower()}}
+
+
+def enrolled(rng, data):
+    return "GET", "/activities/enrolled", {"params": {"email": rng.choice(data["emails"])}}
+
+
+def login(rng, data):
+    return "POST", "/auth/student-login", {"json": {
+        "email": rng.choice(data["emails"]), "password": synthetic.PASSWORD}}
+
+
+def signup(rng, data):
+    return "POST", f"/activities/{rng.choice(data['names'])}/signup", {
+        "params": {"email": rng.choice(data["emails"])}, "headers": data["auth"]}
+
+
+def unregister(rng, data):
+    # Undo an earlier signup of the run when there is one
+    if data["enrolments"]:
+        name, email = data["enrolments"].pop(rng.randrange(len(data["enrolments"])))
+    else:
+        name, email = rng.choice(data["names"]), rng.choice(data["emails"])
+    return "POST", f"/activities/{name}/unregister", {"params": {"email": email}, "headers": data["auth"]}
+
+
+SCENARIOS = {
+    "browse": browse,
+    "filter": filter_activities,
+    "search": search,
+    "enrolled": enrolled,
+    "login": login,
+    "signup": signup,
+    "unregister": unregister,
+}
+
+
+async def run_load(app, data, mix, requests, concurrency, seed):
+    """Send requests from concurrency virtual users; returns the results per kind"""
+    import httpx
+
+    kinds, weights = list(mix), list(mix.values())
+    latencies = {kind: [] for kind in kinds}
+    statuses = {kind: Counter() for kind in kinds}
+    remaining = requests
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        login_response = await client.post("/auth/login", params={
+            "username": "teacher0", "password": synthetic.TEACHER_PASSWORD})
+        login_response.raise_for_status()
+        data["auth"] = {"Authorization": f"Bearer {login_response.json()['token']}"}
+
+        async def user(number):
+            nonlocal remaining
+            rng = random.Random(f"{seed}-{number}")
+            while remaining > 0:
+                remaining -= 1
+                kind = rng.choices(kinds, weights)[0]
+                method, path, options = SCENARIOS[kind](rng, data)
+                started = time.perf_counter()
+                response = await client.request(method, path, **options)
+                latencies[kind].append(time.perf_counter() - started)
+                statuses[kind][response.status_code] += 1
+                if kind == "signup" and response.status_code == 200:
+                    data["enrolments"].append((path.split("/")[2], options["params"]["email"]))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user(number) for number in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    results = {"requests_per_second": round(requests / elapsed, 1), "elapsed_seconds": round(elapsed, 3)}
+    everything = [latency for kind in kinds for latency in latencies[kind]]
+    results["all"] = common.summarize(everything)
+    for kind in kinds:
+        results[kind] = common.summarize(latencies[kind])
+        results[kind]["statuses"] = {str(code): count for code, count in sorted(statuses[kind].items())}
+    results["server_errors"] = sum(count for kind in kinds for code, count in statuses[kind].items() if code >= 500)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    synthetic.add_dataset_arguments(parser)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help=f"request kinds and weights (default {DEFAULT_MIX})")
+    parser.add_argument("--durable", action="store_true",
+                        help="persist writes to a temporary data directory, as in production")
+    common.add_output_argument(parser)
+    args = parser.parse_args()
+
+    # The dataset must be loaded before the app seeds its sample data
+    if args.durable:
+        os.environ["MERGINGTON_DATA_DIR"] = tempfile.mkdtemp(prefix="mergington-load-")
+    else:
+        os.environ.pop("MERGINGTON_DATA_DIR", None)
+    from backend import database, passwords
+
+    if database.storage is not None:
+        database.storage.open()
+    dataset = synthetic.generate(args.activities, args.students, args.participants, args.seed)
+    synthetic.populate(database, dataset)
+    from app import app
+
+    data = {
+        "names": [doc["_id"] for doc in dataset["activities"]],
+        "emails": [doc["_id"] for doc in dataset["students"]],
+        "enrolments": [],
+    }
+    try:
+        results = asyncio.run(run_load(app, data, args.mix, args.requests, args.concurrency, args.seed))
+    finally:
+        passwords.shutdown_pool()
+        database.close_database()
+
+    parameters = {
+        **synthetic.dataset_parameters(args),
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "mix": args.mix,
+        "durable": args.durable,
+    }
+    common.report("load", parameters, results, args.output)
+
+
+if __name__ == "__main__":
+    main()
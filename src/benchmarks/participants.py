@@ -0,0 +1,99 @@
+"""
+Membership tests and memory of participant lists, by list size
+
+For each list size, compares:
+
+- dict: ParticipantList, the default, keyed by email
+- interned: InternedParticipantList (MERGINGTON_COMPACT_RECORDS=1), which
+  scans its array of ids up to records.ID_SET_THRESHOLD and keeps a set of
+  them beyond it
+- interned_scan: InternedParticipantList that never keeps a set
+
+Run from the src directory:
+
+    python -m benchmarks.participants --sizes 8,32,64,256,1024 --output participants.json
+
+Reports nanoseconds per membership test for members and non-members, and
+bytes per list (tracemalloc, excluding the shared email table).
+"""
+
+import argparse
+import time
+import tracemalloc
+from unittest import mock
+
+from . import common
+
+
+def parse_sizes(text):
+    return sorted(int(size) for size in text.split(","))
+
+
+def kinds():
+    """(name, function building a list from emails) pairs"""
+    from backend import records
+    from backend.participants import ParticipantList
+
+    def interned_scan(emails):
+        with mock.patch.object(records, "ID_SET_THRESHOLD", float("inf")):
+            return records.InternedParticipantList(emails)
+
+    return [
+        ("dict", ParticipantList),
+        ("interned", records.InternedParticipantList),
+        ("interned_scan", interned_scan),
+    ]
+
+
+def per_test_ns(participants, emails, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for email in emails:
+            email in participants
+    return round((time.perf_counter() - started) / (repeat * len(emails)) * 1e9, 1)
+
+
+def list_bytes(build, emails, copies=100):
+    """Average bytes allocated by building a list of emails, the emails themselves excluded"""
+    build(emails)  # intern the emails first
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        lists = [build(emails) for _ in range(copies)]
+        allocated = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del lists
+    return round(allocated / copies)
+
+
+def run_size(size, repeat):
+    members = [f"student{number}@mergington.edu" for number in range(size)]
+    # Interned like the members, as students signed up to other activities are
+    others = [f"other{number}@mergington.edu" for number in range(size)]
+    results = {}
+    for name, build in kinds():
+        build(others)
+        participants = build(members)
+        results[name] = {
+            "member_ns": per_test_ns(participants, members, repeat),
+            "non_member_ns": per_test_ns(participants, others, repeat),
+            "bytes": list_bytes(build, members),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=parse_sizes, default="8,32,64,256,1024",
+                        help="comma-separated numbers of participants per list (default 8,32,64,256,1024)")
+    parser.add_argument("--repeat", type=int, default=200, help="membership tests per email")
+    common.add_output_argument(parser)
+    args = parser.parse_args()
+
+    results = {str(size): run_size(size, args.repeat) for size in args.sizes}
+    common.report("participants", {"sizes": args.sizes, "repeat": args.repeat}, results, args.output)
+
+
+if __name__ == "__main__":
+    main()
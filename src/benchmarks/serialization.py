@@ -0,0 +1,161 @@
+"""
+CPU cost of encoding the activity listing, for catalogs of several sizes
+
+For each catalog size, encodes the whole GET /activities listing:
+
+- validated: what FastAPI does when an endpoint returns the listing as
+  plain dicts with response_model=Dict[str, Any] (validation, serialization
+  by the response field, then JSONResponse), the path the endpoints avoid
+- validated_typed: the same with response_model=Dict[str, Activity], what
+  the typed response models would cost if responses were validated
+- json, orjson: documents.json_dumps and orjson_dumps straight from the
+  stored documents (orjson only if it is installed)
+- stream: the chunks of GET /activities?stream=true
+- endpoint, endpoint_stream: whole GET /activities requests through the app
+  (in process, with httpx's ASGI transport), with the response cache emptied
+  before each one so the listing is encoded every time
+
+Run from the src directory:
+
+    python -m benchmarks.serialization --sizes 1000,10000,100000 --output serialization.json
+
+Reports the process CPU time per request (p50/p99/mean) and the body size.
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+from . import common, synthetic
+
+
+def parse_sizes(text):
+    return sorted(int(size) for size in text.split(","))
+
+
+async def measure(function, repeat, budget):
+    """CPU seconds of each call of function (a coroutine function), up to repeat calls or budget seconds"""
+    timings = []
+    deadline = time.perf_counter() + budget
+    while len(timings) < repeat and (not timings or time.perf_counter() < deadline):
+        started = time.process_time()
+        await function()
+        timings.append(time.process_time() - started)
+    return timings
+
+
+def encoders(listing, plain):
+    """(name, coroutine function returning the body) pairs encoding the listing"""
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import serialize_response
+    from fastapi.utils import create_model_field
+    from typing import Any, Dict
+
+    from backend import documents
+    from backend.routers.activities import Activity
+
+    generic = create_model_field("Response", Dict[str, Any], mode="serialization")
+    typed = create_model_field("Response", Dict[str, Activity], mode="serialization")
+
+    async def validated(field):
+        content = await serialize_response(field=field, response_content=plain)
+        return JSONResponse(content).body
+
+    async def encode(dumps):
+        return dumps(listing)
+
+    async def stream():
+        return b"".join(documents.iter_dumps(listing.items()))
+
+    found = [
+        ("validated", lambda: validated(generic)),
+        ("validated_typed", lambda: validated(typed)),
+        ("json", lambda: encode(documents.json_dumps)),
+    ]
+    if documents.orjson is not None:
+        found.append(("orjson", lambda: encode(documents.orjson_dumps)))
+    found.append(("stream", stream))
+    return found
+
+
+async def run_size(app, args):
+    """Results of every measurement on the activities collection as it is"""
+    import httpx
+    from backend import database
+    from backend.routers.activities import response_cache
+
+    listing = {doc["_id"]: doc.without_id() for doc in database.activities_collection.find({}, view=True)}
+    plain = {doc.pop("_id"): doc for doc in database.activities_collection.find({})}
+    for doc in plain.values():
+        doc["participants"] = list(doc["participants"])
+
+    results = {}
+    for name, function in encoders(listing, plain):
+        body = await function()
+        results[name] = common.summarize(await measure(function, args.repeat, args.budget))
+        results[name]["bytes"] = len(body)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        for name, params in (("endpoint", {}), ("endpoint_stream", {"stream": "true"})):
+            async def request():
+                response_cache.clear()
+                response = await client.get("/activities", params=params)
+                response.raise_for_status()
+                return response.content
+            body = await request()
+            results[name] = common.summarize(await measure(request, args.repeat, args.budget))
+            results[name]["bytes"] = len(body)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=parse_sizes, default="1000,10000,100000",
+                        help="comma-separated numbers of activities (default 1000,10000,100000)")
+    parser.add_argument("--students", type=int, default=1000)
+    parser.add_argument("--participants", type=synthetic.parse_distribution, default="uniform",
+                        help="participants per activity: a number or one of " + ", ".join(synthetic.DISTRIBUTIONS))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--budget", type=float, default=5.0, help="seconds per measurement at most")
+    common.add_output_argument(parser)
+    args = parser.parse_args()
+
+    # Benchmark the collections in memory, without persistent storage
+    os.environ.pop("MERGINGTON_DATA_DIR", None)
+    from backend import database, passwords
+
+    # One dataset of the largest size; each catalog size adds the next activities to the collection
+    dataset = synthetic.generate(args.sizes[-1], args.students, args.participants, args.seed)
+    activities = dataset["activities"]
+    synthetic.populate(database, {**dataset, "activities": activities[:args.sizes[0]]})
+    # Imported once the collections are populated, so it does not seed its sample data
+    from app import app
+
+    results = {}
+    loaded = args.sizes[0]
+    try:
+        for size in args.sizes:
+            if size > loaded:
+                database.activities_collection.insert_many(dict(doc) for doc in activities[loaded:size])
+                loaded = size
+            results[str(size)] = asyncio.run(run_size(app, args))
+    finally:
+        passwords.shutdown_pool()
+        database.close_database()
+
+    parameters = {
+        "sizes": args.sizes,
+        "students": args.students,
+        "participants": args.participants,
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "budget": args.budget,
+    }
+    common.report("serialization", parameters, results, args.output)
+
+
+if __name__ == "__main__":
+    main()
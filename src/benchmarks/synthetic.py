@@ -0,0 +1,135 @@
+"""
+Deterministic synthetic datasets for benchmarks
+
+generate(activities, students, participants, seed) builds the same documents
+for the same arguments on every run and machine. Participants per activity
+follow one of these distributions (capacity is 10-30 per activity):
+
+- "empty": no participants
+- "uniform": a uniformly random number up to capacity
+- "skewed": most activities nearly empty, a few full (beta distribution)
+- "full": every activity at capacity
+- a number: that many participants per activity, capped at capacity
+
+Every student's password is PASSWORD and every teacher's (teacher0,
+teacher1, ...) is TEACHER_PASSWORD. populate() inserts a dataset through the
+collections in backend.database, so their indexes see it; to replace the
+sample data, call it before database.init_database() (or importing app).
+"""
+
+import random
+
+from backend.schedule import WEEKDAYS, format_schedule, format_time
+
+PASSWORD = "student123"
+TEACHER_PASSWORD = "teacher123"
+DISTRIBUTIONS = ("empty", "uniform", "skewed", "full")
+
+TOPICS = ["Chess", "Robotics", "Drama", "Debate", "Art", "Music", "Soccer", "Basketball", "Coding",
+          "Science", "Math", "Photography", "Writing", "Dance", "Gardening", "Film", "Swimming", "Tennis"]
+_KINDS = ["Club", "Workshop", "Team", "Society", "Lab", "Studio"]
+_WORDS = ["learn", "practice", "compete", "build", "explore", "create", "perform", "tournaments",
+          "projects", "skills", "friends", "fundamentals", "advanced", "techniques", "showcase"]
+_FIRST_NAMES = ["Alex", "Sam", "Jordan", "Taylor", "Morgan", "Casey", "Riley", "Jamie", "Avery", "Quinn"]
+_LAST_NAMES = ["Smith", "Chen", "Garcia", "Patel", "Kim", "Nguyen", "Brown", "Lopez", "Khan", "Silva"]
+_CAPACITIES = [10, 12, 15, 18, 20, 24, 25, 30]
+
+
+def student_email(number):
+    return f"student{number}@mergington.edu"
+
+
+def participant_count(rng, distribution, capacity):
+    """Number of participants for an activity of the given capacity"""
+    if isinstance(distribution, int):
+        return min(distribution, capacity)
+    if distribution == "empty":
+        return 0
+    if distribution == "uniform":
+        return rng.randint(0, capacity)
+    if distribution == "skewed":
+        return round(capacity * rng.betavariate(0.5, 2.0))
+    if distribution == "full":
+        return capacity
+    raise ValueError(f"Unknown participants distribution: {distribution!r}")
+
+
+def parse_distribution(text):
+    """A distribution given on the command line: a name or a number"""
+    if text.isdigit():
+        return int(text)
+    if text not in DISTRIBUTIONS:
+        raise ValueError(f"Participants must be a number or one of {', '.join(DISTRIBUTIONS)}")
+    return text
+
+
+def generate(activities=1000, students=1000, participants="uniform", seed=0, teachers=3):
+    """Dict of "activities", "students" and "teachers" documents (with _id)"""
+    rng = random.Random(seed)
+    emails = [student_email(number) for number in range(students)]
+
+    activity_docs = []
+    for number in range(activities):
+        days = sorted(rng.sample(WEEKDAYS, rng.choice([1, 1, 2, 2, 3])), key=WEEKDAYS.index)
+        start = rng.randrange(6 * 60 + 30, 18 * 60, 15)
+        end = start + rng.choice([45, 60, 90, 120])
+        capacity = rng.choice(_CAPACITIES)
+        count = min(participant_count(rng, participants, capacity), students)
+        activity_docs.append({
+            "_id": f"{rng.choice(TOPICS)} {rng.choice(_KINDS)} {number}",
+            "description": " ".join(rng.choice(_WORDS) for _ in range(8)).capitalize(),
+            "schedule": format_schedule(days, start, end),
+            "schedule_details": {"days": days, "start_time": format_time(start), "end_time": format_time(end)},
+            "max_participants": capacity,
+            "participants": rng.sample(emails, count),
+        })
+
+    student_docs = [{
+        "_id": email,
+        "first_name": rng.choice(_FIRST_NAMES),
+        "last_name": rng.choice(_LAST_NAMES),
+        "password": PASSWORD,
+        "grade": str(rng.randint(9, 12)),
+        "phone": f"555-{number % 10000:04d}",
+    } for number, email in enumerate(emails)]
+
+    teacher_docs = [{
+        "_id": f"teacher{number}",
+        "display_name": f"Teacher {number}",
+        "password": TEACHER_PASSWORD,
+        "role": "admin" if number == 0 else "teacher",
+    } for number in range(teachers)]
+
+    return {"activities": activity_docs, "students": student_docs, "teachers": teacher_docs}
+
+
+def populate(database, dataset):
+    """Insert a dataset into the collections of backend.database
+
+    Passwords are hashed once per distinct password and the hash is shared,
+    so large datasets load quickly.
+    """
+    from backend.passwords import hash_password
+
+    hashes = {}
+    for name in ("students", "teachers"):
+        for doc in dataset[name]:
+            if doc["password"] not in hashes:
+                hashes[doc["password"]] = hash_password(doc["password"])
+    database.activities_collection.insert_many(dict(doc) for doc in dataset["activities"])
+    database.students_collection.insert_many({**doc, "password": hashes[doc["password"]]} for doc in dataset["students"])
+    database.teachers_collection.insert_many({**doc, "password": hashes[doc["password"]]} for doc in dataset["teachers"])
+
+
+def add_dataset_arguments(parser):
+    """Command-line options selecting a dataset"""
+    parser.add_argument("--activities", type=int, default=1000)
+    parser.add_argument("--students", type=int, default=1000)
+    parser.add_argument("--participants", type=parse_distribution, default="uniform",
+                        help="participants per activity: a number or one of " + ", ".join(DISTRIBUTIONS))
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def dataset_parameters(args):
+    return {"activities": args.activities, "students": args.students,
+            "participants": args.participants, "seed": args.seed}
@@ -80,6 +80,10 @@ document.addEventListener("DOMContentLoaded", () => {
   let allActivities = {};
   let currentFilter = "all";
   let searchQuery = "";
+  // Search results come in pages: the search URL and the next page's cursor,
+  // which is null once every match is shown
+  let searchUrl = "";
+  let searchNextCursor = null;
   let currentDay = "";
   let currentTimeRange = "";
   let currentView = "card"; // Track current view mode
@@ -149,15 +153,15 @@ document.addEventListener("DOMContentLoaded", () => {
       try {
         currentUser = JSON.parse(savedUser);
         updateAuthUI();
-        // Verify the stored user with the server
+        // Verify the stored session with the server
         if (currentUser.user_type === "teacher") {
-          validateTeacherSession(currentUser.username);
+          validateSession("/auth/check-session");
         } else if (currentUser.user_type === "student") {
-          validateStudentSession(currentUser.email);
+          validateSession("/auth/check-student-session");
         }
       } catch (error) {
         console.error("Error parsing saved user", error);
-        logout(); // Clear invalid data
+        clearSession(); // Clear invalid data
       }
     }
 
@@ -165,49 +169,32 @@ document.addEventListener("DOMContentLoaded", () => {
     updateAuthBodyClass();
   }
 
-  // Validate teacher session with the server
-  async function validateTeacherSession(username) {
-    try {
-      const response = await fetch(
-        `/auth/check-session?username=${encodeURIComponent(username)}`
-      );
-
-      if (!response.ok) {
-        // Session invalid, log out
-        logout();
-        return;
-      }
-
-      // Session is valid, update user data
-      const userData = await response.json();
-      currentUser = userData;
-      localStorage.setItem("currentUser", JSON.stringify(userData));
-      updateAuthUI();
-    } catch (error) {
-      console.error("Error validating teacher session:", error);
+  // Authorization header for the current session (empty when logged out)
+  function authHeaders() {
+    if (!currentUser || !currentUser.token) {
+      return {};
     }
+    return { Authorization: `Bearer ${currentUser.token}` };
   }
 
-  // Validate student session with the server
-  async function validateStudentSession(email) {
+  // Validate the stored session token with the server
+  async function validateSession(endpoint) {
     try {
-      const response = await fetch(
-        `/auth/check-student-session?email=${encodeURIComponent(email)}`
-      );
+      const response = await fetch(endpoint, { headers: authHeaders() });
 
       if (!response.ok) {
-        // Session invalid, log out
-        logout();
+        // Session invalid or expired, log out
+        clearSession();
         return;
       }
 
-      // Session is valid, update user data
+      // Session is valid, update user data (the token stays the same)
       const userData = await response.json();
-      currentUser = userData;
-      localStorage.setItem("currentUser", JSON.stringify(userData));
+      currentUser = { ...userData, token: currentUser.token };
+      localStorage.setItem("currentUser", JSON.stringify(currentUser));
       updateAuthUI();
     } catch (error) {
-      console.error("Error validating student session:", error);
+      console.error("Error validating session:", error);
     }
   }
 
@@ -443,8 +430,18 @@ document.addEventListener("DOMContentLoaded", () => {
     }
   }
 
-  // Logout function
-  function logout() {
+  // Logout function: end the session on the server, then locally
+  async function logout() {
+    try {
+      await fetch("/auth/logout", { method: "POST", headers: authHeaders() });
+    } catch (error) {
+      console.error("Error logging out:", error);
+    }
+    clearSession();
+  }
+
+  // Forget the current session in this browser
+  function clearSession() {
     currentUser = null;
     localStorage.removeItem("currentUser");
     updateAuthUI();
@@ -821,13 +818,23 @@ document.addEventListener("DOMContentLoaded", () => {
         }
       }
 
+      // Search is answered by the server, which only returns the matches
+      let endpoint = "/activities";
+      if (searchQuery.trim()) {
+        endpoint = "/activities/search";
+        queryParams.push(`q=${encodeURIComponent(searchQuery.trim())}`);
+      }
+
       const queryString =
         queryParams.length > 0 ? `?${queryParams.join("&")}` : "";
-      const response = await fetch(`/activities${queryString}`);
+      const response = await fetch(`${endpoint}${queryString}`);
       const activities = await response.json();
 
       // Save the activities data
       allActivities = activities;
+      searchUrl = `${endpoint}${queryString}`;
+      searchNextCursor =
+        endpoint === "/activities/search" ? response.headers.get("X-Next-Cursor") : null;
 
       // Apply search and filter, and handle weekend filter in client
       displayFilteredActivities();
@@ -838,6 +845,112 @@ document.addEventListener("DOMContentLoaded", () => {
     }
   }
 
+  // Add the next page of search results to the ones shown
+  async function fetchMoreSearchResults() {
+    const url = searchUrl;
+    if (!searchNextCursor) {
+      return;
+    }
+    try {
+      const response = await fetch(`${url}&cursor=${encodeURIComponent(searchNextCursor)}`);
+      const activities = await response.json();
+      // Ignore the page if a new search started meanwhile
+      if (url !== searchUrl) {
+        return;
+      }
+      Object.assign(allActivities, activities);
+      searchNextCursor = response.headers.get("X-Next-Cursor");
+      displayFilteredActivities();
+    } catch (error) {
+      console.error("Error fetching more search results:", error);
+    }
+  }
+
+  // Tell the user the search results are incomplete, with a button for the rest
+  function renderMoreResultsNotice() {
+    if (!searchNextCursor) {
+      return;
+    }
+    const notice = document.createElement("div");
+    notice.className = "more-results";
+    const shown = Object.keys(allActivities).length;
+    notice.innerHTML = `
+      <p>Showing the first ${shown} matches. More activities match your search.</p>
+      <button type="button">Show more results</button>
+    `;
+    notice.querySelector("button").addEventListener("click", fetchMoreSearchResults);
+    if (currentView === "card") {
+      activitiesList.appendChild(notice);
+    } else {
+      calendarBody.appendChild(notice);
+    }
+  }
+
+  // Live participant updates pushed by the server (see GET /activities/stream)
+  let liveUpdatesConnected = false;
+
+  function connectLiveUpdates() {
+    if (!window.EventSource) {
+      return;
+    }
+
+    const source = new EventSource("/activities/stream");
+    let hasConnected = false;
+
+    source.addEventListener("open", () => {
+      liveUpdatesConnected = true;
+      // Changes made while reconnecting were missed, so reload once
+      if (hasConnected) {
+        fetchActivities();
+      }
+      hasConnected = true;
+    });
+
+    source.addEventListener("error", () => {
+      // The browser reconnects by itself
+      liveUpdatesConnected = false;
+    });
+
+    source.addEventListener("occupancy", (event) => {
+      applyOccupancyDeltas(JSON.parse(event.data));
+    });
+
+    source.addEventListener("resync", () => {
+      fetchActivities();
+    });
+  }
+
+  // Patch the loaded activities with participant changes and redraw them
+  function applyOccupancyDeltas(deltas) {
+    let changed = false;
+
+    deltas.forEach((delta) => {
+      const details = allActivities[delta.activity];
+      if (!details) {
+        return;
+      }
+
+      if (delta.participants) {
+        details.participants = delta.participants;
+      } else {
+        const participants = details.participants.filter(
+          (email) => !delta.removed.includes(email)
+        );
+        delta.added.forEach((email) => {
+          if (!participants.includes(email)) {
+            participants.push(email);
+          }
+        });
+        details.participants = participants;
+      }
+      changed = true;
+    });
+
+    if (changed) {
+      displayFilteredActivities();
+    }
+  }
+
   // Function to display filtered activities
   function displayFilteredActivities() {
     // Clear both views
@@ -848,7 +961,8 @@ document.addEventListener("DOMContentLoaded", () => {
       calendarBody.innerHTML = "";
     }
 
-    // Apply client-side filtering - this handles category filter and search, plus weekend filter
+    // Apply client-side filtering - this handles category filter and weekend filter
+    // (search results are already filtered by the server)
     let filteredActivities = {};
 
     Object.entries(allActivities).forEach(([name, details]) => {
@@ -871,20 +985,6 @@ document.addEventListener("DOMContentLoaded", () => {
         }
       }
 
-      // Apply search filter
-      const searchableContent = [
-        name.toLowerCase(),
-        details.description.toLowerCase(),
-        formatSchedule(details).toLowerCase(),
-      ].join(" ");
-
-      if (
-        searchQuery &&
-        !searchableContent.includes(searchQuery.toLowerCase())
-      ) {
-        return;
-      }
-
       // Activity passed all filters, add to filtered list
       filteredActivities[name] = details;
     });
@@ -903,6 +1003,7 @@ document.addEventListener("DOMContentLoaded", () => {
       } else {
         calendarBody.innerHTML = noResultsHtml;
       }
+      renderMoreResultsNotice();
       return;
     }
 
@@ -918,6 +1019,7 @@ document.addEventListener("DOMContentLoaded", () => {
     } else {
       renderCalendarView(filteredActivities);
     }
+    renderMoreResultsNotice();
   }
 
   // Function to render activities grouped by category
@@ -1367,15 +1469,19 @@ document.addEventListener("DOMContentLoaded", () => {
   }
 
   // Event listeners for search and filter
+  // Wait for a pause in typing before asking the server for matches
+  let searchTimeout = null;
   searchInput.addEventListener("input", (event) => {
     searchQuery = event.target.value;
-    displayFilteredActivities();
+    clearTimeout(searchTimeout);
+    searchTimeout = setTimeout(fetchActivities, 250);
   });
 
   searchButton.addEventListener("click", (event) => {
     event.preventDefault();
+    clearTimeout(searchTimeout);
     searchQuery = searchInput.value;
-    displayFilteredActivities();
+    fetchActivities();
   });
 
   // Add event listeners to category filter buttons
@@ -1598,9 +1704,10 @@ document.addEventListener("DOMContentLoaded", () => {
               activity
             )}/unregister?email=${encodeURIComponent(
               email
-            )}&teacher_username=${encodeURIComponent(currentUser.username)}`,
+            )}`,
             {
               method: "POST",
+              headers: authHeaders(),
             }
           );
 
@@ -1608,8 +1715,10 @@ document.addEventListener("DOMContentLoaded", () => {
 
           if (response.ok) {
             showMessage(result.message, "success");
-            // Refresh the activities list
-            fetchActivities();
+            // The live update stream patches the list; reload only without it
+            if (!liveUpdatesConnected) {
+              fetchActivities();
+            }
           } else {
             showMessage(result.detail || "An error occurred", "error");
           }
@@ -1655,9 +1764,10 @@ document.addEventListener("DOMContentLoaded", () => {
           activity
         )}/signup?email=${encodeURIComponent(
           email
-        )}&teacher_username=${encodeURIComponent(currentUser.username)}`,
+        )}`,
         {
           method: "POST",
+          headers: authHeaders(),
         }
       );
 
@@ -1666,8 +1776,10 @@ document.addEventListener("DOMContentLoaded", () => {
       if (response.ok) {
         showMessage(result.message, "success");
         closeRegistrationModalHandler();
-        // Refresh the activities list after successful signup
-        fetchActivities();
+        // The live update stream patches the list; reload only without it
+        if (!liveUpdatesConnected) {
+          fetchActivities();
+        }
       } else {
         showMessage(result.detail || "An error occurred", "error");
       }
@@ -1688,5 +1800,6 @@ document.addEventListener("DOMContentLoaded", () => {
   checkAuthentication();
   initializeFilters();
   updateViewToggle(); // Initialize view toggle state
+  connectLiveUpdates();
   fetchActivities();
 });
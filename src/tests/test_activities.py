@@ -0,0 +1,74 @@
+"""
+GET /activities filters
+"""
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from app import app
+from backend.routers.activities import build_schedule_query
+
+client = TestClient(app)
+
+
+def names(params):
+    response = client.get("/activities", params=params)
+    assert response.status_code == 200
+    return set(response.json())
+
+
+def test_times_are_normalized():
+    assert build_schedule_query(None, "9:00", "7:05") == {
+        "schedule_details.start_time": {"$gte": "09:00"},
+        "schedule_details.end_time": {"$lte": "07:05"},
+    }
+
+
+@pytest.mark.parametrize("field", ["start_time", "end_time"])
+def test_unpadded_time_filters_like_padded(field):
+    assert names({field: "9:00"}) == names({field: "09:00"})
+
+
+def test_time_filters_select_activities():
+    everything = names({})
+    assert names({"start_time": "00:00"}) == everything
+    assert names({"start_time": "9:00"}) < everything
+    assert names({"end_time": "9:00"}) < names({"end_time": "23:59"}) == everything
+
+
+@pytest.mark.parametrize("path, extra", [("/activities", {}), ("/activities/search", {"q": "club"})])
+@pytest.mark.parametrize("params", [{"start_time": "banana"}, {"end_time": "25:00"}, {"start_time": "9:60"}])
+def test_malformed_time_is_rejected(path, extra, params):
+    response = client.get(path, params={**extra, **params})
+    assert response.status_code == 400
+
+
+def test_malformed_time_in_query_builder():
+    with pytest.raises(HTTPException) as error:
+        build_schedule_query("Monday", None, "noon")
+    assert error.value.status_code == 400
+
+
+def test_search_pages_follow_the_cursor():
+    everything = client.get("/activities/search", params={"q": "a"}).json()
+    assert len(everything) > 3
+    seen = []
+    params = {"q": "a", "limit": 2}
+    while True:
+        response = client.get("/activities/search", params=params)
+        assert response.status_code == 200
+        page = response.json()
+        assert 1 <= len(page) <= 2
+        seen.extend(page)
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+        assert len(page) == 2
+        params["cursor"] = cursor
+    assert seen == list(everything)
+
+
+def test_search_with_invalid_cursor():
+    response = client.get("/activities/search", params={"q": "club", "cursor": "!!"})
+    assert response.status_code == 400
@@ -0,0 +1,153 @@
+"""
+Aggregation pipelines: each stage, and stages streamed together
+"""
+
+import pytest
+
+from backend.aggregation import evaluate_expression
+from backend.database import InMemoryCollection
+from backend.participants import normalize_participants
+
+
+@pytest.fixture
+def activities():
+    collection = InMemoryCollection({}, normalize=normalize_participants)
+    for name, max_participants, days, participants in [
+        ("Chess", 12, ["Monday", "Friday"], ["a@m.edu", "b@m.edu"]),
+        ("Gym", 30, ["Friday"], ["a@m.edu"]),
+        ("Art", 15, [], []),
+        ("Math", None, ["Tuesday"], ["c@m.edu", "d@m.edu", "e@m.edu"]),
+    ]:
+        collection.insert_one({
+            "_id": name,
+            "max_participants": max_participants,
+            "schedule": {"days": days},
+            "participants": participants,
+        })
+    return collection
+
+
+def run(collection, *stages):
+    return list(collection.aggregate(list(stages)))
+
+
+def test_match(activities):
+    assert [doc["_id"] for doc in run(activities, {"$match": {"schedule.days": "Friday"}})] == ["Chess", "Gym"]
+    assert [doc["_id"] for doc in run(
+        activities,
+        {"$match": {"max_participants": {"$gt": 12}}},
+        {"$match": {"schedule.days": {"$size": 0}}},
+    )] == ["Art"]
+    assert [doc["_id"] for doc in run(
+        activities,
+        {"$project": {"count": {"$size": "$participants"}}},
+        {"$match": {"count": {"$gte": 2}}},
+    )] == ["Chess", "Math"]
+
+
+def test_unwind(activities):
+    assert [(doc["_id"], doc["schedule"]["days"]) for doc in run(activities, {"$unwind": "$schedule.days"})] == [
+        ("Chess", "Monday"), ("Chess", "Friday"), ("Gym", "Friday"), ("Math", "Tuesday"),
+    ]
+    preserved = run(activities, {"$unwind": {"path": "$schedule.days", "preserveNullAndEmptyArrays": True}})
+    assert [doc["_id"] for doc in preserved] == ["Chess", "Chess", "Gym", "Art", "Math"]
+    assert preserved[3]["schedule"] == {}
+
+
+def test_unwind_leaves_stored_documents_alone(activities):
+    run(activities, {"$unwind": "$schedule.days"})
+    assert activities.find_one({"_id": "Chess"})["schedule"]["days"] == ["Monday", "Friday"]
+
+
+def test_group_accumulators(activities):
+    result = run(activities, {"$group": {
+        "_id": None,
+        "activities": {"$count": {}},
+        "capacity": {"$sum": "$max_participants"},
+        "average": {"$avg": "$max_participants"},
+        "smallest": {"$min": "$max_participants"},
+        "largest": {"$max": "$max_participants"},
+        "names": {"$push": "$_id"},
+        "first": {"$first": "$_id"},
+        "last": {"$last": "$_id"},
+    }})
+    assert result == [{
+        "_id": None,
+        "activities": 4,
+        "capacity": 57,
+        "average": 19,
+        "smallest": 12,
+        "largest": 30,
+        "names": ["Chess", "Gym", "Art", "Math"],
+        "first": "Chess",
+        "last": "Math",
+    }]
+
+
+def test_group_by_unwound_field(activities):
+    result = run(
+        activities,
+        {"$unwind": "$participants"},
+        {"$group": {"_id": "$participants", "activities": {"$addToSet": "$_id"}, "count": {"$sum": 1}}},
+    )
+    assert result[0] == {"_id": "a@m.edu", "activities": ["Chess", "Gym"], "count": 2}
+    assert [group["_id"] for group in result] == ["a@m.edu", "b@m.edu", "c@m.edu", "d@m.edu", "e@m.edu"]
+
+
+def test_group_by_compound_key(activities):
+    result = run(activities, {"$group": {"_id": {"days": "$schedule.days"}, "n": {"$count": {}}}})
+    assert [group["_id"] for group in result] == [
+        {"days": ["Monday", "Friday"]}, {"days": ["Friday"]}, {"days": []}, {"days": ["Tuesday"]},
+    ]
+
+
+def test_project(activities):
+    included = run(activities, {"$project": {"_id": 0, "schedule.days": 1, "spots": {
+        "$subtract": [{"$ifNull": ["$max_participants", 0]}, {"$size": "$participants"}],
+    }}})
+    assert included[0] == {"schedule": {"days": ["Monday", "Friday"]}, "spots": 10}
+    assert included[3] == {"schedule": {"days": ["Tuesday"]}, "spots": -3}
+
+    excluded = run(activities, {"$project": {"participants": 0, "schedule.days": 0}})
+    assert excluded[0] == {"_id": "Chess", "max_participants": 12, "schedule": {}}
+
+
+def test_sort_skip_limit(activities):
+    ordered = run(activities, {"$sort": {"max_participants": -1, "_id": 1}})
+    assert [doc["_id"] for doc in ordered] == ["Gym", "Art", "Chess", "Math"]
+    ascending = run(activities, {"$sort": {"max_participants": 1}})
+    assert [doc["_id"] for doc in ascending] == ["Math", "Chess", "Art", "Gym"]
+    top = run(activities, {"$sort": {"max_participants": -1}}, {"$skip": 1}, {"$limit": 2})
+    assert [doc["_id"] for doc in top] == ["Art", "Chess"]
+    bounded = run(activities, {"$sort": {"max_participants": -1}}, {"$limit": 2})
+    assert [doc["_id"] for doc in bounded] == ["Gym", "Art"]
+
+
+def test_count(activities):
+    assert run(activities, {"$match": {"schedule.days": "Friday"}}, {"$count": "total"}) == [{"total": 2}]
+    assert run(activities, {"$match": {"_id": "Nope"}}, {"$count": "total"}) == [{"total": 0}]
+
+
+def test_expressions():
+    doc = {"a": 6, "b": 3, "nested": {"list": [1, 2]}, "none": None}
+    assert evaluate_expression(doc, {"$divide": ["$a", "$b"]}) == 2
+    assert evaluate_expression(doc, {"$divide": ["$a", 0]}) is None
+    assert evaluate_expression(doc, {"$multiply": ["$a", "$b", 2]}) == 36
+    assert evaluate_expression(doc, {"$add": ["$a", "$missing"]}) is None
+    assert evaluate_expression(doc, {"$size": "$nested.list"}) == 2
+    assert evaluate_expression(doc, {"$size": "$missing"}) == 0
+    assert evaluate_expression(doc, {"$ifNull": ["$none", "default"]}) == "default"
+    assert evaluate_expression(doc, {"$gt": ["$a", "$b"]}) is True
+    assert evaluate_expression(doc, {"$lt": ["$missing", 1]}) is False
+    assert evaluate_expression(doc, {"$literal": "$a"}) == "$a"
+    assert evaluate_expression(doc, {"x": "$a", "y": ["$b", 1]}) == {"x": 6, "y": [3, 1]}
+
+
+@pytest.mark.parametrize("pipeline, message", [
+    ([{"$lookup": {}}], "stage"),
+    ([{"$group": {"_id": None, "x": {"$median": "$a"}}}], "accumulator"),
+    ([{"$project": {"x": {"$concat": ["$a"]}}}], "expression"),
+])
+def test_unsupported(activities, pipeline, message):
+    with pytest.raises(ValueError, match=message):
+        run(activities, *pipeline)
@@ -0,0 +1,58 @@
+"""
+Minified JavaScript must behave like its source (checked with node)
+"""
+
+import shutil
+import subprocess
+
+import pytest
+
+from backend.assets import minify_js
+
+NODE = shutil.which("node")
+
+needs_node = pytest.mark.skipif(NODE is None, reason="node is not installed")
+
+
+def run(source):
+    result = subprocess.run([NODE, "-e", source], capture_output=True, text=True, timeout=30)
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+
+def assert_same_behaviour(source):
+    assert run(minify_js(source)) == run(source)
+
+
+@needs_node
+@pytest.mark.parametrize("source", [
+    "var b = 5; var a = b++ / 2; var s = '/'; var t = 'x   y'; console.log(a, b, s, t);",
+    "var n = 4, p, q; var r = (n-- / 2, p = '/', q = 'a  ,  b'); console.log(r, n, p, q);",
+    "var i = 1; var j = i++\n/ 2 / 1; console.log(j, 'a  /  b');",
+], ids=["increment", "decrement", "across-lines"])
+def test_division_after_postfix_operator(source):
+    assert_same_behaviour(source)
+
+
+@needs_node
+def test_regex_after_keywords():
+    assert_same_behaviour(r'''
+function isUrl(u) {
+  return /^https?:\/\//.test(u);
+}
+function kind(x) {
+  switch (typeof x) {
+    case "string": return /a\/b/.source + '  kept  ';
+  }
+  if (!x) throw /bad/; else x = /c[/]d/g.test("c/d") ? {return: 8} : x;
+  const half = x.return / 2 / 1;
+  for (const m of /x/.exec("x") || []) { console.log(m, half); }
+  return void /y/, typeof /z/;
+}
+async function f() { return await /q/.source; }
+f().then(value => console.log(isUrl("https://a.b"), isUrl("ftp://x"), kind({}), kind("s"), value, 10 / 2 / 5));
+''')
+
+
+def test_strings_and_comments_are_kept():
+    assert minify_js("var a = 'x   y'; // gone\n/* gone */ var b = \"1 / 2\";\n") == "var a='x   y';\nvar b=\"1 / 2\";\n"
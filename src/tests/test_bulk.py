@@ -0,0 +1,123 @@
+"""
+Bulk writes: checked up front, diagnosed per request, logged as applied
+"""
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import app
+from backend.database import InMemoryCollection
+from backend.participants import normalize_participants
+from backend.storage import StorageEngine
+
+
+def signup(email):
+    return {"update_one": {
+        "filter": {
+            "_id": "Chess Club",
+            "participants": {"$ne": email},
+            "$expr": {"$lt": [{"$size": "$participants"}, "$max_participants"]},
+        },
+        "update": {"$addToSet": {"participants": email}},
+    }}
+
+
+def unregister(email, activity="Chess Club"):
+    return {"update_one": {
+        "filter": {"_id": activity, "participants": email},
+        "update": {"$pull": {"participants": email}},
+    }}
+
+
+def activities(directory=None):
+    collection = InMemoryCollection({}, normalize=normalize_participants)
+    storage = None
+    if directory is not None:
+        storage = StorageEngine(str(directory))
+        storage.attach("activities", collection)
+        storage.open()
+    if not collection.data:
+        collection.insert_one({"_id": "Chess Club", "max_participants": 2, "participants": ["a@mergington.edu"]})
+    return collection, storage
+
+
+def test_each_request_is_diagnosed_as_it_is_applied():
+    collection, _ = activities()
+    result = collection.bulk_write([
+        signup("a@mergington.edu"),
+        signup("b@mergington.edu"),
+        signup("b@mergington.edu"),
+        signup("c@mergington.edu"),
+        unregister("z@mergington.edu"),
+        unregister("a@mergington.edu", activity="Nope"),
+        unregister("a@mergington.edu"),
+        signup("c@mergington.edu"),
+    ])
+    assert [(update.matched_count, update.unmatched_by) for update in result.results] == [
+        (0, "participants"),
+        (1, None),
+        (0, "participants"),
+        (0, "$expr"),
+        (0, "participants"),
+        (0, "_id"),
+        (1, None),
+        (1, None),
+    ]
+    assert list(collection.find_one({"_id": "Chess Club"})["participants"]) == ["b@mergington.edu", "c@mergington.edu"]
+
+
+@pytest.mark.parametrize("bad", [
+    {"update_one": {"filter": {"_id": "Chess Club"}, "update": {"$rename": {"a": "b"}}}},
+    {"delete_one": {"filter": {}}},
+    {"insert_one": {"document": {"name": "no id"}}},
+    {"update_many": {"filter": {}}},
+])
+def test_invalid_request_changes_nothing(bad):
+    collection, _ = activities()
+    version = collection.version
+    with pytest.raises(ValueError):
+        collection.bulk_write([signup("b@mergington.edu"), bad])
+    assert collection.version == version
+    assert list(collection.find_one({"_id": "Chess Club"})["participants"]) == ["a@mergington.edu"]
+
+
+def test_writes_before_a_failure_stay_applied_and_logged(tmp_path):
+    collection, storage = activities(tmp_path)
+    collection.insert_one({"_id": "Art", "participants": [], "max_participants": 5, "description": "text"})
+    with pytest.raises(ValueError):
+        collection.bulk_write([
+            signup("b@mergington.edu"),
+            {"update_one": {"filter": {"_id": "Art"}, "update": {"$push": {"description": "x"}}}},
+            signup("c@mergington.edu"),
+        ])
+    assert list(collection.find_one({"_id": "Chess Club"})["participants"]) == ["a@mergington.edu", "b@mergington.edu"]
+    storage.close()
+
+    recovered, storage = activities(tmp_path)
+    assert list(recovered.find_one({"_id": "Chess Club"})["participants"]) == ["a@mergington.edu", "b@mergington.edu"]
+    assert recovered.find_one({"_id": "Art"})["description"] == "text"
+    storage.close()
+
+
+def test_bulk_endpoint_reports_each_reason():
+    client = TestClient(app)
+    token = client.post("/auth/login", params={"username": "mchen", "password": "chess456"}).json()["token"]
+    members = client.get("/activities").json()["Programming Class"]["participants"]
+    items = [
+        {"activity": "Programming Class", "email": members[0], "action": "signup"},
+        {"activity": "Programming Class", "email": "bulk@mergington.edu", "action": "unregister"},
+        {"activity": "Nope", "email": "bulk@mergington.edu", "action": "signup"},
+        {"activity": "Programming Class", "email": "bulk@mergington.edu", "action": "signup"},
+        {"activity": "Programming Class", "email": "bulk@mergington.edu", "action": "signup"},
+        {"activity": "Programming Class", "email": "bulk@mergington.edu", "action": "unregister"},
+    ]
+    response = client.post("/activities/bulk", json={"items": items}, headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    assert [item.get("detail") for item in response.json()["results"]] == [
+        "Already signed up for this activity",
+        "Not registered for this activity",
+        "Activity not found",
+        None,
+        "Already signed up for this activity",
+        None,
+    ]
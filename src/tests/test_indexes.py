@@ -0,0 +1,139 @@
+"""
+Secondary indexes: a query answered by an index returns what a scan returns
+"""
+
+import pytest
+
+from backend.database import InMemoryCollection
+from backend.indexes import HashIndex, SortedIndex
+
+DOCUMENTS = [
+    {"_id": 1, "n": 3, "tags": ["a", "b"]},
+    {"_id": 2, "n": 7, "tags": "a"},
+    {"_id": 3, "n": [1, 9], "tags": ["c", {"x": 1}]},
+    {"_id": 4, "n": {"deep": 1}, "tags": {"x": 1}},
+    {"_id": 5, "n": None, "tags": None},
+    {"_id": 6},
+    {"_id": 7, "n": "text", "tags": [["nested"]]},
+    {"_id": 8, "n": 5.5, "tags": ["b"]},
+]
+
+QUERIES = [
+    {"n": {"$gte": 3}},
+    {"n": {"$lt": 5}},
+    {"n": {"$gt": 2, "$lte": 8}},
+    {"n": 9},
+    {"n": 3},
+    {"n": None},
+    {"n": "text"},
+    {"n": {"$gt": "a"}},
+    {"n": [1, 9]},
+    {"tags": "a"},
+    {"tags": ["a", "b"]},
+    {"tags": {"x": 1}},
+    {"tags": {"$in": ["c", ["nested"]]}},
+    {"tags": {"$in": [None]}},
+    {"tags": None},
+]
+
+
+def collections():
+    indexed = InMemoryCollection({})
+    indexed.create_index("n", kind="sorted")
+    indexed.create_index("tags", kind="hash")
+    plain = InMemoryCollection({})
+    for doc in DOCUMENTS:
+        indexed.insert_one(dict(doc))
+        plain.insert_one(dict(doc))
+    return indexed, plain
+
+
+def keys(collection, query):
+    return [doc["_id"] for doc in collection.find(query)]
+
+
+@pytest.mark.parametrize("query", QUERIES, ids=str)
+def test_index_matches_scan(query):
+    indexed, plain = collections()
+    assert keys(indexed, query) == keys(plain, query)
+
+
+def test_index_matches_scan_after_updates():
+    indexed, plain = collections()
+    for collection in (indexed, plain):
+        collection.update_one({"_id": 1}, {"$set": {"n": [4, 10], "tags": {"y": 2}}})
+        collection.update_one({"_id": 3}, {"$set": {"n": 2, "tags": "c"}})
+        collection.update_one({"_id": 7}, {"$set": {"n": None}})
+    for query in QUERIES:
+        assert keys(indexed, query) == keys(plain, query), query
+    assert indexed.indexes["n"].unindexed == {1, 4}
+
+
+def test_hash_index_skips_unhashable_values():
+    index = HashIndex("tags")
+    index.add(1, {"tags": ["a", {"x": 1}, ["b"]]})
+    assert index.lookup("a") == {1}
+    assert index.lookup(["a"]) is None
+    assert index.lookup({"$in": ["a", ["b"]]}) is None
+    index.remove(1, {"tags": ["a", {"x": 1}, ["b"]]})
+    assert index.entries == {}
+
+
+def test_sorted_index_mixed_types():
+    index = SortedIndex("n")
+    for key, value in enumerate([3, "a", None, 1, [2], 2.5]):
+        index.add(key, {"n": value})
+    assert index.values == [1, 2.5, 3]
+    assert index.lookup({"$gte": 2}) == {0, 5, 1, 4}
+    assert index.lookup({"$gte": "a"}) is None
+    assert index.lookup(None) is None
+
+
+class FailingIndex:
+    """Index that cannot take the value "bad" """
+
+    def __init__(self, field):
+        self.field = field
+        self.entries = {}
+
+    def add(self, key, doc):
+        if doc.get(self.field) == "bad":
+            raise RuntimeError("cannot index")
+        self.entries[key] = doc.get(self.field)
+
+    def remove(self, key, doc):
+        self.entries.pop(key, None)
+
+    def lookup(self, condition):
+        return None
+
+
+def failing_collection():
+    collection = InMemoryCollection({})
+    collection.create_index("n", kind="sorted")
+    collection.indexes["m"] = FailingIndex("m")
+    collection.insert_one({"_id": 1, "n": 1, "m": "good"})
+    return collection
+
+
+def test_failed_insert_leaves_collection_unchanged():
+    collection = failing_collection()
+    version = collection.version
+    with pytest.raises(RuntimeError):
+        collection.insert_one({"_id": 2, "n": 2, "m": "bad"})
+    with pytest.raises(RuntimeError):
+        collection.insert_one({"_id": 1, "n": 5, "m": "bad"})
+    assert collection.version == version
+    assert list(collection.data) == [1]
+    assert collection.indexes["n"].keys == [1]
+    assert collection.indexes["m"].entries == {1: "good"}
+    assert keys(collection, {"n": {"$gte": 0}}) == [1]
+
+
+def test_failed_update_is_undone():
+    collection = failing_collection()
+    with pytest.raises(RuntimeError):
+        collection.update_one({"_id": 1}, {"$set": {"n": 9, "m": "bad"}})
+    assert collection.find_one({"_id": 1}) == {"_id": 1, "n": 1, "m": "good"}
+    assert collection.indexes["n"].values == [1]
+    assert collection.indexes["m"].entries == {1: "good"}
@@ -0,0 +1,81 @@
+"""
+Participant updates: only writes that change the list count as modifications
+"""
+
+import pytest
+
+from backend import records
+from backend.database import InMemoryCollection
+from backend.participants import ParticipantList, normalize_participants
+from backend.records import compact_activity
+
+
+def normalize_compact(doc):
+    record = compact_activity(doc)
+    record.setdefault("participants", [])
+    return record
+
+
+@pytest.fixture(params=[normalize_participants, normalize_compact], ids=["participant-list", "compact"])
+def activities(request):
+    collection = InMemoryCollection({}, normalize=request.param)
+    collection.insert_one({"_id": "Chess Club", "max_participants": 3, "participants": ["a@mergington.edu"]})
+    return collection
+
+
+def changes(collection):
+    seen = []
+    collection.subscribe(lambda operation, key, doc, update: seen.append((operation, key)))
+    return seen
+
+
+@pytest.mark.parametrize("update", [
+    {"$push": {"participants": "a@mergington.edu"}},
+    {"$addToSet": {"participants": "a@mergington.edu"}},
+    {"$pull": {"participants": "b@mergington.edu"}},
+])
+def test_update_that_leaves_participants_unchanged(activities, update):
+    version = activities.version
+    seen = changes(activities)
+    result = activities.update_one({"_id": "Chess Club"}, update)
+    assert (result.matched_count, result.modified_count) == (1, 0)
+    assert activities.version == version
+    assert seen == []
+    assert list(activities.find_one({"_id": "Chess Club"})["participants"]) == ["a@mergington.edu"]
+
+
+def test_push_of_a_new_participant(activities):
+    version = activities.version
+    seen = changes(activities)
+    result = activities.update_one({"_id": "Chess Club"}, {"$push": {"participants": "b@mergington.edu"}})
+    assert result.modified_count == 1
+    assert activities.version == version + 1
+    assert seen == [("update", "Chess Club")]
+    assert list(activities.find_one({"_id": "Chess Club"})["participants"]) == ["a@mergington.edu", "b@mergington.edu"]
+
+
+def test_push_to_a_plain_list_always_appends():
+    collection = InMemoryCollection({})
+    collection.insert_one({"_id": 1, "log": ["x"]})
+    assert collection.update_one({"_id": 1}, {"$push": {"log": "x"}}).modified_count == 1
+    assert collection.update_one({"_id": 1}, {"$push": {"new": "y"}}).modified_count == 1
+    assert collection.find_one({"_id": 1}) == {"_id": 1, "log": ["x", "x"], "new": ["y"]}
+
+
+@pytest.mark.parametrize("size", [records.ID_SET_THRESHOLD - 1, records.ID_SET_THRESHOLD + 5])
+def test_interned_list_membership(size):
+    emails = [f"s{number}@mergington.edu" for number in range(size)]
+    interned = records.InternedParticipantList(emails)
+    plain = ParticipantList(emails)
+    interned.append(emails[0])
+    interned.remove(emails[3])
+    plain.remove(emails[3])
+    interned.append("new@mergington.edu")
+    plain.append("new@mergington.edu")
+    interned.discard(emails[-1])
+    plain.discard(emails[-1])
+    assert interned == plain
+    for email in emails + ["new@mergington.edu", "never@mergington.edu"]:
+        assert (email in interned) == (email in plain), email
+    with pytest.raises(ValueError):
+        interned.remove(emails[3])
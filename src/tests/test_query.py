@@ -0,0 +1,91 @@
+"""
+Query operators: compiled predicates match documents as MongoDB would
+"""
+
+import pytest
+
+from backend.participants import ParticipantList
+from backend.query import compile_query, query_shape
+
+DOCUMENTS = {
+    1: {"name": "Chess", "max": 12, "days": ["Monday", "Friday"], "schedule": {"start": "15:30"}},
+    2: {"name": "Gym", "max": 30, "days": ["Friday"], "schedule": {"start": "06:30"}, "note": None},
+    3: {"name": "Art", "max": 15, "days": [], "schedule": {}},
+    4: {"name": "Math", "days": "Tuesday", "tags": [["x"], {"y": 1}]},
+    5: {"name": "Club", "max": "many", "days": ParticipantList(["Monday"])},
+}
+
+
+def matches(query):
+    predicate = compile_query(query)
+    return sorted(key for key, doc in DOCUMENTS.items() if predicate(doc, key))
+
+
+@pytest.mark.parametrize("query, expected", [
+    ({}, [1, 2, 3, 4, 5]),
+    ({"name": "Chess"}, [1]),
+    ({"name": {"$eq": "Chess"}}, [1]),
+    ({"name": {"$ne": "Chess"}}, [2, 3, 4, 5]),
+    ({"days": "Friday"}, [1, 2]),
+    ({"days": "Monday"}, [1, 5]),
+    ({"days": "Tuesday"}, [4]),
+    ({"days": ["Friday"]}, [2]),
+    ({"days": []}, [3]),
+    ({"tags": ["x"]}, [4]),
+    ({"tags": {"y": 1}}, [4]),
+    ({"note": None}, [1, 2, 3, 4, 5]),
+    ({"max": None}, [4]),
+    ({"name": {"$in": ["Chess", "Art"]}}, [1, 3]),
+    ({"days": {"$in": ["Monday", "Sunday"]}}, [1, 5]),
+    ({"max": {"$in": [None]}}, [4]),
+    ({"tags": {"$in": [["x"]]}}, [4]),
+    ({"days": {"$nin": ["Friday"]}}, [3, 4, 5]),
+    ({"max": {"$gt": 12}}, [2, 3]),
+    ({"max": {"$gte": 12}}, [1, 2, 3]),
+    ({"max": {"$lt": 15}}, [1]),
+    ({"max": {"$lte": 15}}, [1, 3]),
+    ({"max": {"$gt": 12, "$lt": 30}}, [3]),
+    ({"days": {"$gte": "S"}}, [4]),
+    ({"note": {"$exists": True}}, [2]),
+    ({"max": {"$exists": False}}, [4]),
+    ({"days": {"$size": 1}}, [2, 5]),
+    ({"days": {"$size": 0}}, [3]),
+    ({"schedule.start": {"$lt": "12:00"}}, [2]),
+    ({"schedule.start": {"$exists": False}}, [3, 4, 5]),
+    ({"name.first": "C"}, []),
+    ({"_id": 3}, [3]),
+    ({"_id": {"$in": [1, 5]}}, [1, 5]),
+    ({"$and": [{"days": "Friday"}, {"max": {"$lt": 20}}]}, [1]),
+    ({"$or": [{"name": "Art"}, {"days": "Tuesday"}]}, [3, 4]),
+    ({"$nor": [{"name": "Art"}, {"days": "Tuesday"}]}, [1, 2, 5]),
+    ({"$expr": {"$lt": [{"$size": "$days"}, 2]}, "max": {"$exists": True}}, [2, 3, 5]),
+])
+def test_operator(query, expected):
+    assert matches(query) == expected
+
+
+def test_same_shape_with_other_values():
+    assert matches({"days": {"$in": ["Monday"]}}) == [1, 5]
+    assert matches({"days": {"$in": ["Friday"]}}) == [1, 2]
+    assert matches({"max": {"$gt": 20}}) == [2]
+    assert matches({"max": {"$gt": 0}}) == [1, 2, 3]
+
+
+def test_id_stored_outside_the_document():
+    predicate = compile_query({"_id": "Chess Club"})
+    assert predicate({}, "Chess Club")
+    assert not predicate({"_id": "Chess Club"}, "Other")
+    assert predicate({"_id": "Chess Club"})
+
+
+def test_unsupported_operator():
+    with pytest.raises(ValueError, match=r"\$regex"):
+        compile_query({"name": {"$regex": "^C"}})
+
+
+def test_query_shape_hides_values():
+    assert query_shape({"name": "Chess", "max": {"$gt": 3}, "$or": [{"days": ["Monday"]}]}) == {
+        "name": "?",
+        "max": {"$gt": "?"},
+        "$or": [{"days": "?"}],
+    }
@@ -0,0 +1,69 @@
+"""
+Password reset tokens: issued and redeemed atomically
+"""
+
+import asyncio
+import itertools
+
+from backend import database
+
+emails = (f"reset{number}@mergington.edu" for number in itertools.count())
+
+
+def new_student():
+    email = next(emails)
+    database.students_collection.insert_one({"_id": email, "name": "Reset Test", "password": "-"})
+    return email
+
+
+def stored_tokens(email):
+    return database.students_collection.find_one({"_id": email}).get("password_reset_tokens", [])
+
+
+def test_token_is_redeemed_once():
+    email = new_student()
+
+    async def run():
+        token = await database.store_reset_token(email, database.generate_reset_token())
+        return await asyncio.gather(*(database.redeem_reset_token(token) for _ in range(5)))
+
+    results = asyncio.run(run())
+    assert results.count(email) == 1
+    assert results.count(None) == 4
+    assert stored_tokens(email) == []
+
+
+def test_unknown_token_is_not_redeemed():
+    assert asyncio.run(database.redeem_reset_token("not-a-token")) is None
+
+
+def test_change_made_between_read_and_write_is_kept():
+    email = new_student()
+    other = {"token": "other", "expires_at": 2 ** 50}
+    calls = []
+
+    def change(entries):
+        calls.append(list(entries))
+        if len(calls) == 1:
+            # Another request stores a token after this one read the list
+            database.students_collection.update_one({"_id": email}, {"$set": {"password_reset_tokens": [other]}})
+        return entries + [{"token": "mine", "expires_at": 2 ** 50}]
+
+    asyncio.run(database._update_reset_tokens(email, change))
+    assert calls == [[], [other]]
+    assert [entry["token"] for entry in stored_tokens(email)] == ["other", "mine"]
+
+
+def test_expired_tokens_are_dropped_and_at_most_three_kept():
+    email = new_student()
+    database.students_collection.update_one(
+        {"_id": email}, {"$set": {"password_reset_tokens": [{"token": "old", "expires_at": 1}]}}
+    )
+
+    async def run():
+        return [await database.store_reset_token(email, database.generate_reset_token()) for _ in range(4)]
+
+    tokens = asyncio.run(run())
+    assert len(stored_tokens(email)) == database.RESET_TOKENS_PER_STUDENT
+    assert database.validate_reset_token(tokens[0]) is None
+    assert database.validate_reset_token(tokens[-1]) == email
@@ -0,0 +1,36 @@
+"""
+Session tokens: malformed ones are rejected with 401, never a server error
+"""
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import app
+from backend.sessions import InvalidSession, session_manager
+
+client = TestClient(app)
+
+
+@pytest.mark.parametrize("token", [
+    "no-dot",
+    "a.b.c",
+    "e30.\xe9\xe9",
+    "\xe9\xe9.\xe9\xe9",
+    "e30.AAAA",
+])
+def test_malformed_token_is_invalid(token):
+    with pytest.raises(InvalidSession):
+        session_manager._decode(token)
+
+
+@pytest.mark.parametrize("path", ["/auth/check-session", "/auth/check-student-session"])
+def test_non_ascii_bearer_token_gets_401(path):
+    response = client.get(path, headers={"Authorization": b"Bearer abc.\xe9\xe9\xe9"})
+    assert response.status_code == 401
+
+
+def test_valid_token_still_accepted():
+    login = client.post("/auth/login", params={"username": "mchen", "password": "chess456"})
+    token = login.json()["token"]
+    response = client.get("/auth/check-session", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
@@ -0,0 +1,90 @@
+"""
+Shared storage: several processes writing to one data directory
+
+Run from the src directory:
+
+    python -m pytest tests
+"""
+
+import asyncio
+import multiprocessing
+
+import pytest
+
+from backend.async_collection import AsyncCollection
+from backend.database import InMemoryCollection
+from backend.storage import StorageEngine, fcntl
+
+PROCESSES = 4
+WRITES = 30
+CAPACITY = 50
+# Small enough that the log is rotated many times while the processes write
+SNAPSHOT_EVERY = 7
+
+pytestmark = pytest.mark.skipif(fcntl is None, reason="shared mode needs fcntl")
+
+
+def open_storage(directory):
+    collection = InMemoryCollection({})
+    storage = StorageEngine(directory, shared=True, snapshot_every=SNAPSHOT_EVERY, poll_interval=0.01)
+    storage.attach("activities", collection)
+    storage.open()
+    return collection, storage
+
+
+def writes(process):
+    """(filter, update) pairs of one process: a signup and an unconditional $push each"""
+    for number in range(WRITES):
+        email = f"student{process}-{number}@mergington.edu"
+        yield {
+            "_id": "club",
+            "participants": {"$ne": email},
+            "$expr": {"$lt": [{"$size": "$participants"}, "$max_participants"]},
+        }, {"$addToSet": {"participants": email}}
+        yield {"_id": "log"}, {"$push": {"entries": email}}
+
+
+def write(directory, process, use_async):
+    collection, storage = open_storage(directory)
+    try:
+        if use_async:
+            async def run():
+                storage.bind_loop(asyncio.get_running_loop())
+                activities = AsyncCollection(collection)
+                await asyncio.gather(*(activities.update_one(*pair) for pair in writes(process)))
+            asyncio.run(run())
+        else:
+            for pair in writes(process):
+                collection.update_one(*pair)
+    finally:
+        storage.close()
+
+
+@pytest.mark.parametrize("use_async", [False, True], ids=["sync", "async"])
+def test_processes_share_writes(tmp_path, use_async):
+    directory = str(tmp_path)
+    collection, storage = open_storage(directory)
+    collection.insert_one({"_id": "club", "max_participants": CAPACITY, "participants": []})
+    collection.insert_one({"_id": "log", "entries": []})
+    storage.close()
+
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=write, args=(directory, process, use_async)) for process in range(PROCESSES)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+
+    collection, storage = open_storage(directory)
+    try:
+        # No record lost or applied twice across the rotations
+        entries = collection.find_one({"_id": "log"})["entries"]
+        assert len(entries) == PROCESSES * WRITES
+        assert len(set(entries)) == len(entries)
+        # Capacity checks saw every earlier signup, whichever process made it
+        participants = collection.find_one({"_id": "club"})["participants"]
+        assert len(participants) == CAPACITY
+        assert len(set(participants)) == CAPACITY
+    finally:
+        storage.close()
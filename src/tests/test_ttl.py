@@ -0,0 +1,126 @@
+"""
+TTLStore: entries expire, and the store stays bounded
+"""
+
+import pytest
+
+from backend.ttl import TTLStore
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def store(clock, **options):
+    return TTLStore(ttl=10, background=False, clock=clock, **options)
+
+
+def test_entry_expires(clock):
+    tokens = store(clock)
+    tokens.set("a", 1)
+    clock.now += 9.9
+    assert tokens.get("a") == 1
+    assert "a" in tokens
+    clock.now += 0.1
+    assert tokens.get("a") is None
+    assert tokens.get("a", "gone") == "gone"
+    assert "a" not in tokens
+    assert len(tokens) == 0
+    assert tokens.stats()["expired_total"] == 1
+
+
+def test_ttl_per_entry(clock):
+    tokens = store(clock)
+    tokens.set("short", 1, ttl=1)
+    tokens.set("long", 2)
+    clock.now += 1
+    assert tokens.get("short") is None
+    assert tokens.get("long") == 2
+
+
+def test_set_again_extends_expiry(clock):
+    tokens = store(clock)
+    tokens.set("a", 1)
+    clock.now += 8
+    tokens.set("a", 2)
+    clock.now += 8
+    assert tokens.get("a") == 2
+    assert tokens.sweep() == 0
+    clock.now += 2
+    assert tokens.sweep() == 1
+    assert len(tokens) == 0
+
+
+def test_pop_expired_returns_default(clock):
+    tokens = store(clock)
+    tokens.set("a", 1)
+    tokens.set("b", 2)
+    assert tokens.pop("a") == 1
+    assert tokens.pop("a") is None
+    clock.now += 10
+    assert tokens.pop("b", "gone") == "gone"
+    assert len(tokens) == 0
+
+
+def test_sweep_in_batches(clock):
+    tokens = store(clock, sweep_batch=3)
+    for key in range(8):
+        tokens.set(key, key)
+    tokens.set("later", 1, ttl=20)
+    clock.now += 10
+    assert tokens.sweep() == 3
+    assert tokens.sweep(limit=10) == 5
+    assert tokens.sweep() == 0
+    assert len(tokens) == 1
+    assert tokens.stats()["expired_total"] == 8
+
+
+def test_set_sweeps_a_few_expired_entries(clock):
+    tokens = store(clock)
+    for key in range(10):
+        tokens.set(key, key)
+    clock.now += 10
+    tokens.set("new", 1)
+    assert len(tokens) == 10 - 4 + 1
+
+
+def test_cap_per_owner_drops_oldest(clock):
+    tokens = store(clock, max_per_owner=2)
+    for key in ("a", "b", "c"):
+        tokens.set(key, key, owner="alex")
+        clock.now += 1
+    tokens.set("d", "d", owner="sam")
+    assert [key for key in "abcd" if key in tokens] == ["b", "c", "d"]
+    assert tokens.stats()["evicted_total"] == 1
+    tokens.discard_owner("alex")
+    assert [key for key in "abcd" if key in tokens] == ["d"]
+    assert tokens.stats()["owners"] == 1
+
+
+def test_cap_on_store_drops_earliest_expiry(clock):
+    tokens = store(clock, max_entries=3)
+    tokens.set("a", 1, ttl=30)
+    tokens.set("b", 2, ttl=5)
+    tokens.set("c", 3, ttl=20)
+    tokens.set("b", 2, ttl=40)
+    tokens.set("d", 4)
+    assert sorted(key for key in "abcd" if key in tokens) == ["a", "b", "d"]
+    assert len(tokens) == 3
+
+
+def test_heap_is_rebuilt_when_mostly_stale(clock):
+    tokens = store(clock)
+    for _ in range(500):
+        tokens.set("a", 1)
+    stats = tokens.stats()
+    assert stats["entries"] == 1
+    assert stats["heap_size"] <= 2 * stats["entries"] + 65